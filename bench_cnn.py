@@ -0,0 +1,176 @@
+"""
+Check and time the CNN encoder variants of pair_models.build_cnn.
+
+    python bench_cnn.py --batch-size 2048 --steps 20
+    python bench_cnn.py --fold-dir cache/cv1/
+
+    unfused    one Conv1D/MaxPooling1D tower per filter width and question
+    fused      the first convolutions of all the widths as one convolution
+    shared     fused, one weight-tied tower over both questions as one batch
+
+The weights of the unfused model are copied into the others (the question 1
+tower for the shared one, so the unfused reference gets both towers equal)
+and the largest difference of the predictions is reported with the
+parameter count, the predicted pairs/s and the trained samples/s on CPU.
+For the shared variant the pairs/s of predict_pairs_encoded, which encodes
+each unique question once and reuses it across pairs, is reported as well.
+Without --fold-dir the pairs are drawn from a pool of --n-questions random
+questions and the embedding matrix is random.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import time
+import argparse
+import numpy as np
+
+from keras import backend as K
+from keras.layers import Conv1D
+
+import pair_data
+import pair_models
+import train_pair
+import checkpoint
+
+
+VARIANTS = (('unfused', {'fused': False, 'shared': False}),
+            ('fused', {'fused': True, 'shared': False}),
+            ('shared', {'fused': True, 'shared': True}))
+
+
+#
+# Weights
+# ----------------------------------------------------------------------------
+def _layer(model, name):
+    for layer in checkpoint.flat_layers(model):
+        if layer.name == name:
+            return layer
+    return None
+
+
+def copy_cnn_weights(src, dst, params, src_prefix, dst_prefix):
+    # One tower of the unfused model src into one tower of dst, the filters
+    # of each width stacked into the fused kernel
+    num_filters = params['num_filters']
+    fused = _layer(dst, dst_prefix + 'conv1_fused')
+    if fused is not None:
+        kernel, bias = [np.zeros_like(w) for w in fused.get_weights()]
+        for w, ks in enumerate(params['filter_sizes']):
+            k, b = _layer(src, src_prefix + 'conv1_w%d' % ks).get_weights()
+            kernel[:ks, :, w * num_filters:(w + 1) * num_filters] = k
+            bias[w * num_filters:(w + 1) * num_filters] = b
+        fused.set_weights([kernel, bias])
+    else:
+        for ks in params['filter_sizes']:
+            _layer(dst, dst_prefix + 'conv1_w%d' % ks).set_weights(
+                _layer(src, src_prefix + 'conv1_w%d' % ks).get_weights())
+    for ks in params['filter_sizes']:
+        _layer(dst, dst_prefix + 'conv2_w%d' % ks).set_weights(
+            _layer(src, src_prefix + 'conv2_w%d' % ks).get_weights())
+
+
+def copy_head_weights(src, dst):
+    # Embedding and classifier, in the same order in every variant
+    head = lambda m: [l for l in checkpoint.flat_layers(m) if l.weights and not isinstance(l, Conv1D)]
+    for a, b in zip(head(src), head(dst)):
+        b.set_weights(a.get_weights())
+
+
+#
+# Timing
+# ----------------------------------------------------------------------------
+def predict_speed(model, data_1, data_2, batch_size, encoded=False):
+    # Both question orders, as train_pair predicts them
+    predict = train_pair.predict_pairs_encoded if encoded else train_pair.predict_pairs
+    predict(model, data_1[:batch_size], data_2[:batch_size], batch_size, verbose=0)
+    start = time.time()
+    predict(model, data_1, data_2, batch_size, verbose=0)
+    return len(data_1) / (time.time() - start)
+
+
+def train_speed(model, data_1, data_2, labels, batch_size, steps):
+    train_pair.compile_model(model)
+    model.train_on_batch([data_1[:batch_size], data_2[:batch_size]], labels[:batch_size])
+    start = time.time()
+    for i in range(steps):
+        j = (i * batch_size) % max(len(data_1) - batch_size, 1)
+        model.train_on_batch([data_1[j:j + batch_size], data_2[j:j + batch_size]], labels[j:j + batch_size])
+    return steps * batch_size / (time.time() - start)
+
+
+def random_fold(n_pairs, n_questions, vocab_size, max_sequence_length, rng):
+    # Left-padded like pad_sequences, 4 to max_sequence_length words
+    lengths = rng.randint(4, max_sequence_length + 1, n_questions)
+    questions = rng.randint(1, vocab_size, (n_questions, max_sequence_length)).astype(np.int32)
+    questions[np.arange(max_sequence_length)[None, :] < (max_sequence_length - lengths)[:, None]] = 0
+    data_1 = questions[rng.randint(0, n_questions, n_pairs)]
+    data_2 = questions[rng.randint(0, n_questions, n_pairs)]
+    embedding_matrix = rng.normal(0, 0.1, (vocab_size, pair_data.EMBEDDING_DIM)).astype(np.float32)
+    labels = rng.randint(0, 2, n_pairs)
+    return data_1, data_2, labels, embedding_matrix
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Check and time the CNN encoder variants.')
+    parser.add_argument('--fold-dir', help='fold cache of pair_data.prepare_fold, random pairs otherwise')
+    parser.add_argument('--n-pairs', type=int, default=20000)
+    parser.add_argument('--n-questions', type=int, default=30000)
+    parser.add_argument('--vocab-size', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=2048)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    max_sequence_length = pair_data.MAX_SEQUENCE_LENGTH
+    if args.fold_dir:
+        data = pair_data.load_fold(args.fold_dir)
+        max_sequence_length = data['meta']['max_sequence_length']
+        data_1 = np.asarray(data['train_data_1'][:args.n_pairs])
+        data_2 = np.asarray(data['train_data_2'][:args.n_pairs])
+        labels = np.asarray(data['train_labels'][:args.n_pairs])
+        embedding_matrix = data['embedding_matrix']
+    else:
+        data_1, data_2, labels, embedding_matrix = random_fold(args.n_pairs, args.n_questions, args.vocab_size,
+                                                               max_sequence_length, rng)
+
+    params = pair_models.sample_params('cnn', rng)
+    reference = pair_models.build_model('cnn', embedding_matrix, dict(params, fused=False, shared=False),
+                                        max_sequence_length)
+    # Both towers equal, so that the shared variant computes the same function
+    copy_cnn_weights(reference, reference, params, 'q1_', 'q2_')
+    ref_preds = train_pair.predict_pairs(reference, data_1, data_2, args.batch_size, verbose=0)
+    ref_weights = reference.get_weights()
+
+    print('%-8s %12s %12s %12s %14s %16s' % ('', 'params', 'max |diff|', 'pairs/s', 'train samp/s',
+                                            'reused pairs/s'))
+    for name, variant in VARIANTS:
+        K.clear_session()
+        reference = pair_models.build_model('cnn', embedding_matrix, dict(params, fused=False, shared=False),
+                                            max_sequence_length)
+        reference.set_weights(ref_weights)
+        model = pair_models.build_model('cnn', embedding_matrix, dict(params, **variant), max_sequence_length)
+        copy_head_weights(reference, model)
+        copy_cnn_weights(reference, model, params, 'q1_', '' if variant['shared'] else 'q1_')
+        if not variant['shared']:
+            copy_cnn_weights(reference, model, params, 'q2_', 'q2_')
+
+        diff = np.max(np.abs(train_pair.predict_pairs(model, data_1, data_2, args.batch_size, verbose=0) - ref_preds))
+        reused = '-'
+        if variant['shared']:
+            encoded = train_pair.predict_pairs_encoded(model, data_1, data_2, args.batch_size, verbose=0)
+            diff = max(diff, np.max(np.abs(encoded - ref_preds)))
+            reused = '%.0f' % predict_speed(model, data_1, data_2, args.batch_size, encoded=True)
+        speed = predict_speed(model, data_1, data_2, args.batch_size)
+        print('%-8s %12d %12.2e %12.0f %14.0f %16s' % (
+            name, model.count_params(), diff, speed,
+            train_speed(model, data_1, data_2, labels, args.batch_size, args.steps), reused))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Sweep the threading settings of runtime_config.py and record the best per host.
+
+    python bench_threads.py --models lstm cnn --batch-size 2048 --steps 10
+
+For every model, profile and number of cores (powers of two up to all the
+allowed cores), each combination of inter-op threads and KMP_BLOCKTIME is
+timed in a fresh process pinned to those cores, with as many intra-op
+threads as cores: training steps for the 'train' profile, batches of
+--predict-batch-size pairs for 'inference'. The data are random pairs
+(bench_cnn.random_fold).
+
+The best setting of each (model, profile, cores) is merged into
+runtime_config.SETTINGS_FILE under the host name, where configure() picks
+it up. Every measurement goes to --out (bench_threads.jsonl).
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import socket
+import argparse
+import traceback
+
+import cv_runner
+import runtime_config
+
+
+INTER_OP = (1, 2, 4)
+KMP_BLOCKTIME = (0, 1, 200)
+
+
+#
+# One measurement
+# ----------------------------------------------------------------------------
+def measure(model_name, profile, n_pairs, batch_size, predict_batch_size, steps):
+    import numpy as np
+    import bench_cnn
+    import pair_data
+    import pair_models
+
+    rng = np.random.RandomState(0)
+    data_1, data_2, labels, embedding_matrix = bench_cnn.random_fold(n_pairs, n_pairs, 20000,
+                                                                     pair_data.MAX_SEQUENCE_LENGTH, rng)
+    model = pair_models.build_model(model_name, embedding_matrix, pair_models.sample_params(model_name, rng))
+    if profile == 'train':
+        return bench_cnn.train_speed(model, data_1, data_2, labels, batch_size, steps)
+    return bench_cnn.predict_speed(model, data_1, data_2, predict_batch_size)
+
+
+def _bench_worker(key, job, cpus, queue):
+    try:
+        start = time.time()
+        settings = runtime_config.configure(job['profile'], job['cpus'], inter_op=job['inter_op'],
+                                            kmp_blocktime=job['kmp_blocktime'])
+        speed = measure(job['model'], job['profile'], job['n_pairs'], job['batch_size'],
+                        job['predict_batch_size'], job['steps'])
+        queue.put((key, dict(settings, samples_per_sec=speed, wall=time.time() - start), None))
+    except Exception:
+        queue.put((key, None, traceback.format_exc()))
+
+
+#
+# Sweep
+# ----------------------------------------------------------------------------
+def core_counts(n):
+    counts = []
+    c = 1
+    while c < n:
+        counts.append(c)
+        c *= 2
+    return counts + [n]
+
+
+def sweep(models, profiles, cpus, n_pairs, batch_size, predict_batch_size, steps, out_path):
+    jobs = []
+    for model in models:
+        for profile in profiles:
+            for n in core_counts(len(cpus)):
+                for inter_op in INTER_OP:
+                    if inter_op > n:
+                        continue
+                    for blocktime in KMP_BLOCKTIME:
+                        key = '%s/%s/%d/%d/%d' % (model, profile, n, inter_op, blocktime)
+                        jobs.append((key, {'model': model, 'profile': profile, 'cpus': cpus[:n],
+                                           'inter_op': inter_op, 'kmp_blocktime': blocktime,
+                                           'n_pairs': n_pairs, 'batch_size': batch_size,
+                                           'predict_batch_size': predict_batch_size, 'steps': steps}))
+
+    # One slot over all the cores: the measurements run one at a time
+    results = cv_runner.run_jobs(jobs, _bench_worker, [cpus])
+
+    best = {}
+    with open(out_path, 'a') as f:
+        for key, job in jobs:
+            result, error = results[key]
+            if error:
+                continue
+            record = dict(result, model=job['model'], host=socket.gethostname())
+            f.write(json.dumps(record) + '\n')
+            slot = best.setdefault(job['model'], {}).setdefault(job['profile'], {})
+            n = str(len(job['cpus']))
+            if n not in slot or result['samples_per_sec'] > slot[n]['samples_per_sec']:
+                slot[n] = dict((k, result[k]) for k in ('intra_op', 'inter_op', 'kmp_blocktime', 'kmp_affinity',
+                                                        'samples_per_sec'))
+    return best
+
+
+def record_best(best, path=runtime_config.SETTINGS_FILE):
+    settings = runtime_config.load_settings(path)
+    host = settings.setdefault(socket.gethostname(), {})
+    for model, profiles in best.items():
+        for profile, counts in profiles.items():
+            host.setdefault(model, {}).setdefault(profile, {}).update(counts)
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'w') as f:
+        json.dump(settings, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Sweep the threading settings and record the best per host.')
+    parser.add_argument('--models', nargs='+', choices=('lstm', 'cnn', 'advanced_lstm'), default=['lstm', 'cnn'])
+    parser.add_argument('--profiles', nargs='+', choices=sorted(runtime_config.PROFILES),
+                        default=sorted(runtime_config.PROFILES))
+    parser.add_argument('--n-pairs', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=2048)
+    parser.add_argument('--predict-batch-size', type=int, default=256)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--out', default='bench_threads.jsonl')
+    parser.add_argument('--settings', default=runtime_config.SETTINGS_FILE)
+    args = parser.parse_args()
+
+    cpus = runtime_config.allowed_cpus()
+    best = sweep(args.models, args.profiles, cpus, args.n_pairs, args.batch_size, args.predict_batch_size,
+                 args.steps, args.out)
+    record_best(best, args.settings)
+
+    print('%-14s %-10s %5s %6s %6s %10s %12s' % ('model', 'profile', 'cores', 'intra', 'inter', 'blocktime',
+                                                 'samples/s'))
+    for model in sorted(best):
+        for profile in sorted(best[model]):
+            for n in sorted(best[model][profile], key=int):
+                s = best[model][profile][n]
+                print('%-14s %-10s %5s %6d %6d %10d %12.0f' % (model, profile, n, s['intra_op'], s['inter_op'],
+                                                               s['kmp_blocktime'], s['samples_per_sec']))
+    print('Recorded in %s for %s' % (args.settings, socket.gethostname()))
+
+
+if __name__ == '__main__':
+    main()
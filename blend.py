@@ -0,0 +1,142 @@
+"""
+Streaming blend of submission files.
+
+    python blend.py 0.2950_lstm_*.csv 0.3012_2l_cnn_*.csv --method logit --out blend.csv.gz
+    python blend.py a.csv b.csv c.csv --oof oof_a.csv oof_b.csv oof_c.csv --method mean --out blend.csv
+
+The submissions (test_id, is_duplicate) are read side by side in chunks of
+--chunksize rows, checked to be row-aligned on test_id, blended and appended
+to --out, so memory stays bounded by the chunk size whatever the number of
+files. Output ending in .gz is gzipped.
+
+Methods, with weights w summing to 1:
+    mean       sum(w * p)
+    geometric  prod(p ** w)
+    logit      sigmoid(sum(w * logit(p)))
+The weights are given with --weights, learned with --oof (the out-of-fold
+prediction files of the same models, as written by cv_runner.py, by
+minimising the weighted logloss of the blend), or equal by default.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import gzip
+import argparse
+import numpy as np
+import pandas as pd
+
+import rebalance
+
+
+EPS = 1e-15
+
+
+#
+# Blending
+# ----------------------------------------------------------------------------
+def blend(preds, weights, method='mean'):
+    # preds: (n_models, n_rows) probabilities
+    preds = np.clip(np.asarray(preds, dtype=np.float64), EPS, 1 - EPS)
+    weights = np.asarray(weights, dtype=np.float64)[:, None]
+    if method == 'mean':
+        return (weights * preds).sum(axis=0)
+    if method == 'geometric':
+        return np.exp((weights * np.log(preds)).sum(axis=0))
+    if method == 'logit':
+        z = (weights * np.log(preds / (1 - preds))).sum(axis=0)
+        return 1. / (1. + np.exp(-z))
+    raise ValueError('Unknown blend method %r' % method)
+
+
+def _logloss(labels, preds, sample_weights):
+    preds = np.clip(preds, EPS, 1 - EPS)
+    losses = -(labels * np.log(preds) + (1 - labels) * np.log(1 - preds))
+    return np.sum(sample_weights * losses) / np.sum(sample_weights)
+
+
+def learn_weights(oof_paths, method='mean', re_weight=True):
+    # Weights on the simplex minimising the weighted logloss of the blended
+    # out-of-fold predictions (files with id, is_duplicate, pred)
+    from scipy.optimize import minimize
+
+    merged = None
+    for i, path in enumerate(oof_paths):
+        oof = pd.read_csv(path, usecols=['id', 'is_duplicate', 'pred']).rename(columns={'pred': 'pred%d' % i})
+        merged = oof if merged is None else merged.merge(oof.drop('is_duplicate', axis=1), on='id')
+    labels = merged['is_duplicate'].values
+    preds = merged[['pred%d' % i for i in range(len(oof_paths))]].values.T
+    sample_weights = rebalance.class_weights(labels, re_weight)
+
+    n = len(oof_paths)
+    result = minimize(lambda w: _logloss(labels, blend(preds, w, method), sample_weights),
+                      np.ones(n) / n, method='SLSQP', bounds=[(0., 1.)] * n,
+                      constraints=({'type': 'eq', 'fun': lambda w: np.sum(w) - 1.},))
+    weights = np.clip(result.x, 0., 1.)
+    weights /= weights.sum()
+
+    for path, w, p in zip(oof_paths, weights, preds):
+        print('%6.3f  %.4f  %s' % (w, _logloss(labels, p, sample_weights), path))
+    print('Blended OOF logloss: %.4f (%d rows)' % (_logloss(labels, blend(preds, weights, method), sample_weights),
+                                                   len(labels)))
+    return weights
+
+
+#
+# Streaming
+# ----------------------------------------------------------------------------
+def stream_blend(paths, out_path, weights=None, method='mean', chunksize=200000):
+    weights = np.ones(len(paths)) / len(paths) if weights is None else np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.sum()
+
+    readers = [pd.read_csv(path, chunksize=chunksize, usecols=['test_id', 'is_duplicate']) for path in paths]
+    opener = gzip.open if out_path.endswith('.gz') else open
+    n_rows = 0
+    with opener(out_path, 'wt') as out:
+        out.write('test_id,is_duplicate\n')
+        while True:
+            chunks = [next(reader, None) for reader in readers]
+            if all(chunk is None for chunk in chunks):
+                break
+            if any(chunk is None for chunk in chunks):
+                short = [path for path, chunk in zip(paths, chunks) if chunk is None]
+                raise ValueError('%s end before row %d' % (', '.join(short), n_rows))
+            test_id = chunks[0]['test_id'].values
+            for path, chunk in zip(paths[1:], chunks[1:]):
+                if len(chunk) != len(test_id) or not np.array_equal(chunk['test_id'].values, test_id):
+                    raise ValueError('%s is not row-aligned with %s near row %d' % (path, paths[0], n_rows))
+            preds = blend([chunk['is_duplicate'].values for chunk in chunks], weights, method)
+            pd.DataFrame({'test_id': test_id, 'is_duplicate': preds}).to_csv(
+                out, header=False, index=False, columns=['test_id', 'is_duplicate'])
+            n_rows += len(test_id)
+    print('Blended %d rows of %d files into %s' % (n_rows, len(paths), out_path))
+    return n_rows
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Blend submission files in bounded memory.')
+    parser.add_argument('submissions', nargs='+')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--method', choices=('mean', 'geometric', 'logit'), default='mean')
+    parser.add_argument('--weights', type=float, nargs='+')
+    parser.add_argument('--oof', nargs='+', help='out-of-fold files of the same models, to learn the weights')
+    parser.add_argument('--chunksize', type=int, default=200000)
+    args = parser.parse_args()
+
+    weights = args.weights
+    if args.oof:
+        if len(args.oof) != len(args.submissions):
+            parser.error('--oof needs one file per submission')
+        weights = learn_weights(args.oof, args.method)
+    if weights is not None and len(weights) != len(args.submissions):
+        parser.error('--weights needs one weight per submission')
+
+    stream_blend(args.submissions, args.out, weights, args.method, args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
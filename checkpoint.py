@@ -0,0 +1,199 @@
+"""
+Resumable training checkpoints for the pair models.
+
+ResumableCheckpoint replaces ModelCheckpoint(save_best_only=True): at the end
+of every epoch it atomically rewrites
+    <STAMP>.h5    best weights so far (same file as before)
+    <STAMP>.ckpt  full training state: layer weights, optimizer weights, next
+                  epoch, early-stopping counters, numpy/python RNG state, the
+                  sampled hyperparameters and the history so far
+A killed job started again with the same out_dir picks up the .ckpt and goes
+on from the next epoch with the same optimizer moments and shuffling order.
+
+Next to it <STAMP>.ckpt.json holds the epoch, best score, finished flag
+and run info, so find_checkpoint() picks a checkpoint without unpickling
+every .ckpt of the directory.
+
+Frozen embedding layers, nested sub-models included, are left out of the
+.ckpt, they are rebuilt from the fold artifacts. Dropout masks are drawn by the TF graph seed and are not part
+of the restored state.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import glob
+import json
+import pickle
+import random
+import numpy as np
+
+from keras.callbacks import Callback
+from keras.layers import Embedding
+
+
+#
+# Atomic writes
+# ----------------------------------------------------------------------------
+def atomic_save_weights(model, path):
+    # Written next to the target and renamed, so a crash mid-write keeps the
+    # previous best model intact
+    tmp_path = path + '.tmp%d' % os.getpid()
+    model.save_weights(tmp_path, overwrite=True)
+    os.replace(tmp_path, path)
+
+
+def atomic_pickle(obj, path):
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def atomic_json(obj, path):
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+#
+# Training state
+# ----------------------------------------------------------------------------
+def _is_frozen_embedding(layer):
+    return isinstance(layer, Embedding) and not layer.trainable
+
+
+def flat_layers(model):
+    # Layers of the nested models (the shared 'encoder' and 'head') included
+    layers = []
+    for layer in model.layers:
+        layers.extend(flat_layers(layer) if hasattr(layer, 'layers') else [layer])
+    return layers
+
+
+def get_state(model):
+    # Weights by layer position, optimizer slots and RNG state
+    return {'layer_weights': [None if _is_frozen_embedding(layer) else layer.get_weights()
+                              for layer in flat_layers(model)],
+            'optimizer_weights': model.optimizer.get_weights(),
+            'rng': {'numpy': np.random.get_state(), 'python': random.getstate()}}
+
+
+def set_state(model, state):
+    layers = flat_layers(model)
+    if len(layers) != len(state['layer_weights']):
+        raise ValueError('Checkpoint of %d layers for a model of %d' % (len(state['layer_weights']), len(layers)))
+    for layer, weights in zip(layers, state['layer_weights']):
+        if weights is not None:
+            layer.set_weights(weights)
+
+    # The optimizer slots only exist once the training function is built
+    model._make_train_function()
+    model.optimizer.set_weights(state['optimizer_weights'])
+
+    np.random.set_state(state['rng']['numpy'])
+    random.setstate(state['rng']['python'])
+
+
+def summary_path(ckpt_path):
+    return ckpt_path + '.json'
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def find_checkpoint(out_dir, arch=None, test_CVID=None):
+    # Latest unfinished .ckpt in out_dir, optionally of one model and fold,
+    # going by the .ckpt.json summaries, only the chosen .ckpt is unpickled
+    found = None
+    for path in sorted(glob.glob(os.path.join(out_dir, '*.ckpt')), key=os.path.getmtime):
+        if os.path.exists(summary_path(path)):
+            with open(summary_path(path)) as f:
+                summary = json.load(f)
+        else:
+            summary = load_checkpoint(path)
+        if summary.get('finished'):
+            continue
+        if arch is not None and summary.get('arch') != arch:
+            continue
+        if test_CVID is not None and summary.get('test_CVID') != test_CVID:
+            continue
+        found = path
+    return None if found is None else (found, load_checkpoint(found))
+
+
+#
+# Callback
+# ----------------------------------------------------------------------------
+class ResumableCheckpoint(Callback):
+
+    def __init__(self, ckpt_path, bst_model_path, early_stopping=None, state=None, monitor='val_loss', info=None):
+        super(ResumableCheckpoint, self).__init__()
+        self.ckpt_path = ckpt_path
+        self.bst_model_path = bst_model_path
+        self.early_stopping = early_stopping
+        self.monitor = monitor
+
+        # Anything else to keep with the state (arch, fold, params)
+        self.info = info or {}
+
+        # State loaded from a previous run, restored at on_train_begin
+        self.resume_state = state
+        self.best = np.inf
+        self.history = {}
+
+    def on_train_begin(self, logs=None):
+        # Runs after EarlyStopping.on_train_begin (callback order), which
+        # would otherwise reset the restored counters
+        state = self.resume_state
+        if state is None:
+            return
+        set_state(self.model, state)
+        self.best = state['best']
+        self.history = state['history']
+        if self.early_stopping is not None:
+            self.early_stopping.wait = state['early_stopping']['wait']
+            self.early_stopping.best = state['early_stopping']['best']
+        self.resume_state = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        for k, v in logs.items():
+            self.history.setdefault(k, []).append(float(v))
+
+        current = logs.get(self.monitor)
+        if current is not None and current < self.best:
+            self.best = float(current)
+            atomic_save_weights(self.model, self.bst_model_path)
+
+        state = get_state(self.model)
+        state.update(self.info)
+        state.update({'epoch': epoch + 1,
+                      'best': self.best,
+                      'history': self.history,
+                      'finished': False})
+        if self.early_stopping is not None:
+            state['early_stopping'] = {'wait': self.early_stopping.wait, 'best': self.early_stopping.best}
+        atomic_pickle(state, self.ckpt_path)
+        self._write_summary(state)
+
+    def on_train_end(self, logs=None):
+        # Only the summary is rewritten, find_checkpoint goes by it
+        path = summary_path(self.ckpt_path)
+        if os.path.exists(path):
+            with open(path) as f:
+                summary = json.load(f)
+            summary['finished'] = True
+            atomic_json(summary, path)
+
+    def _write_summary(self, state):
+        summary = dict((k, state[k]) for k in ('epoch', 'best', 'finished'))
+        summary.update(self.info)
+        atomic_json(summary, summary_path(self.ckpt_path))
@@ -0,0 +1,249 @@
+"""
+Train every CV fold of one pair model in parallel worker processes.
+
+    python cv_runner.py --model lstm --folds 0 1 2 3 4 --out-dir cv_lstm/
+
+The fold artifacts are prepared once in this process (one GoogleNews load
+for all folds) and memory-mapped by the workers. Each worker is pinned to its
+own set of cores with TF/OMP thread pools of the same size, and the number of
+concurrent folds is chosen to minimise the estimated wall-clock time.
+
+The report (cv_report.json), the out-of-fold predictions of all folds
+(oof_<STAMP>.csv) and the fold-averaged test submission are written to
+--out-dir. Folds whose configuration (data, model, parameters, seed and
+training options) is already in --registry are not trained again, their
+recorded results are used (see run_registry.py).
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from queue import Empty
+import numpy as np
+import pandas as pd
+
+import data_paths
+import run_registry
+import runtime_config
+import submission
+
+
+#
+# Pack folds onto cores
+# ----------------------------------------------------------------------------
+def available_cpus():
+    return runtime_config.allowed_cpus()
+
+
+def plan_slots(n_jobs, cpus, min_threads=1, scaling=0.7):
+    # Splits the cores into disjoint equal sets, one per concurrently running
+    # job. A job on t threads is assumed to run t ** scaling times faster than
+    # on one, so the estimated wall time of s slots is
+    #     ceil(n_jobs / s) / (len(cpus) // s) ** scaling
+    best = None
+    for n_slots in range(1, min(n_jobs, len(cpus) // min_threads) + 1):
+        threads = len(cpus) // n_slots
+        wall = np.ceil(n_jobs / float(n_slots)) / threads ** scaling
+        if best is None or wall < best[0] - 1e-9:
+            best = (wall, n_slots, threads)
+
+    if best is None:
+        return [list(cpus)]
+    _, n_slots, threads = best
+    return [list(cpus[i * threads:(i + 1) * threads]) for i in range(n_slots)]
+
+
+def pin_process(cpus, model=None):
+    # Must run before tensorflow is imported in the process, threads and
+    # affinity as set by runtime_config for these cores
+    return runtime_config.configure('train', cpus, model)
+
+
+#
+# Worker processes
+# ----------------------------------------------------------------------------
+def run_jobs(jobs, target, slots):
+    # Runs target(key, job, cpus, queue) for every (key, job) in its own
+    # process, at most one per slot. Returns {key: (result, error)}.
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    pending = list(jobs)
+    free_slots = list(range(len(slots)))
+    running = {}
+    results = {}
+
+    while pending or running:
+        while pending and free_slots:
+            key, job = pending.pop(0)
+            slot = free_slots.pop(0)
+            proc = ctx.Process(target=target, args=(key, job, slots[slot], queue))
+            proc.start()
+            running[key] = (proc, slot)
+            print('Started %s on cpus %s' % (key, slots[slot]))
+
+        try:
+            key, result, error = queue.get(timeout=30)
+        except Empty:
+            # A worker killed before reporting (e.g. by the OOM killer)
+            crashed = [k for k, (proc, _) in running.items() if proc.exitcode not in (None, 0)]
+            if not crashed:
+                continue
+            key, result, error = crashed[0], None, 'exit code %d' % running[crashed[0]][0].exitcode
+        proc, slot = running.pop(key)
+        proc.join()
+        free_slots.append(slot)
+        results[key] = (result, error)
+        if error:
+            print('Job %s failed:\n%s' % (key, error))
+        else:
+            print('Finished %s' % (key,))
+
+    return results
+
+
+def _fold_worker(key, job, cpus, queue):
+    try:
+        pin_process(cpus, job['arch'])
+        import train_pair
+        report = train_pair.run_fold(**job)
+        report['cpus'] = cpus
+        queue.put((key, report, None))
+    except Exception:
+        queue.put((key, None, traceback.format_exc()))
+
+
+#
+# Collect the fold results
+# ----------------------------------------------------------------------------
+def collect(reports, out_dir, stamp, re_weight=True):
+    import pair_data
+    import train_pair
+
+    oof = [np.load(r['oof_path']) for r in reports]
+    oof = pd.DataFrame({'id': np.concatenate([f['ids'] for f in oof]),
+                        'is_duplicate': np.concatenate([f['labels'] for f in oof]),
+                        'pred': np.concatenate([f['preds'] for f in oof])}).sort_values('id')
+    oof_path = os.path.join(out_dir, 'oof_' + stamp + '.csv')
+    oof.to_csv(oof_path, index=False, columns=['id', 'is_duplicate', 'pred'])
+
+    scores = [r['oof_logloss'] for r in reports]
+    summary = {'stamp': stamp,
+               'folds': reports,
+               'mean_logloss': float(np.mean(scores)),
+               'std_logloss': float(np.std(scores)),
+               'oof_logloss': train_pair.weighted_logloss(oof['is_duplicate'].values, oof['pred'].values, re_weight),
+               'oof_path': oof_path}
+
+    test_paths = [r['test_preds_path'] for r in reports if 'test_preds_path' in r]
+    if test_paths:
+        test_ids = pair_data.load_fold(reports[0]['fold_dir'])['test_ids']
+        # Running sum over the memory-mapped fold predictions
+        preds = np.zeros(len(test_ids), dtype=np.float64)
+        for path in test_paths:
+            preds += np.load(path, mmap_mode='r')
+        preds /= len(test_paths)
+        summary['submission_path'] = submission.write_submission(
+            test_ids, preds, summary['oof_logloss'], 'cv%d_' % len(test_paths) + stamp, out_dir)
+    return summary
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Train all CV folds of a pair model in parallel.')
+    parser.add_argument('--model', choices=('lstm', 'cnn', 'advanced_lstm'), default='lstm')
+    parser.add_argument('--folds', type=int, nargs='+', default=[0, 1, 2, 3, 4])
+    parser.add_argument('--data-dir', default=data_paths.DATA_DIR)
+    parser.add_argument('--embedding-file', default=data_paths.EMBEDDING_FILE)
+    parser.add_argument('--cache-dir', default=data_paths.CACHE_DIR)
+    parser.add_argument('--out-dir', default='cv_runs/')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=2048)
+    parser.add_argument('--accum-steps', type=int, default=1,
+                        help='micro-batches per update, to train --batch-size in less memory')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the sampled hyperparameters')
+    parser.add_argument('--min-threads', type=int, default=1, help='fewest cores given to one fold')
+    parser.add_argument('--scaling', type=float, default=0.7, help='assumed exponent of per-fold thread scaling')
+    parser.add_argument('--no-test', action='store_true', help='skip the test set predictions')
+    parser.add_argument('--registry', default=run_registry.REGISTRY_DIR,
+                        help='registry of finished runs, folds already trained with the same config are reused')
+    parser.add_argument('--no-registry', action='store_true', help='always train, do not record the folds')
+    args = parser.parse_args()
+
+    import pair_data
+    import pair_models
+
+    start = time.time()
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    # A restarted run keeps the parameters of its folds (they resume from
+    # their checkpoints in out_dir/cv<ID>/)
+    params_path = os.path.join(args.out_dir, 'params.json')
+    if os.path.exists(params_path):
+        with open(params_path) as f:
+            params = json.load(f)
+    else:
+        params = pair_models.sample_params(args.model, np.random.RandomState(args.seed))
+        with open(params_path, 'w') as f:
+            json.dump(params, f, indent=2)
+    stamp = pair_models.make_stamp(args.model, params)
+    print(stamp)
+
+    # Prepare all folds first, sharing one word2vec load
+    word2vec = None
+    fold_dirs = {}
+    for test_CVID in args.folds:
+        fold_dir = os.path.join(args.cache_dir, 'cv%d' % test_CVID)
+        if not os.path.exists(os.path.join(fold_dir, 'meta.json')) and word2vec is None:
+            word2vec = pair_data.load_word2vec(args.embedding_file)
+        fold_dirs[test_CVID] = pair_data.prepare_fold(test_CVID, args.data_dir, args.embedding_file,
+                                                      args.cache_dir, word2vec=word2vec)
+    del word2vec
+
+    jobs = [('cv%d' % test_CVID, {'arch': args.model,
+                                   'fold_dir': fold_dirs[test_CVID],
+                                   'params': params,
+                                   'out_dir': os.path.join(args.out_dir, 'cv%d' % test_CVID),
+                                   'epochs': args.epochs,
+                                   'batch_size': args.batch_size,
+                                   'accum_steps': args.accum_steps,
+                                   'predict_test': not args.no_test,
+                                   'verbose': 2,
+                                   'seed': args.seed,
+                                   'registry_dir': None if args.no_registry else args.registry})
+            for test_CVID in args.folds]
+    slots = plan_slots(len(jobs), available_cpus(), args.min_threads, args.scaling)
+    print('Running %d folds on %d slots of %d cpus' % (len(jobs), len(slots), len(slots[0])))
+
+    results = run_jobs(jobs, _fold_worker, slots)
+    failed = [key for key, (_, error) in results.items() if error]
+    reports = [results[key][0] for key, _ in jobs if not results[key][1]]
+
+    summary = collect(reports, args.out_dir, stamp, re_weight=True) if reports else {'stamp': stamp}
+    summary['failed'] = failed
+    summary['wall_time'] = time.time() - start
+    with open(os.path.join(args.out_dir, 'cv_report.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    for report in reports:
+        print('cv%d: %.4f (%d epochs, %.0fs%s)' % (report['test_CVID'], report['oof_logloss'],
+                                                    report['epochs'], report['train_time'],
+                                                    ', cached' if report.get('cached') else ''))
+    if reports:
+        print('OOF logloss %.4f, mean %.4f +- %.4f, wall time %.0fs' % (
+            summary['oof_logloss'], summary['mean_logloss'], summary['std_logloss'], summary['wall_time']))
+    if failed:
+        print('Failed folds: %s' % ', '.join(failed))
+
+
+if __name__ == '__main__':
+    main()
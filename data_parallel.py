@@ -0,0 +1,362 @@
+"""
+Synchronous data-parallel CPU training of the pair models.
+
+    python data_parallel.py --model lstm --cvid 0 --workers 4
+    python data_parallel.py --model cnn --cvid 0 --per-socket
+    python data_parallel.py --model lstm --cvid 0 --bench 1 2 4 8 --bench-steps 30
+
+Each worker process is pinned to its own cores (or its own socket) and holds
+a replica of the model. Every global batch of --batch-size pairs is split
+into one shard per worker; the workers compute the gradients of their shard,
+exchange them through shared memory and all apply the same size-weighted
+average with their own copy of the optimizer, so the replicas stay equal and
+a step is the same update as one single-process step on the full batch, up
+to the dropout masks and the BatchNormalization batch statistics, which are
+those of each shard. The BatchNormalization moving statistics are averaged
+across the replicas at the end of every epoch. A worker killed without
+reporting (OOM killer, segfault) breaks the barrier of the others.
+
+Worker 0 validates, keeps the best weights, decides early stopping and
+writes the same outputs as train_pair.run_fold(). --bench reports the
+training throughput and scaling efficiency for each number of workers.
+
+tf.distribute cannot drive standalone Keras models on this backend, hence
+the gradient exchange is done here directly.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import glob
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from queue import Empty
+import numpy as np
+
+import pair_data
+import cv_runner
+
+
+#
+# Worker layout
+# ----------------------------------------------------------------------------
+def socket_cpus():
+    # [[cpus of socket 0], [cpus of socket 1], ...] from sysfs
+    allowed = set(cv_runner.available_cpus())
+    sockets = {}
+    for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology/physical_package_id'):
+        cpu = int(path.split('/')[-3][3:])
+        if cpu in allowed:
+            with open(path) as f:
+                sockets.setdefault(int(f.read()), []).append(cpu)
+    return [sorted(cpus) for _, cpus in sorted(sockets.items())] or [sorted(allowed)]
+
+
+def split_cpus(n_workers):
+    cpus = cv_runner.available_cpus()
+    per_worker = max(1, len(cpus) // n_workers)
+    return [cpus[i * per_worker:(i + 1) * per_worker] or cpus[-1:] for i in range(n_workers)]
+
+
+#
+# Gradient exchange
+# ----------------------------------------------------------------------------
+class GradientExchange(object):
+    # Float32 slots in shared memory, one row per worker
+
+    def __init__(self, ctx, n_workers, size):
+        self.n_workers = n_workers
+        self.size = size
+        self.buffer = ctx.RawArray('f', n_workers * size)
+        self.barrier = ctx.Barrier(n_workers)
+
+    def view(self):
+        return np.frombuffer(self.buffer, dtype=np.float32).reshape(self.n_workers, self.size)
+
+    def allreduce(self, rank, flat, weights=None):
+        # Weighted mean over the workers of flat (len <= size)
+        view = self.view()
+        view[rank, :len(flat)] = flat
+        self.barrier.wait()
+        if weights is None:
+            result = view[:, :len(flat)].mean(axis=0)
+        else:
+            weights = np.asarray(weights, dtype=np.float32) / np.sum(weights)
+            result = weights.dot(view[:, :len(flat)])
+        # Nobody may overwrite its row before everyone has read
+        self.barrier.wait()
+        return result
+
+
+def _flatten(arrays):
+    return np.concatenate([a.ravel() for a in arrays]).astype(np.float32)
+
+
+def _unflatten(flat, like):
+    arrays = []
+    offset = 0
+    for a in like:
+        arrays.append(flat[offset:offset + a.size].reshape(a.shape))
+        offset += a.size
+    return arrays
+
+
+def build_step_functions(model):
+    # grad_fn(inputs) -> gradients of the shard (running the BatchNormalization
+    # updates); apply_fn(gradients) -> optimizer update with the given gradients
+    from keras import backend as K
+
+    weights = model.trainable_weights
+    targets = getattr(model, '_feed_targets', None) or model.targets
+    sample_weights = getattr(model, '_feed_sample_weights', None) or model.sample_weights
+    inputs = list(model.inputs) + list(targets) + list(sample_weights) + [K.learning_phase()]
+    grads = K.gradients(model.total_loss, weights)
+    grad_fn = K.function(inputs, grads, updates=model.updates)
+
+    placeholders = [K.placeholder(shape=K.int_shape(w)) for w in weights]
+    model.optimizer.get_gradients = lambda loss, params: placeholders
+    updates = model.optimizer.get_updates(loss=model.total_loss, params=weights)
+    apply_fn = K.function(placeholders, [], updates=updates)
+    return grad_fn, apply_fn
+
+
+#
+# One worker
+# ----------------------------------------------------------------------------
+def _worker(rank, n_workers, cpus, job, exchange, stop_flag, queue, train_fn):
+    try:
+        cv_runner.pin_process(cpus)
+        queue.put((rank, train_fn(rank, n_workers, exchange, stop_flag, **job), None))
+    except Exception:
+        queue.put((rank, None, traceback.format_exc()))
+        # Let the other workers fail instead of waiting at the barrier forever
+        exchange.barrier.abort()
+
+
+def train_worker(rank, n_workers, exchange, stop_flag, arch, fold_dir, params, out_dir, epochs=200,
+                 batch_size=2048, re_weight=True, patience=3, seed=1234, max_steps=None, predict_test=True):
+    from keras import backend as K
+    import pair_models
+    import train_pair
+    import checkpoint
+
+    data = pair_data.load_fold(fold_dir)
+    stamp = pair_models.make_stamp(arch, params)
+    model = pair_models.build_model(arch, data['embedding_matrix'], params,
+                                    max_sequence_length=data['meta']['max_sequence_length'])
+    train_pair.compile_model(model)
+    grad_fn, apply_fn = build_step_functions(model)
+
+    # Start every replica from the weights of worker 0
+    trainable = model.trainable_weights
+    like = K.batch_get_value(trainable)
+    flat = exchange.allreduce(rank, _flatten(like), weights=[1] + [0] * (n_workers - 1))
+    K.batch_set_value(list(zip(trainable, _unflatten(flat, like))))
+    bn_stats = [w for w in model.non_trainable_weights if len(K.int_shape(w)) == 1]
+
+    data_1_train, data_2_train, labels_train = pair_data.augment_pairs(
+        data['train_data_1'], data['train_data_2'], data['train_labels'])
+    weights_train = pair_data.sample_weights(labels_train, re_weight)
+    data_1_valid, data_2_valid, labels_valid = pair_data.augment_pairs(
+        data['valid_data_1'], data['valid_data_2'], data['valid_labels'])
+    weight_val = pair_data.sample_weights(labels_valid, re_weight)
+
+    # Same permutation on every worker
+    rng = np.random.RandomState(seed)
+    n_steps = int(np.ceil(len(labels_train) / float(batch_size)))
+    bst_model_path = os.path.join(out_dir, stamp + '.h5')
+    best, wait, history = np.inf, 0, {'val_loss': [], 'step_time': [], 'samples_per_sec': []}
+    steps_done = 0
+    warmup = min(3, (max_steps or 0) // 2)
+
+    for epoch in range(epochs):
+        perm = rng.permutation(len(labels_train))
+        epoch_start = time.time()
+        samples = 0
+        for step in range(n_steps):
+            idx = perm[step * batch_size:(step + 1) * batch_size]
+            shard = np.sort(idx[rank::n_workers])
+            sizes = [len(idx[r::n_workers]) for r in range(n_workers)]
+
+            grads = grad_fn([data_1_train[shard], data_2_train[shard], labels_train[shard][:, None],
+                             weights_train[shard], 1])
+            avg = exchange.allreduce(rank, _flatten(grads), weights=sizes)
+            apply_fn(_unflatten(avg, grads))
+
+            samples += len(idx)
+            steps_done += 1
+            if max_steps and steps_done == warmup:
+                # Benchmarks leave graph warm-up out of the throughput
+                epoch_start, samples = time.time(), 0
+            if max_steps and steps_done >= max_steps:
+                break
+        epoch_time = time.time() - epoch_start
+        history['step_time'].append(epoch_time / max(step + 1 - (warmup if max_steps else 0), 1))
+        history['samples_per_sec'].append(samples / max(epoch_time, 1e-9))
+
+        # Average the BatchNormalization moving statistics
+        values = K.batch_get_value(bn_stats)
+        if values:
+            K.batch_set_value(list(zip(bn_stats, _unflatten(exchange.allreduce(rank, _flatten(values)), values))))
+
+        if max_steps and steps_done >= max_steps:
+            break
+
+        if rank == 0:
+            val_loss = model.evaluate([data_1_valid, data_2_valid], labels_valid, sample_weight=weight_val,
+                                      batch_size=8192, verbose=0)[0]
+            history['val_loss'].append(float(val_loss))
+            print('Epoch %d: val_loss %.4f, %.0f samples/s' % (epoch + 1, val_loss, history['samples_per_sec'][-1]))
+            if val_loss < best:
+                best, wait = float(val_loss), 0
+                checkpoint.atomic_save_weights(model, bst_model_path)
+            else:
+                wait += 1
+            stop_flag.value = int(wait >= patience)
+        exchange.barrier.wait()
+        if stop_flag.value:
+            break
+
+    result = {'rank': rank, 'steps': steps_done, 'history': history}
+    if rank != 0 or max_steps:
+        return result
+
+    model.load_weights(bst_model_path)
+    oof_preds = train_pair.predict_pairs(model, data['valid_data_1'], data['valid_data_2'], verbose=0)
+    oof_path = os.path.join(out_dir, 'oof_' + stamp + '.npz')
+    np.savez(oof_path, ids=data['valid_ids'], labels=data['valid_labels'], preds=oof_preds)
+    result.update({'stamp': stamp,
+                   'bst_model_path': bst_model_path,
+                   'bst_val_score': best,
+                   'oof_logloss': train_pair.weighted_logloss(data['valid_labels'], oof_preds, re_weight),
+                   'oof_path': oof_path})
+    if predict_test:
+        result['test_preds_path'] = os.path.join(out_dir, 'test_' + stamp + '.npy')
+        result['submission_path'] = train_pair.predict_submission(model, data['test_data_1'], data['test_data_2'],
+                                                                  data['test_ids'], best, stamp, out_dir,
+                                                                  preds_path=result['test_preds_path'], verbose=0)
+    return result
+
+
+#
+# Launch the workers
+# ----------------------------------------------------------------------------
+def run(n_workers, job, cpu_sets=None, n_params=None, train_fn=train_worker, timeout=30):
+    # {rank: result of train_fn(rank, n_workers, exchange, stop_flag, **job)},
+    # None for the workers that failed
+    ctx = multiprocessing.get_context('spawn')
+    cpu_sets = cpu_sets or split_cpus(n_workers)
+    exchange = GradientExchange(ctx, n_workers, n_params)
+    stop_flag = ctx.Value('i', 0)
+    queue = ctx.Queue()
+
+    procs = [ctx.Process(target=_worker, args=(rank, n_workers, cpu_sets[rank], job, exchange, stop_flag, queue,
+                                               train_fn))
+             for rank in range(n_workers)]
+    for proc in procs:
+        proc.start()
+    running = dict(enumerate(procs))
+    results = {}
+    while running:
+        try:
+            rank, result, error = queue.get(timeout=timeout)
+        except Empty:
+            # A worker killed before reporting (e.g. by the OOM killer): the
+            # others would wait at the barrier forever
+            crashed = [r for r, proc in running.items() if proc.exitcode not in (None, 0)]
+            if not crashed:
+                continue
+            rank, result, error = crashed[0], None, 'exit code %d' % running[crashed[0]].exitcode
+            exchange.barrier.abort()
+        if rank not in running:
+            continue
+        running.pop(rank).join()
+        if error:
+            print('Worker %d failed:\n%s' % (rank, error))
+        results[rank] = result
+    return results
+
+
+def count_params(arch, fold_dir, params):
+    # Size of the exchange buffer: trainable weights of the model
+    import pair_models
+    from keras import backend as K
+
+    data = pair_data.load_fold(fold_dir)
+    model = pair_models.build_model(arch, data['embedding_matrix'], params)
+    n = max(int(sum(np.prod(K.int_shape(w)) for w in model.trainable_weights)),
+            int(sum(np.prod(K.int_shape(w)) for w in model.non_trainable_weights if len(K.int_shape(w)) == 1)))
+    K.clear_session()
+    return n
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Synchronous data-parallel training of a pair model.')
+    parser.add_argument('--model', choices=('lstm', 'cnn', 'advanced_lstm'), default='lstm')
+    parser.add_argument('--cvid', type=int, default=0)
+    parser.add_argument('--cache-dir', default=pair_data.CACHE_DIR)
+    parser.add_argument('--out-dir', default='dp_runs/')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--per-socket', action='store_true', help='one worker per CPU socket')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=2048, help='global batch size')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the sampled hyperparameters')
+    parser.add_argument('--bench', type=int, nargs='+', help='worker counts to benchmark, e.g. 1 2 4 8')
+    parser.add_argument('--bench-steps', type=int, default=30)
+    args = parser.parse_args()
+
+    import pair_models
+
+    fold_dir = pair_data.prepare_fold(args.cvid, cache_dir=args.cache_dir)
+    params = pair_models.sample_params(args.model, np.random.RandomState(args.seed))
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    n_params = count_params(args.model, fold_dir, params)
+    job = {'arch': args.model, 'fold_dir': fold_dir, 'params': params, 'out_dir': args.out_dir,
+           'epochs': args.epochs, 'batch_size': args.batch_size}
+
+    if args.bench:
+        report = []
+        for n_workers in args.bench:
+            job['max_steps'] = args.bench_steps
+            results = run(n_workers, job, n_params=n_params)
+            if results.get(0) is None:
+                continue
+            throughput = results[0]['history']['samples_per_sec'][-1]
+            report.append({'workers': n_workers, 'samples_per_sec': throughput})
+        base = report[0]['samples_per_sec'] / report[0]['workers'] if report else 1.
+        print('%8s %12s %8s %11s' % ('workers', 'samples/s', 'speedup', 'efficiency'))
+        for r in report:
+            r['speedup'] = r['samples_per_sec'] / (base * report[0]['workers'])
+            r['efficiency'] = r['samples_per_sec'] / (base * r['workers'])
+            print('%8d %12.0f %8.2f %10.1f%%' % (r['workers'], r['samples_per_sec'], r['speedup'],
+                                                  100 * r['efficiency']))
+        with open(os.path.join(args.out_dir, 'scaling_%s.json' % args.model), 'w') as f:
+            json.dump({'model': args.model, 'params': params, 'batch_size': args.batch_size, 'runs': report},
+                      f, indent=2)
+        return
+
+    cpu_sets = socket_cpus() if args.per_socket else None
+    n_workers = len(cpu_sets) if cpu_sets else args.workers
+    start = time.time()
+    results = run(n_workers, job, cpu_sets, n_params=n_params)
+    report = results.get(0)
+    if report is not None:
+        report['workers'] = n_workers
+        report['wall_time'] = time.time() - start
+        print('%s: val %.4f, oof %.4f, %.0fs on %d workers' % (report['stamp'], report['bst_val_score'],
+                                                              report['oof_logloss'], report['wall_time'], n_workers))
+        with open(os.path.join(args.out_dir, report['stamp'] + '.dp.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
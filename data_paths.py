@@ -0,0 +1,50 @@
+"""
+Default locations of the data and content hashes of its files, kept apart
+from pair_data.py so that the xgboost scripts and the feature store can use
+them without importing nltk and the text cleaning of preprocessing.py.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import glob
+import hashlib
+
+
+#
+# Default directories
+# ----------------------------------------------------------------------------
+DATA_DIR = '/home/ian/Dataset/QuoraQP/'
+EMBEDDING_FILE = '/home/ian/workspace/resources/GoogleNews-vectors-negative300.bin'
+CACHE_DIR = 'cache/'
+
+# Fold whose arrays the embedding features of the feature store are built from
+EMBEDDING_FOLD = os.path.join(CACHE_DIR, 'cv0')
+
+
+#
+# Versions of the data
+# ----------------------------------------------------------------------------
+_hashes = {}
+
+
+def data_hash(paths):
+    # Content hash of the files, computed once per process for unchanged files
+    stamp = tuple((path, os.path.getsize(path), os.path.getmtime(path)) for path in paths)
+    if stamp not in _hashes:
+        h = hashlib.sha1()
+        for path in paths:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+        _hashes[stamp] = h.hexdigest()[:16]
+    return _hashes[stamp]
+
+
+def fold_hash(fold_dir):
+    # Content hash of the arrays and json files of a pair_data fold
+    if not os.path.exists(os.path.join(fold_dir, 'meta.json')):
+        raise IOError('No prepared fold in %s' % fold_dir)
+    return data_hash(sorted(glob.glob(os.path.join(fold_dir, '*.npy')) + glob.glob(os.path.join(fold_dir, '*.json'))))
@@ -0,0 +1,199 @@
+"""
+Distil an ensemble of pair models into a small, fast student.
+
+    python distill.py --members runs/lstm_*.json runs/2l_cnn_*.json --student bag --out-dir distill/
+
+The members are given by the <STAMP>.json files written by train_pair
+(their weights are the <STAMP>.h5 next to them) and must be trained on the
+same fold. The ensemble's averaged prediction over the fold's train pairs
+and the unlabeled test pairs becomes the soft target of the student
+('bag' or 'small_cnn', see pair_models.py), which is validated on the
+fold's validation pairs with the true labels.
+
+The report (distill_<STUDENT>.json) gives the weighted validation logloss of
+the ensemble and the student, and the latency (one pair, batch of 1) and
+throughput (batches of 8192) and the weight memory of both.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from keras import backend as K
+
+import pair_data
+import pair_models
+import train_pair
+import checkpoint
+
+
+STUDENT_PARAMS = {'bag': {'num_dense': 64, 'rate_drop_dense': 0.1, 'act': 'relu'},
+                  'small_cnn': {'num_filters': 64, 'num_dense': 64, 'rate_drop_dense': 0.1, 'act': 'relu'}}
+
+
+#
+# Ensemble
+# ----------------------------------------------------------------------------
+def load_members(paths):
+    members = []
+    for path in paths:
+        with open(path) as f:
+            member = json.load(f)
+        member['weights_path'] = os.path.splitext(path)[0] + '.h5'
+        members.append(member)
+
+    fold_dirs = set(m['fold_dir'] for m in members)
+    if len(fold_dirs) != 1:
+        raise ValueError('Ensemble members come from different folds: %s' % ', '.join(sorted(fold_dirs)))
+    return members, fold_dirs.pop()
+
+
+def build_member(member, data):
+    # Fine-tuned members (finetune.py) have their own, extended embedding
+    embedding_matrix = data['embedding_matrix']
+    if 'vocab_dir' in member:
+        embedding_matrix = np.load(os.path.join(member['vocab_dir'], 'embedding_matrix.npy'), mmap_mode='r')
+    model = pair_models.build_model(member['arch'], embedding_matrix, member['params'],
+                                    max_sequence_length=data['meta']['max_sequence_length'])
+    model.load_weights(member['weights_path'])
+    return model
+
+
+def ensemble_predict(models, data_1, data_2, batch_size=8192):
+    return np.mean([train_pair.predict_pairs(m, data_1, data_2, batch_size, verbose=0) for m in models], axis=0)
+
+
+#
+# Speed and memory
+# ----------------------------------------------------------------------------
+def weight_bytes(models):
+    # The frozen embedding matrix is shared by all the models, count it once;
+    # the layers of the nested 'encoder' and 'head' models are walked too
+    seen = set()
+    total = 0
+    for model in models:
+        for layer in checkpoint.flat_layers(model):
+            for w in layer.weights:
+                shape = K.int_shape(w)
+                key = ('embedding', shape) if layer.__class__.__name__ == 'Embedding' else id(w)
+                if key not in seen:
+                    seen.add(key)
+                    total += int(np.prod(shape)) * 4
+    return total
+
+
+def measure_speed(models, data_1, data_2, n_latency=200, n_throughput=100000):
+    one_1, one_2 = data_1[:1], data_2[:1]
+    for m in models:
+        m.predict([one_1, one_2], batch_size=1)
+
+    latencies = []
+    for i in range(n_latency):
+        start = time.time()
+        for m in models:
+            m.predict([data_1[i:i + 1], data_2[i:i + 1]], batch_size=1)
+        latencies.append(time.time() - start)
+
+    n = min(n_throughput, len(data_1))
+    start = time.time()
+    ensemble_predict(models, data_1[:n], data_2[:n])
+    elapsed = time.time() - start
+    return {'latency_ms_p50': 1000 * float(np.median(latencies)),
+            'latency_ms_p95': 1000 * float(np.percentile(latencies, 95)),
+            # Both question orders are predicted per pair
+            'pairs_per_sec': n / elapsed}
+
+
+#
+# Distillation
+# ----------------------------------------------------------------------------
+def distill(member_paths, student='bag', out_dir='distill/', epochs=30, batch_size=2048, re_weight=True):
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    members, fold_dir = load_members(member_paths)
+    data = pair_data.load_fold(fold_dir)
+
+    print('Predicting soft targets with %d members' % len(members))
+    teachers = [build_member(m, data) for m in members]
+    soft_train = ensemble_predict(teachers, data['train_data_1'], data['train_data_2'])
+    soft_test = ensemble_predict(teachers, data['test_data_1'], data['test_data_2'])
+    ensemble_valid = ensemble_predict(teachers, data['valid_data_1'], data['valid_data_2'])
+    ensemble_speed = measure_speed(teachers, data['valid_data_1'], data['valid_data_2'])
+    ensemble_bytes = weight_bytes(teachers)
+    del teachers
+    K.clear_session()
+
+    # Student on train + test pairs with the ensemble's soft targets
+    params = STUDENT_PARAMS[student]
+    stamp = 'student_%s_%d' % (student, len(members))
+    model = pair_models.build_model(student, data['embedding_matrix'], params,
+                                    max_sequence_length=data['meta']['max_sequence_length'])
+    train_pair.compile_model(model)
+
+    data_1_train, data_2_train, soft_targets = pair_data.augment_pairs(
+        np.vstack((data['train_data_1'], data['test_data_1'])),
+        np.vstack((data['train_data_2'], data['test_data_2'])),
+        np.concatenate((soft_train, soft_test)))
+    data_1_valid, data_2_valid, labels_valid = pair_data.augment_pairs(
+        data['valid_data_1'], data['valid_data_2'], data['valid_labels'])
+    weight_val = pair_data.sample_weights(labels_valid, re_weight)
+
+    from keras.callbacks import EarlyStopping
+    bst_model_path = os.path.join(out_dir, stamp + '.h5')
+    model_checkpoint = checkpoint.ResumableCheckpoint(os.path.join(out_dir, stamp + '.ckpt'), bst_model_path,
+                                                      info={'arch': student, 'params': params})
+    model.fit([data_1_train, data_2_train], soft_targets,
+              validation_data=([data_1_valid, data_2_valid], labels_valid, weight_val),
+              epochs=epochs, batch_size=batch_size, shuffle=True, verbose=2,
+              callbacks=[EarlyStopping(monitor='val_loss', patience=3), model_checkpoint])
+    model.load_weights(bst_model_path)
+
+    student_valid = train_pair.predict_pairs(model, data['valid_data_1'], data['valid_data_2'], verbose=0)
+    report = {'student': student,
+              'params': params,
+              'members': member_paths,
+              'fold_dir': fold_dir,
+              'bst_model_path': bst_model_path,
+              'ensemble': dict(ensemble_speed,
+                               logloss=train_pair.weighted_logloss(data['valid_labels'], ensemble_valid, re_weight),
+                               weight_mb=ensemble_bytes / 2. ** 20),
+              'student_model': dict(measure_speed([model], data['valid_data_1'], data['valid_data_2']),
+                                    logloss=train_pair.weighted_logloss(data['valid_labels'], student_valid,
+                                                                        re_weight),
+                                    weight_mb=weight_bytes([model]) / 2. ** 20)}
+    report['logloss_gap'] = report['student_model']['logloss'] - report['ensemble']['logloss']
+    with open(os.path.join(out_dir, 'distill_%s.json' % student), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('%-10s %9s %10s %10s %12s %10s' % ('', 'logloss', 'p50 (ms)', 'p95 (ms)', 'pairs/s', 'weights'))
+    for name, r in (('ensemble', report['ensemble']), ('student', report['student_model'])):
+        print('%-10s %9.4f %10.2f %10.2f %12.0f %8.1fMB' % (name, r['logloss'], r['latency_ms_p50'],
+                                                             r['latency_ms_p95'], r['pairs_per_sec'],
+                                                             r['weight_mb']))
+    print('Logloss gap: %+.4f' % report['logloss_gap'])
+    return report
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Distil an ensemble of pair models into a small student.')
+    parser.add_argument('--members', nargs='+', required=True, help='<STAMP>.json files of the ensemble')
+    parser.add_argument('--student', choices=pair_models.STUDENT_ARCHS, default='bag')
+    parser.add_argument('--out-dir', default='distill/')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=2048)
+    args = parser.parse_args()
+
+    distill(args.members, args.student, args.out_dir, args.epochs, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
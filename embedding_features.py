@@ -0,0 +1,151 @@
+"""
+Embedding similarity features of the pairs, from the cached fold arrays.
+
+    python embedding_features.py --fold-dir cache/cv0/
+
+A fold of pair_data.py holds the padded token ids of every train pair
+(train and validation files) and of every test pair, and the GoogleNews
+embedding matrix of its word index. Each question is pooled into three
+sentence vectors
+
+    mean       mean of its word vectors
+    idf_mean   mean weighted by the idf of the words over all questions
+    max        element-wise max of its word vectors
+
+counting only the words with a vector (padding and words missing from
+GoogleNews are masked out), and every pair gets the cosine, L1 and
+Euclidean distances between the vectors of its questions. All of it is
+array gathers over chunks of padded sequences, no loop over the rows.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import time
+import argparse
+import numpy as np
+
+import data_paths
+
+
+POOLINGS = ('mean', 'idf_mean', 'max')
+DISTANCES = ('cosine', 'l1', 'euclidean')
+FEATURE_NAMES = tuple('emb_%s_%s' % (pooling, distance) for pooling in POOLINGS for distance in DISTANCES)
+
+
+#
+# Word weights
+# ----------------------------------------------------------------------------
+def token_idf(sequences, nb_words):
+    # log(questions / (1 + questions containing the word)) of every word id,
+    # from the (n, max_sequence_length) padded sequences
+    df = np.zeros(nb_words, dtype=np.int64)
+    n = 0
+    for seqs in sequences:
+        seqs = np.sort(np.asarray(seqs), axis=1)
+        # Each word once per question: ids different from the previous one
+        first = np.ones(seqs.shape, dtype=bool)
+        first[:, 1:] = seqs[:, 1:] != seqs[:, :-1]
+        df += np.bincount(seqs[first & (seqs > 0)], minlength=nb_words)
+        n += len(seqs)
+    return np.log(n / (1. + df)).astype(np.float32)
+
+
+#
+# Sentence vectors
+# ----------------------------------------------------------------------------
+def pool(seqs, embedding, known, idf):
+    # {pooling: (n, dim) sentence vectors} of one chunk of padded sequences;
+    # questions without any known word get zero vectors
+    seqs = np.asarray(seqs)
+    vectors = embedding[seqs]
+    mask = known[seqs]
+    counts = mask.sum(axis=1, keepdims=True).astype(np.float32)
+    weights = np.where(mask, idf[seqs], 0)
+
+    pooled = {'mean': np.einsum('ij,ijk->ik', mask.astype(np.float32), vectors) / np.maximum(counts, 1),
+              'idf_mean': np.einsum('ij,ijk->ik', weights, vectors) /
+                          np.maximum(weights.sum(axis=1, keepdims=True), 1e-6)}
+    vectors[~mask] = -np.inf
+    pooled['max'] = np.where(counts > 0, vectors.max(axis=1), 0)
+    return pooled
+
+
+def distances(u, v, eps=1e-6):
+    # {distance: (n,) values} between the rows of u and v; cosine is 0 when
+    # either vector is zero
+    norms = np.linalg.norm(u, axis=1) * np.linalg.norm(v, axis=1)
+    return {'cosine': np.einsum('ij,ij->i', u, v) / np.maximum(norms, eps),
+            'l1': np.abs(u - v).sum(axis=1),
+            'euclidean': np.linalg.norm(u - v, axis=1)}
+
+
+def pair_features(data_1, data_2, embedding, idf, chunk_size=5000):
+    # (n, len(FEATURE_NAMES)) float32 features of the pairs of padded
+    # sequences, chunk_size pairs gathered at a time
+    embedding = np.asarray(embedding, dtype=np.float32)
+    known = np.any(embedding != 0, axis=1)
+    features = np.empty((len(data_1), len(FEATURE_NAMES)), dtype=np.float32)
+    for start in range(0, len(data_1), chunk_size):
+        stop = min(start + chunk_size, len(data_1))
+        pooled_1 = pool(data_1[start:stop], embedding, known, idf)
+        pooled_2 = pool(data_2[start:stop], embedding, known, idf)
+        columns = []
+        for pooling in POOLINGS:
+            values = distances(pooled_1[pooling], pooled_2[pooling])
+            columns.extend(values[distance] for distance in DISTANCES)
+        features[start:stop] = np.stack(columns, axis=1)
+    return features
+
+
+def fold_features(fold_dir, chunk_size=5000, verbose=1):
+    # (train_ids, train_features, test_ids, test_features) of every pair of
+    # the fold, its train and validation pairs together
+    import pair_data
+
+    start = time.time()
+    data = pair_data.load_fold(fold_dir)
+    embedding = data['embedding_matrix']
+    idf = token_idf([data[split + '_data_' + q] for split in ('train', 'valid', 'test') for q in '12'],
+                    len(embedding))
+
+    train_ids = np.concatenate([data['train_ids'], data['valid_ids']])
+    train_features = np.concatenate([pair_features(data[split + '_data_1'], data[split + '_data_2'], embedding, idf,
+                                                   chunk_size)
+                                     for split in ('train', 'valid')])
+    test_features = pair_features(data['test_data_1'], data['test_data_2'], embedding, idf, chunk_size)
+    if verbose:
+        print('Embedding features of %d train and %d test pairs in %.1fs' % (
+            len(train_ids), len(test_features), time.time() - start))
+    return train_ids, train_features, np.asarray(data['test_ids']), test_features
+
+
+def align(ids, features, row_ids):
+    # Rows of features in the order of row_ids, nan for the ids not found
+    order = np.argsort(ids)
+    pos = np.clip(np.searchsorted(ids, row_ids, sorter=order), 0, len(ids) - 1)
+    rows = order[pos]
+    aligned = features[rows]
+    aligned[ids[rows] != row_ids] = np.nan
+    return aligned
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Embedding similarity features of one cached fold.')
+    parser.add_argument('--fold-dir', default=data_paths.EMBEDDING_FOLD)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    train_ids, train_features, test_ids, test_features = fold_features(args.fold_dir, args.chunk_size)
+    for name, train_column, test_column in zip(FEATURE_NAMES, train_features.T, test_features.T):
+        print('%-22s train %.4f +- %.4f  test %.4f +- %.4f' % (
+            name, np.nanmean(train_column), np.nanstd(train_column), np.nanmean(test_column),
+            np.nanstd(test_column)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+Versioned store of the pair feature columns of the xgboost models.
+
+    python feature_store.py --features word_match tfidf_word_match q1_chars q2_chars
+    python feature_store.py --list
+
+Every feature is a named column registered with @feature(name, version)
+and computed for train and test at once. Its columns are saved as
+
+    STORE_DIR/<DATA_HASH>/<NAME>.v<VERSION>.train.npy
+    STORE_DIR/<DATA_HASH>/<NAME>.v<VERSION>.test.npy
+
+keyed by a hash of the train and test files and by the version of the
+feature code (bump it when the code of a feature changes). The features
+built from other data as well (the emb_* ones, from the cached fold
+data_paths.EMBEDDING_FOLD) add a hash of that data to their version:
+<NAME>.v<VERSION>-<KEY>, and are left out of the default features while
+that fold is not prepared. get_matrix(names)
+only computes the features missing from the store, reading the csv files
+only then, and returns the columns as one memory-mapped float32 matrix per
+split, itself cached for that set of features.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+import data_paths
+import graph_features
+import pair_features
+
+
+STORE_DIR = 'features/'
+TRAIN_FILE = os.path.join(data_paths.DATA_DIR, 'train.csv')
+TEST_FILE = os.path.join(data_paths.DATA_DIR, 'test.csv')
+
+SPLITS = ('train', 'test')
+
+GRAPH_FEATURES = ('q1_degree', 'q2_degree', 'common_neighbours', 'q1_kcore', 'q2_kcore', 'component_size')
+
+EMBEDDING_FEATURES = tuple('emb_%s_%s' % (pooling, distance) for pooling in ('mean', 'idf_mean', 'max')
+                           for distance in ('cosine', 'l1', 'euclidean'))
+
+# name -> (version, function(data, shared) -> (train column, test column),
+# depends), data being {'train': DataFrame, 'test': DataFrame}, shared a dict
+# of the intermediate results common to several features and depends None or
+# a function returning the version of the other data the feature is built from
+FEATURES = {}
+
+
+def feature(name, version, depends=None):
+    def register(fn):
+        FEATURES[name] = (version, fn, depends)
+        return fn
+    return register
+
+
+#
+# Features
+# ----------------------------------------------------------------------------
+def _question_matrices(data, shared):
+    if 'matrices' not in shared:
+        shared['matrices'] = pair_features.question_matrices(
+            pd.concat([data['train']['question1'], data['test']['question1']]),
+            pd.concat([data['train']['question2'], data['test']['question2']]))
+    return shared['matrices']
+
+
+def _split(values, data):
+    n = len(data['train'])
+    return values[:n], values[n:]
+
+
+@feature('word_match', 1)
+def word_match(data, shared):
+    q1, q2, _ = _question_matrices(data, shared)
+    return _split(pair_features.word_match_share(q1, q2), data)
+
+
+@feature('tfidf_word_match', 1)
+def tfidf_word_match(data, shared):
+    # Count weights of the train questions, as in xgboost.ipynb
+    q1, q2, vocabulary = _question_matrices(data, shared)
+    train = data['train']
+    weights = pair_features.count_weights(pd.concat([train['question1'], train['question2']]))
+    w = pair_features.weight_vector(vocabulary, weights)
+    return _split(pair_features.tfidf_word_match_share(q1, q2, w), data)
+
+
+def _tfidf_cosine(data, analyzer, ngram_range, min_df=1):
+    t1, t2 = pair_features.tfidf_matrices(pd.concat([data['train']['question1'], data['test']['question1']]),
+                                          pd.concat([data['train']['question2'], data['test']['question2']]),
+                                          analyzer, ngram_range, min_df)
+    return _split(pair_features.row_cosine(t1, t2), data)
+
+
+@feature('tfidf_cosine', 1)
+def tfidf_cosine(data, shared):
+    # Cosine of the word TF-IDF vectors, TfidfVectorizer as in xgboost_3.ipynb
+    return _tfidf_cosine(data, 'word', (1, 1))
+
+
+@feature('tfidf_char_cosine', 1)
+def tfidf_char_cosine(data, shared):
+    # Cosine of the TF-IDF vectors of the 2 to 4 character n-grams, robust
+    # to typos and inflections; n-grams seen once are left out
+    return _tfidf_cosine(data, 'char_wb', (2, 4), min_df=2)
+
+
+def _length_feature(column, words):
+    def compute(data, shared):
+        # map(str): NaN questions count as 'nan', as astype(str) did before pandas 3
+        texts = [data[split][column].map(str) for split in SPLITS]
+        if words:
+            return tuple(t.str.count(' ').values + 1 for t in texts)
+        return tuple(t.str.len().values for t in texts)
+    return compute
+
+
+for _q in ('q1', 'q2'):
+    # Distribution statistics of the notebooks: characters and words of each question
+    feature(_q + '_chars', 2)(_length_feature('question' + _q[1], words=False))
+    feature(_q + '_words', 2)(_length_feature('question' + _q[1], words=True))
+
+
+def _graph_feature(name):
+    def compute(data, shared):
+        if 'graph' not in shared:
+            both = pd.concat([data['train'], data['test']], ignore_index=True)
+            shared['graph'] = graph_features.pair_features(both['question1'], both['question2'])
+        return _split(shared['graph'][name].values, data)
+    return compute
+
+
+for _name in GRAPH_FEATURES:
+    # Question graph over the train and test pairs, see graph_features.py
+    feature(_name, 1)(_graph_feature(_name))
+
+
+def _embedding_version():
+    return data_paths.fold_hash(data_paths.EMBEDDING_FOLD)
+
+
+def _embedding_feature(name):
+    def compute(data, shared):
+        import embedding_features
+
+        # The fold arrays are matched to the csv rows by pair id
+        if 'embedding' not in shared:
+            train_ids, train_features, test_ids, test_features = embedding_features.fold_features(
+                data_paths.EMBEDDING_FOLD)
+            shared['embedding'] = (embedding_features.align(train_ids, train_features, data['train']['id'].values),
+                                   embedding_features.align(test_ids, test_features, data['test']['test_id'].values))
+        j = embedding_features.FEATURE_NAMES.index(name)
+        return tuple(features[:, j] for features in shared['embedding'])
+    return compute
+
+
+for _name in EMBEDDING_FEATURES:
+    # Sentence vector distances over the GoogleNews vectors of the cached
+    # fold, see embedding_features.py; keyed by the content of the fold too
+    feature(_name, 1, depends=_embedding_version)(_embedding_feature(_name))
+
+
+#
+# Store
+# ----------------------------------------------------------------------------
+def feature_key(name):
+    # <NAME>.v<VERSION>, followed by -<KEY> for the features built from other
+    # inputs than the csv files
+    version, _, depends = FEATURES[name]
+    return '%s.v%d' % (name, version) + ('-' + depends() if depends is not None else '')
+
+
+def available():
+    # Registered features whose inputs exist: the emb_* ones need the fold
+    names = sorted(FEATURES)
+    if not os.path.exists(os.path.join(data_paths.EMBEDDING_FOLD, 'meta.json')):
+        names = [name for name in names if name not in EMBEDDING_FEATURES]
+    return names
+
+
+def column_path(store_dir, name, split):
+    return os.path.join(store_dir, '%s.%s.npy' % (feature_key(name), split))
+
+
+def atomic_save(path, array):
+    # np.save to a temporary file renamed over path, readers never see a
+    # half-written array
+    tmp_path = path + '.tmp%d.npy' % os.getpid()
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def read_data(train_file=TRAIN_FILE, test_file=TEST_FILE):
+    return {'train': pd.read_csv(train_file), 'test': pd.read_csv(test_file)}
+
+
+def ensure(names, train_file=TRAIN_FILE, test_file=TEST_FILE, store_dir=STORE_DIR, data_key=None):
+    # Computes and saves the features missing from the store; returns the
+    # directory of this version of the data
+    unknown = [name for name in names if name not in FEATURES]
+    if unknown:
+        raise ValueError('Unknown features %s, expected some of %s' % (', '.join(unknown),
+                                                                        ', '.join(sorted(FEATURES))))
+    data_dir = os.path.join(store_dir, data_key or data_paths.data_hash([train_file, test_file]))
+    missing = [name for name in names if not all(os.path.exists(column_path(data_dir, name, split))
+                                                  for split in SPLITS)]
+    if not missing:
+        return data_dir
+
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    data = read_data(train_file, test_file)
+    shared = {}
+    for name in missing:
+        print('Computing %s' % name)
+        columns = FEATURES[name][1](data, shared)
+        for split, values in zip(SPLITS, columns):
+            atomic_save(column_path(data_dir, name, split), np.asarray(values, dtype=np.float64))
+    return data_dir
+
+
+def matrix_key(names):
+    # Changes with the features, their order and their versions
+    return hashlib.sha1('|'.join(feature_key(n) for n in names).encode('utf-8')).hexdigest()[:12]
+
+
+def get_column(column, split='train', train_file=TRAIN_FILE, test_file=TEST_FILE, store_dir=STORE_DIR,
+               data_key=None):
+    # A column of the csv files as they are (is_duplicate, test_id), cached
+    # next to the features
+    data_dir = os.path.join(store_dir, data_key or data_paths.data_hash([train_file, test_file]))
+    path = os.path.join(data_dir, 'raw_%s.%s.npy' % (column, split))
+    if not os.path.exists(path):
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        values = pd.read_csv(train_file if split == 'train' else test_file, usecols=[column])[column].values
+        atomic_save(path, values)
+    return np.load(path, mmap_mode='r')
+
+
+def get_matrix(names, split='train', train_file=TRAIN_FILE, test_file=TEST_FILE, store_dir=STORE_DIR,
+               data_key=None):
+    # Memory-mapped (n_pairs, len(names)) float32 matrix of the features
+    data_dir = ensure(names, train_file, test_file, store_dir, data_key)
+    key = matrix_key(names)
+    path = os.path.join(data_dir, 'matrix_%s.%s.npy' % (key, split))
+    if not os.path.exists(path):
+        columns = [np.load(column_path(data_dir, name, split), mmap_mode='r') for name in names]
+        tmp_path = path + '.tmp%d.npy' % os.getpid()
+        matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                           shape=(len(columns[0]), len(names)))
+        for j, column in enumerate(columns):
+            matrix[:, j] = column
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, path)
+        with open(os.path.join(data_dir, 'matrix_%s.json' % key), 'w') as f:
+            json.dump(list(names), f)
+    return np.load(path, mmap_mode='r')
+
+
+def stored(store_dir=STORE_DIR):
+    # {data hash: [feature.vN, ...]} of the columns in the store
+    found = {}
+    if not os.path.exists(store_dir):
+        return found
+    for data_key in sorted(os.listdir(store_dir)):
+        names = set()
+        for f in os.listdir(os.path.join(store_dir, data_key)):
+            if f.endswith('.train.npy') and not f.startswith(('matrix_', 'raw_')):
+                names.add(f[:-len('.train.npy')])
+        found[data_key] = sorted(names)
+    return found
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Compute and store pair feature columns.')
+    parser.add_argument('--features', nargs='+', help='default: every available feature')
+    parser.add_argument('--train-file', default=TRAIN_FILE)
+    parser.add_argument('--test-file', default=TEST_FILE)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--list', action='store_true', help='list the stored features')
+    args = parser.parse_args()
+
+    if args.list:
+        for data_key, names in stored(args.store_dir).items():
+            print('%s  %s' % (data_key, ' '.join(names)))
+        return
+
+    if args.features is None:
+        args.features = available()
+        if len(args.features) < len(FEATURES):
+            print('Leaving out the emb_* features: no prepared fold in %s' % data_paths.EMBEDDING_FOLD)
+    for split in SPLITS:
+        matrix = get_matrix(args.features, split, args.train_file, args.test_file, args.store_dir)
+        print('%s: %d pairs x %d features' % (split, matrix.shape[0], matrix.shape[1]))
+
+
+if __name__ == '__main__':
+    main()
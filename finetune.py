@@ -0,0 +1,267 @@
+"""
+Fine-tune a trained pair model on newly labelled pairs.
+
+    python finetune.py --run runs/lstm_230_120_0.27_0.31.json --new-pairs new_pairs.csv --out-dir finetune/
+
+The run is given by the <STAMP>.json written by train_pair (its weights are
+the <STAMP>.h5 next to it). The new pairs have the layout of the training
+files (id, qid1, qid2, question1, question2, is_duplicate) and are cleaned
+like them, then indexed with the frozen word_index of the run: known words
+keep their index, new words are appended as new rows of the embedding
+matrix, looked up in --embedding-file without loading it whole (zero rows
+without it): the byte offsets of its words are indexed by one scan, cached
+under pair_data.CACHE_DIR, and later lookups only seek to the new words.
+The model trains for a few epochs on the new pairs mixed with a --replay
+share of the fold's training pairs and is validated on as many of the
+fold's validation pairs, so the wall time follows the new data, not the
+dataset.
+
+Written to --out-dir:
+    <STAMP>_ft.h5 / .ckpt / .metrics.jsonl   as for train_pair.fit
+    <STAMP>_ft_vocab/                        extended word_index.json and
+                                             embedding_matrix.npy
+    <STAMP>_ft.json                          run description, which can be
+                                             fine-tuned again the same way
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import mmap
+import json
+import time
+import pickle
+import argparse
+import numpy as np
+
+import pair_data
+import pair_models
+import train_pair
+import checkpoint
+
+
+#
+# Vocabulary
+# ----------------------------------------------------------------------------
+def load_vocab(run):
+    # Word index and embedding matrix of a run, its own if it was fine-tuned
+    if 'vocab_dir' in run:
+        word_index = pair_data.load_word_index(run['vocab_dir'])
+        embedding_matrix = np.load(os.path.join(run['vocab_dir'], 'embedding_matrix.npy'))
+    else:
+        word_index = pair_data.load_word_index(run['fold_dir'])
+        embedding_matrix = np.load(os.path.join(run['fold_dir'], 'embedding_matrix.npy'))
+    # Words past the embedding rows were dropped by the tokenizer
+    nb_words = embedding_matrix.shape[0]
+    return dict((w, i) for w, i in word_index.items() if i < nb_words), embedding_matrix
+
+
+def new_words(texts, word_index, min_count=1):
+    # Unknown words of the new texts, most frequent first
+    from keras.preprocessing.text import text_to_word_sequence
+
+    counts = {}
+    for text in texts:
+        for word in text_to_word_sequence(text):
+            if word not in word_index:
+                counts[word] = counts.get(word, 0) + 1
+    return sorted((w for w, c in counts.items() if c >= min_count), key=lambda w: (-counts[w], w))
+
+
+def word_offsets(embedding_file, index_path=None):
+    # {word: byte offset of its vector} of the binary word2vec file, built
+    # by one scan and cached (pickled, with the size and mtime of the file
+    # it was built from) so that later lookups seek straight to the vectors
+    if index_path is None:
+        index_path = os.path.join(pair_data.CACHE_DIR, os.path.basename(embedding_file) + '.offsets.pkl')
+    stamp = (os.path.getsize(embedding_file), os.path.getmtime(embedding_file))
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['stamp'] == stamp:
+            return cached['dim'], cached['offsets']
+
+    start = time.time()
+    offsets = {}
+    with open(embedding_file, 'rb') as f:
+        n, dim = [int(x) for x in f.readline().split()]
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = f.tell()
+        for _ in range(n):
+            end = data.find(b' ', pos)
+            word = data[pos:end].lstrip(b'\n').decode('utf-8', errors='ignore')
+            offsets[word] = end + 1
+            pos = end + 1 + 4 * dim
+        data.close()
+    print('Indexed %d words of %s in %.1fs' % (len(offsets), os.path.basename(embedding_file), time.time() - start))
+
+    if not os.path.exists(os.path.dirname(index_path) or '.'):
+        os.makedirs(os.path.dirname(index_path))
+    tmp_path = index_path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'stamp': stamp, 'dim': dim, 'offsets': offsets}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+    return dim, offsets
+
+
+def lookup_vectors(embedding_file, words, index_path=None):
+    # Vectors of the given words, read at their offsets in the binary
+    # word2vec file instead of building the full KeyedVectors
+    dim, offsets = word_offsets(embedding_file, index_path)
+    found = {}
+    with open(embedding_file, 'rb') as f:
+        for word in words:
+            if word in offsets:
+                f.seek(offsets[word])
+                found[word] = np.frombuffer(f.read(4 * dim), dtype=np.float32)
+    print('Found %d of %d new words in %s' % (len(found), len(words), os.path.basename(embedding_file)))
+    return found
+
+
+def extend_vocab(word_index, embedding_matrix, words, vectors):
+    # New words get the next rows, the existing indices are unchanged
+    word_index = dict(word_index)
+    rows = np.zeros((len(words), embedding_matrix.shape[1]), dtype=embedding_matrix.dtype)
+    for k, word in enumerate(words):
+        word_index[word] = embedding_matrix.shape[0] + k
+        if word in vectors:
+            rows[k] = vectors[word]
+    return word_index, np.vstack((embedding_matrix, rows))
+
+
+def to_tensor(texts, word_index, max_sequence_length):
+    from keras.preprocessing.text import text_to_word_sequence
+    from keras.preprocessing.sequence import pad_sequences
+
+    seqs = [[word_index[w] for w in text_to_word_sequence(text) if w in word_index] for text in texts]
+    return pad_sequences(seqs, maxlen=max_sequence_length)
+
+
+#
+# Weights
+# ----------------------------------------------------------------------------
+def layer_weights(model):
+    # Weights by layer position, None for the embedding whose size changes
+    return [None if layer.__class__.__name__ == 'Embedding' else layer.get_weights()
+            for layer in checkpoint.flat_layers(model)]
+
+
+def set_layer_weights(model, weights):
+    for layer, w in zip(checkpoint.flat_layers(model), weights):
+        if w:
+            layer.set_weights(w)
+
+
+#
+# Fine-tuning
+# ----------------------------------------------------------------------------
+def finetune(run_path, new_pairs, out_dir='finetune/', embedding_file=None, replay=1.0, epochs=3,
+             batch_size=2048, lr=0.0005, min_count=1, re_weight=True, seed=None, verbose=2):
+    from keras import backend as K
+    from keras.optimizers import Nadam
+
+    start = time.time()
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    rng = np.random.RandomState(seed)
+
+    with open(run_path) as f:
+        run = json.load(f)
+    arch, params = run['arch'], run['params']
+    stamp = os.path.splitext(os.path.basename(run_path))[0]
+    data = pair_data.load_fold(run['fold_dir'])
+    max_sequence_length = data['meta']['max_sequence_length']
+
+    # Vocabulary of the run extended with the new words
+    word_index, embedding_matrix = load_vocab(run)
+    new_ids, new_texts_1, new_texts_2, new_labels = pair_data.read_pairs(new_pairs)
+    words = new_words(new_texts_1 + new_texts_2, word_index, min_count)
+    vectors = lookup_vectors(embedding_file, words) if embedding_file and words else {}
+    word_index_ft, embedding_matrix_ft = extend_vocab(word_index, embedding_matrix, words, vectors)
+    print('%d new pairs, %d new words' % (len(new_ids), len(words)))
+
+    # Weights of the run on the extended embedding
+    model = pair_models.build_model(arch, embedding_matrix, params, max_sequence_length)
+    model.load_weights(os.path.splitext(run_path)[0] + '.h5')
+    weights = layer_weights(model)
+    K.clear_session()
+    model = pair_models.build_model(arch, embedding_matrix_ft, params, max_sequence_length)
+    set_layer_weights(model, weights)
+    train_pair.compile_model(model, optimizer=Nadam(lr=lr))
+
+    # New pairs mixed with a replay sample of the fold, validated on a sample
+    # of the fold's validation pairs of the same size
+    n_new = len(new_ids)
+    replay_idx = np.sort(rng.choice(len(data['train_ids']), min(int(replay * n_new), len(data['train_ids'])),
+                                    replace=False))
+    n_train = n_new + len(replay_idx)
+    valid_idx = np.sort(rng.choice(len(data['valid_ids']), min(n_train, len(data['valid_ids'])), replace=False))
+    mixed = {'train_data_1': np.vstack((to_tensor(new_texts_1, word_index_ft, max_sequence_length),
+                                        data['train_data_1'][replay_idx])),
+             'train_data_2': np.vstack((to_tensor(new_texts_2, word_index_ft, max_sequence_length),
+                                        data['train_data_2'][replay_idx])),
+             'train_labels': np.concatenate((np.array(new_labels), data['train_labels'][replay_idx])),
+             'valid_data_1': data['valid_data_1'][valid_idx],
+             'valid_data_2': data['valid_data_2'][valid_idx],
+             'valid_labels': data['valid_labels'][valid_idx]}
+
+    stamp_ft = stamp + '_ft'
+    vocab_dir = os.path.join(out_dir, stamp_ft + '_vocab')
+    if not os.path.exists(vocab_dir):
+        os.makedirs(vocab_dir)
+    np.save(os.path.join(vocab_dir, 'embedding_matrix.npy'), embedding_matrix_ft)
+    with open(os.path.join(vocab_dir, 'word_index.json'), 'w') as f:
+        json.dump(word_index_ft, f)
+
+    print(stamp_ft)
+    bst_model_path, bst_val_score, hist = train_pair.fit(
+        model, mixed, stamp_ft, out_dir=out_dir, re_weight=re_weight, epochs=epochs, batch_size=batch_size,
+        verbose=verbose, info={'arch': arch, 'test_CVID': run.get('test_CVID'), 'params': params})
+
+    report = {'arch': arch,
+              'test_CVID': run.get('test_CVID'),
+              'fold_dir': run['fold_dir'],
+              'vocab_dir': vocab_dir,
+              'params': params,
+              'base': run_path,
+              'new_pairs': new_pairs,
+              'n_new': n_new,
+              'n_replay': len(replay_idx),
+              'n_new_words': len(words),
+              'n_new_vectors': len(vectors),
+              'bst_model_path': bst_model_path,
+              'bst_val_score': float(bst_val_score),
+              'epochs': len(hist.history['val_loss']),
+              'total_time': time.time() - start}
+    with open(os.path.join(out_dir, stamp_ft + '.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Fine-tuned on %d new and %d replayed pairs in %.0fs, val_loss %.4f' % (
+        n_new, len(replay_idx), report['total_time'], bst_val_score))
+    return report
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Fine-tune a trained pair model on newly labelled pairs.')
+    parser.add_argument('--run', required=True, help='<STAMP>.json of the run to fine-tune')
+    parser.add_argument('--new-pairs', required=True, help='csv of new pairs, layout of the training files')
+    parser.add_argument('--out-dir', default='finetune/')
+    parser.add_argument('--embedding-file', help='word2vec binary file to look the new words up in')
+    parser.add_argument('--replay', type=float, default=1.0, help='replayed fold pairs per new pair')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=2048)
+    parser.add_argument('--lr', type=float, default=0.0005)
+    parser.add_argument('--min-count', type=int, default=1, help='occurrences for a new word to get a row')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    finetune(args.run, args.new_pairs, args.out_dir, args.embedding_file, args.replay, args.epochs,
+             args.batch_size, args.lr, args.min_count, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
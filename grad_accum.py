@@ -0,0 +1,87 @@
+"""
+Gradient accumulation for the pair models.
+
+AccumOptimizer wraps a Keras optimizer so that it accumulates the gradients
+of accum_steps micro-batches and applies their mean once per effective
+batch: training with batch_size / accum_steps samples per step keeps the
+activation memory of the small batch and the updates of the large one.
+
+BatchNormalization still normalises each micro-batch with its own
+statistics, but its moving averages are updated once per micro-batch, so
+their momentum is set to momentum ** (1 / accum_steps) (adjust_params) to
+decay at the same rate per effective batch as without accumulation.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+from keras import backend as K
+from keras import optimizers
+
+
+BN_MOMENTUM = 0.99
+
+
+def bn_momentum(accum_steps, momentum=BN_MOMENTUM):
+    return momentum ** (1. / accum_steps)
+
+
+def adjust_params(params, accum_steps):
+    # Parameters of a model trained with accum_steps micro-batches per update
+    if accum_steps <= 1:
+        return params
+    return dict(params, bn_momentum=bn_momentum(accum_steps))
+
+
+#
+# Optimizer
+# ----------------------------------------------------------------------------
+class AccumOptimizer(optimizers.Optimizer):
+
+    def __init__(self, optimizer, accum_steps, **kwargs):
+        super(AccumOptimizer, self).__init__(**kwargs)
+        self.optimizer = optimizers.get(optimizer)
+        self.accum_steps = accum_steps
+        with K.name_scope(self.__class__.__name__):
+            self.iterations = K.variable(0, dtype='int64', name='iterations')
+
+    def get_updates(self, loss, params):
+        import tensorflow as tf
+
+        # One read of the counter, so that the apply decision and the
+        # increment see the same value within a step
+        step = tf.identity(self.iterations) + 1
+        apply = K.equal(step % self.accum_steps, 0)
+        self.updates = [K.update(self.iterations, step)]
+
+        grads = self.get_gradients(loss, params)
+        accums = [K.zeros(K.int_shape(p), dtype=K.dtype(p)) for p in params]
+        totals = [a + g for a, g in zip(accums, grads)]
+
+        # The wrapped optimizer sees the mean gradient of the effective batch,
+        # and its variable updates only take effect on the last micro-batch
+        self.optimizer.get_gradients = lambda loss, params: [t / self.accum_steps for t in totals]
+        gated = lambda x, new: K.switch(apply, new, x)
+        update, update_add, update_sub = K.update, K.update_add, K.update_sub
+        K.update = lambda x, new: update(x, gated(x, new))
+        K.update_add = lambda x, inc: update(x, gated(x, x + inc))
+        K.update_sub = lambda x, dec: update(x, gated(x, x - dec))
+        try:
+            inner = self.optimizer.get_updates(loss=loss, params=params)
+        finally:
+            K.update, K.update_add, K.update_sub = update, update_add, update_sub
+        for u in inner:
+            # (variable, new value) pairs are turned into assignments by K.function
+            self.updates.append((u[0], gated(u[0], u[1])) if isinstance(u, tuple) else u)
+
+        for a, t in zip(accums, totals):
+            self.updates.append(K.update(a, K.switch(apply, K.zeros_like(a), t)))
+
+        self.weights = [self.iterations] + accums + self.optimizer.weights
+        return self.updates
+
+    def get_config(self):
+        config = {'optimizer': optimizers.serialize(self.optimizer), 'accum_steps': self.accum_steps}
+        base_config = super(AccumOptimizer, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -0,0 +1,136 @@
+"""
+Features of the question graph: the questions of all the train and test pairs
+are its nodes and every pair an undirected edge.
+
+    python graph_features.py
+
+The test pairs have no qid, so questions are identified by their text
+(pd.factorize over both columns of train and test), which also merges the
+train questions asked under several qids. The adjacency is one binary CSR
+matrix and every feature is computed with array operations over it:
+
+    degree             distinct neighbours of each question
+    common_neighbours  questions paired with both questions of a pair
+    kcore              k-core number of each question (peeling by rounds)
+    component_size     questions in the connected component of the pair
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import time
+import numpy as np
+import pandas as pd
+
+
+#
+# Graph
+# ----------------------------------------------------------------------------
+def question_ids(questions_1, questions_2):
+    # (ids_1, ids_2, n_questions), one id per distinct question text
+    codes, uniques = pd.factorize(pd.concat([pd.Series(questions_1), pd.Series(questions_2)],
+                                            ignore_index=True).map(str))
+    n = len(questions_1)
+    return codes[:n], codes[n:], len(uniques)
+
+
+def adjacency(ids_1, ids_2, n_nodes):
+    # Symmetric binary CSR matrix, repeated pairs and self-loops dropped
+    from scipy import sparse
+
+    keep = ids_1 != ids_2
+    rows = np.concatenate((ids_1[keep], ids_2[keep]))
+    cols = np.concatenate((ids_2[keep], ids_1[keep]))
+    graph = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n_nodes, n_nodes))
+    graph.data[:] = 1
+    return graph
+
+
+#
+# Node features
+# ----------------------------------------------------------------------------
+def degree(graph):
+    return np.diff(graph.indptr)
+
+
+def neighbours(graph, nodes):
+    # Concatenated adjacency rows of nodes, one gather over indices
+    starts = graph.indptr[nodes]
+    lengths = graph.indptr[nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return graph.indices[offsets]
+
+
+def kcore(graph):
+    # Frontier peeling: every remaining node of degree <= k is removed at
+    # once with core k, the degrees of its neighbours lowered by their count
+    # in the removed rows, and only those neighbours are checked for the next
+    # round; k is raised to the lowest remaining degree when none is left
+    deg = degree(graph).astype(np.int64)
+    core = np.zeros(len(deg), dtype=np.int64)
+    alive = np.ones(len(deg), dtype=bool)
+    remaining = np.arange(len(deg))
+    while len(remaining):
+        k = deg[remaining].min()
+        frontier = remaining[deg[remaining] <= k]
+        while len(frontier):
+            core[frontier] = k
+            alive[frontier] = False
+            touched, counts = np.unique(neighbours(graph, frontier), return_counts=True)
+            deg[touched] -= counts
+            frontier = touched[alive[touched] & (deg[touched] <= k)]
+        remaining = remaining[alive[remaining]]
+    return core
+
+
+def component_sizes(graph):
+    from scipy.sparse.csgraph import connected_components
+
+    _, labels = connected_components(graph, directed=False)
+    return np.bincount(labels)[labels]
+
+
+#
+# Pair features
+# ----------------------------------------------------------------------------
+def common_neighbours(graph, ids_1, ids_2, chunk_size=500000):
+    counts = np.empty(len(ids_1), dtype=np.int64)
+    for start in range(0, len(ids_1), chunk_size):
+        stop = start + chunk_size
+        both = graph[ids_1[start:stop]].multiply(graph[ids_2[start:stop]])
+        counts[start:stop] = np.asarray(both.sum(axis=1)).ravel()
+    return counts
+
+
+def pair_features(questions_1, questions_2, verbose=1):
+    # DataFrame of the graph features of every pair (question1, question2)
+    start = time.time()
+    ids_1, ids_2, n_nodes = question_ids(questions_1, questions_2)
+    graph = adjacency(ids_1, ids_2, n_nodes)
+    if verbose:
+        print('Question graph: %d nodes, %d edges (%.1fs)' % (n_nodes, graph.nnz // 2, time.time() - start))
+
+    deg = degree(graph)
+    core = kcore(graph)
+    features = pd.DataFrame({'q1_degree': deg[ids_1],
+                             'q2_degree': deg[ids_2],
+                             'common_neighbours': common_neighbours(graph, ids_1, ids_2),
+                             'q1_kcore': core[ids_1],
+                             'q2_kcore': core[ids_2],
+                             'component_size': component_sizes(graph)[ids_1]})
+    if verbose:
+        print('Graph features of %d pairs in %.1fs, max k-core %d' % (len(ids_1), time.time() - start,
+                                                                       core.max()))
+    return features
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+if __name__ == '__main__':
+    import feature_store
+
+    data = feature_store.read_data()
+    both = pd.concat([data['train'], data['test']], ignore_index=True)
+    print(pair_features(both['question1'], both['question2']).describe())
@@ -0,0 +1,174 @@
+"""
+Successive-halving search over the sampled hyperparameters of a pair model.
+
+    python halving_search.py --model lstm --cvid 0 --n-configs 27 --min-epochs 1 --eta 3
+
+Round 0 trains every sampled config for --min-epochs epochs in parallel
+worker processes (packed onto the cores like cv_runner.py). Each following
+round keeps the best 1/eta of the configs by weighted val logloss and trains
+them on from their checkpointed state until they have seen eta times more epochs,
+until one config is left or --max-epochs is reached.
+
+Every (trial, round) is appended to <out-dir>/trials.jsonl with its STAMP.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import argparse
+import traceback
+import numpy as np
+
+import checkpoint
+import pair_data
+import cv_runner
+
+
+#
+# Train one trial for one round
+# ----------------------------------------------------------------------------
+def run_trial(arch, fold_dir, params, stamp, out_dir, epochs, initial_epoch=0, batch_size=2048, verbose=2):
+    import pair_models
+    import train_pair
+
+    start = time.time()
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    data = pair_data.load_fold(fold_dir)
+    model = pair_models.build_model(arch, data['embedding_matrix'], params,
+                                    max_sequence_length=data['meta']['max_sequence_length'])
+    train_pair.compile_model(model)
+
+    # Later rounds go on from the full state of the previous one
+    ckpt_path = os.path.join(out_dir, stamp + '.ckpt')
+    state = checkpoint.load_checkpoint(ckpt_path) if initial_epoch and os.path.exists(ckpt_path) else None
+
+    bst_model_path, bst_val_score, hist = train_pair.fit(model, data, stamp, out_dir=out_dir, epochs=epochs,
+                                                         initial_epoch=initial_epoch, batch_size=batch_size,
+                                                         verbose=verbose, resume_state=state,
+                                                         info={'arch': arch, 'params': params})
+    return {'bst_model_path': bst_model_path,
+            'bst_val_score': float(bst_val_score),
+            'val_loss': [float(v) for v in hist.history['val_loss']],
+            'train_time': time.time() - start}
+
+
+def _trial_worker(key, job, cpus, queue):
+    try:
+        cv_runner.pin_process(cpus, job['arch'])
+        result = run_trial(**job)
+        queue.put((key, result, None))
+    except Exception:
+        queue.put((key, None, traceback.format_exc()))
+
+
+#
+# Successive halving
+# ----------------------------------------------------------------------------
+def sample_trials(arch, n_configs, seed=None):
+    import pair_models
+
+    rng = np.random.RandomState(seed)
+    trials = []
+    for i in range(n_configs):
+        params = pair_models.sample_params(arch, rng)
+        # Trial number keeps STAMPs unique when two draws round the same way
+        stamp = pair_models.make_stamp(arch, params) + '_t%d' % i
+        trials.append({'trial': i, 'stamp': stamp, 'params': params, 'score': None, 'epochs': 0})
+    return trials
+
+
+def successive_halving(trials, arch, fold_dir, out_dir, min_epochs=1, eta=3, max_epochs=200, batch_size=2048,
+                       min_threads=1, log_path=None):
+    survivors = list(trials)
+    budget = min_epochs
+    rnd = 0
+
+    while survivors:
+        jobs = [(t['stamp'], {'arch': arch,
+                              'fold_dir': fold_dir,
+                              'params': t['params'],
+                              'stamp': t['stamp'],
+                              'out_dir': out_dir,
+                              'epochs': budget,
+                              'initial_epoch': t['epochs'],
+                              'batch_size': batch_size})
+                for t in survivors]
+        slots = cv_runner.plan_slots(len(jobs), cv_runner.available_cpus(), min_threads)
+        print('Round %d: %d configs up to %d epochs on %d slots' % (rnd, len(jobs), budget, len(slots)))
+        results = cv_runner.run_jobs(jobs, _trial_worker, slots)
+
+        for t in survivors:
+            result, error = results[t['stamp']]
+            record = {'round': rnd, 'trial': t['trial'], 'stamp': t['stamp'], 'params': t['params']}
+            if error:
+                t['score'] = float('inf')
+                record['error'] = error
+            else:
+                t['epochs'] = budget
+                t['score'] = min(t['score'] or float('inf'), result['bst_val_score'])
+                record.update(result)
+            record['epochs'] = t['epochs']
+            record['score'] = t['score']
+            if log_path:
+                with open(log_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+        survivors = sorted(survivors, key=lambda t: t['score'])
+        for t in survivors:
+            print('  %s  %.4f' % (t['stamp'], t['score']))
+
+        n_keep = len(survivors) // eta
+        if n_keep < 1 or budget >= max_epochs:
+            break
+        survivors = survivors[:n_keep]
+        budget = min(budget * eta, max_epochs)
+        rnd += 1
+
+    return sorted(trials, key=lambda t: t['score'] if t['score'] is not None else float('inf'))
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Successive-halving search of pair model hyperparameters.')
+    parser.add_argument('--model', choices=('lstm', 'cnn', 'advanced_lstm'), default='lstm')
+    parser.add_argument('--cvid', type=int, default=0, help='fold used for the search')
+    parser.add_argument('--data-dir', default=pair_data.DATA_DIR)
+    parser.add_argument('--embedding-file', default=pair_data.EMBEDDING_FILE)
+    parser.add_argument('--cache-dir', default=pair_data.CACHE_DIR)
+    parser.add_argument('--out-dir', default='search/')
+    parser.add_argument('--n-configs', type=int, default=27)
+    parser.add_argument('--min-epochs', type=int, default=1)
+    parser.add_argument('--max-epochs', type=int, default=200)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=2048)
+    parser.add_argument('--min-threads', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    fold_dir = pair_data.prepare_fold(args.cvid, args.data_dir, args.embedding_file, args.cache_dir)
+
+    trials = sample_trials(args.model, args.n_configs, args.seed)
+    trials = successive_halving(trials, args.model, fold_dir, args.out_dir, args.min_epochs, args.eta,
+                                args.max_epochs, args.batch_size, args.min_threads,
+                                log_path=os.path.join(args.out_dir, 'trials.jsonl'))
+
+    best = trials[0]
+    print('Best %s: %.4f after %d epochs (%.0fs)' % (best['stamp'], best['score'], best['epochs'],
+                                                    time.time() - start))
+    with open(os.path.join(args.out_dir, 'best.json'), 'w') as f:
+        json.dump(best, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
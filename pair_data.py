@@ -0,0 +1,234 @@
+"""
+Shared data preparation for the question-pair models.
+
+Cleaning, tokenizing and the embedding lookup are done once per CV fold and
+stored as .npy artifacts under CACHE_DIR/cv<ID>/, so the model scripts (and
+several of them running side by side) memory-map the same arrays instead of
+reloading GoogleNews and re-tokenizing the csv files on every run.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import csv
+import json
+import codecs
+import shutil
+import numpy as np
+
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+
+import data_paths
+import rebalance
+import preprocessing
+
+
+#
+# Default directories and parameters
+# ----------------------------------------------------------------------------
+DATA_DIR = data_paths.DATA_DIR
+EMBEDDING_FILE = data_paths.EMBEDDING_FILE
+CACHE_DIR = data_paths.CACHE_DIR
+MAX_SEQUENCE_LENGTH = 30
+MAX_NB_WORDS = 200000
+EMBEDDING_DIM = 300
+
+CLASS_WEIGHT = rebalance.CLASS_WEIGHT
+
+ARRAYS = ('train_data_1', 'train_data_2', 'train_labels', 'train_ids',
+          'valid_data_1', 'valid_data_2', 'valid_labels', 'valid_ids',
+          'test_data_1', 'test_data_2', 'test_ids',
+          'embedding_matrix')
+
+
+#
+# The function "text_to_wordlist" is from
+# https://www.kaggle.com/currie32/quora-question-pairs/the-importance-of-cleaning-text
+# ----------------------------------------------------------------------------
+def text_to_wordlist(text, remove_stopwords=False, stem_words=False):
+    # Clean the text, with the option to remove stopwords and to stem words.
+
+    # Convert words to lower case and split them
+    text = text.lower().split()
+
+    # Optionally, remove stop words
+    if remove_stopwords:
+        stops = set(stopwords.words("english"))
+        text = [w for w in text if not w in stops]
+
+    text = " ".join(text)
+
+    # Clean the text
+    text = preprocessing.word_patterns_replace(text)
+
+    # Optionally, shorten words to their stems
+    # Ex. >>> print(stemmer.stem("running"))
+    #     run
+    if stem_words:
+        text = text.split()
+        stemmer = SnowballStemmer('english')
+        stemmed_words = [stemmer.stem(word) for word in text]
+        text = " ".join(stemmed_words)
+
+    # Return a list of words
+    return text
+
+
+#
+# Read csv files
+# ----------------------------------------------------------------------------
+def fold_files(test_CVID, data_dir=DATA_DIR):
+    # (train, validation, test) files of one CV fold
+    return (os.path.join(data_dir, 'CV-' + str(test_CVID) + '_clean.csv'),
+            os.path.join(data_dir, 'CV' + str(test_CVID) + '_clean.csv'),
+            os.path.join(data_dir, 'test_clean.csv'))
+
+
+def read_pairs(path, test=False):
+    # Returns (ids, texts_1, texts_2, labels); labels is None for the test file.
+    # Layout of train/validation: id, qid1, qid2, question1, question2, is_duplicate
+    # Layout of test:             test_id, question1, question2
+    q1_col, q2_col = (1, 2) if test else (3, 4)
+
+    ids = []
+    texts_1 = []
+    texts_2 = []
+    labels = []
+    with codecs.open(path, encoding='utf-8') as f:
+        reader = csv.reader(f, delimiter=',')
+        header = next(reader)
+        for values in reader:
+            ids.append(int(values[0]))
+            texts_1.append(text_to_wordlist(values[q1_col]))
+            texts_2.append(text_to_wordlist(values[q2_col]))
+            if not test:
+                labels.append(int(values[5]))
+    print('Found %s texts in %s' % (len(texts_1), os.path.basename(path)))
+
+    return ids, texts_1, texts_2, (None if test else labels)
+
+
+def load_word2vec(embedding_file=EMBEDDING_FILE):
+    from gensim.models import KeyedVectors
+
+    print('Indexing word vectors')
+    word2vec = KeyedVectors.load_word2vec_format(embedding_file, binary=True)
+    print('Found %s word vectors of word2vec' % len(word2vec.vocab))
+    return word2vec
+
+
+def build_embedding_matrix(word_index, word2vec, nb_words, embedding_dim=EMBEDDING_DIM):
+    # Construct a matrix for mapping (word_id ==> word_vec)
+    embedding_matrix = np.zeros((nb_words, embedding_dim))
+    for word, i in word_index.items():
+        if i < nb_words and word in word2vec.vocab:
+            embedding_matrix[i] = word2vec.word_vec(word)
+    print('Null word embeddings: %d' % np.sum(np.sum(embedding_matrix, axis=1) == 0))
+    return embedding_matrix
+
+
+#
+# Build and cache the tensors of one fold
+# ----------------------------------------------------------------------------
+def prepare_fold(test_CVID, data_dir=DATA_DIR, embedding_file=EMBEDDING_FILE, cache_dir=CACHE_DIR,
+                 max_sequence_length=MAX_SEQUENCE_LENGTH, max_nb_words=MAX_NB_WORDS, word2vec=None):
+    # Returns the directory holding the fold artifacts, building them if needed.
+    # The artifacts are written to a temporary directory which is renamed at
+    # the end, so concurrent readers never see a half-written fold.
+    fold_dir = os.path.join(cache_dir, 'cv%d' % test_CVID)
+    if os.path.exists(os.path.join(fold_dir, 'meta.json')):
+        return fold_dir
+
+    from keras.preprocessing.text import Tokenizer
+    from keras.preprocessing.sequence import pad_sequences
+
+    if word2vec is None:
+        word2vec = load_word2vec(embedding_file)
+
+    print('Processing text dataset')
+    train_file, valid_file, test_file = fold_files(test_CVID, data_dir)
+    train_ids, train_texts_1, train_texts_2, train_labels = read_pairs(train_file)
+    valid_ids, valid_texts_1, valid_texts_2, valid_labels = read_pairs(valid_file)
+    test_ids, test_texts_1, test_texts_2, _ = read_pairs(test_file, test=True)
+
+    # Vectorize texts and turn texts into sequences
+    # (=list of word indexes, where the word of rank i in the dataset (starting at 1) has index i).
+    tokenizer = Tokenizer(num_words=max_nb_words)
+    tokenizer.fit_on_texts(train_texts_1 + train_texts_2 + valid_texts_1 + valid_texts_2 + test_texts_1 + test_texts_2)
+    word_index = tokenizer.word_index
+    print('Found %s unique tokens' % len(word_index))
+
+    def to_tensor(texts):
+        return pad_sequences(tokenizer.texts_to_sequences(texts), maxlen=max_sequence_length)
+
+    nb_words = min(max_nb_words, len(word_index)) + 1
+    arrays = {
+        'train_data_1': to_tensor(train_texts_1),
+        'train_data_2': to_tensor(train_texts_2),
+        'train_labels': np.array(train_labels),
+        'train_ids': np.array(train_ids, dtype=np.int64),
+        'valid_data_1': to_tensor(valid_texts_1),
+        'valid_data_2': to_tensor(valid_texts_2),
+        'valid_labels': np.array(valid_labels),
+        'valid_ids': np.array(valid_ids, dtype=np.int64),
+        'test_data_1': to_tensor(test_texts_1),
+        'test_data_2': to_tensor(test_texts_2),
+        'test_ids': np.array(test_ids, dtype=np.int64),
+        'embedding_matrix': build_embedding_matrix(word_index, word2vec, nb_words),
+    }
+    print('Shape of data tensor:', arrays['train_data_1'].shape)
+    print('Shape of label tensor:', arrays['train_labels'].shape)
+
+    tmp_dir = fold_dir + '.tmp%d' % os.getpid()
+    os.makedirs(tmp_dir)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_dir, name + '.npy'), arrays[name])
+    with open(os.path.join(tmp_dir, 'word_index.json'), 'w') as f:
+        json.dump(word_index, f)
+    meta = {'test_CVID': test_CVID,
+            'files': [train_file, valid_file, test_file],
+            'max_sequence_length': max_sequence_length,
+            'max_nb_words': max_nb_words,
+            'nb_words': nb_words}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    try:
+        os.rename(tmp_dir, fold_dir)
+    except OSError:
+        # Another process finished the same fold first
+        shutil.rmtree(tmp_dir)
+    return fold_dir
+
+
+def load_fold(fold_dir, mmap_mode='r'):
+    # Loads the fold artifacts; with mmap_mode='r' the arrays are shared
+    # through the page cache by every process reading the same fold.
+    data = {}
+    for name in ARRAYS:
+        data[name] = np.load(os.path.join(fold_dir, name + '.npy'), mmap_mode=mmap_mode)
+    with open(os.path.join(fold_dir, 'meta.json')) as f:
+        data['meta'] = json.load(f)
+    return data
+
+
+def load_word_index(fold_dir):
+    with open(os.path.join(fold_dir, 'word_index.json')) as f:
+        return json.load(f)
+
+
+#
+# Augment pairs and weights
+# ----------------------------------------------------------------------------
+def augment_pairs(data_1, data_2, labels):
+    # Both question orders, so the model sees every pair symmetrically
+    return (np.vstack((data_1, data_2)),
+            np.vstack((data_2, data_1)),
+            np.concatenate((labels, labels)))
+
+
+def sample_weights(labels, re_weight=True):
+    return rebalance.class_weights(labels, re_weight)
@@ -0,0 +1,147 @@
+"""
+Vectorized versions of the hand-made pair features of the xgboost notebooks.
+
+The notebooks compute them row by row with df.apply and two dicts per pair.
+Here both question columns are turned into binary sparse CSR matrices over
+one shared vocabulary (the words of str(q).lower().split(), stopwords left
+out), so that for all the pairs at once
+
+    shared words   row sums of Q1 .* Q2
+    words          row sums of Q1 and Q2
+
+and the word_match_share of the notebooks is 2 * shared / (words1 + words2),
+0 when either question has no word left. With a vector w of word weights
+(count_weights, idf_weights) the same sums become sparse matrix-vector
+products and give tfidf_word_match_share.
+
+tfidf_matrices() turns both columns into L2-normalised TF-IDF rows with one
+vectorizer (words, or character n-grams), and row_cosine() gives the cosine
+of every pair as the row sums of T1 .* T2, chunk by chunk over processes.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import multiprocessing
+import numpy as np
+
+
+def english_stopwords():
+    from nltk.corpus import stopwords
+    return set(stopwords.words("english"))
+
+
+#
+# Binary question matrices
+# ----------------------------------------------------------------------------
+def question_matrices(questions_1, questions_2, stops=None):
+    # Returns (Q1, Q2, vocabulary): CSR matrices with a 1 where the word of
+    # the column is in the question, and the words of the columns
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    if stops is None:
+        stops = english_stopwords()
+    n = len(questions_1)
+    vectorizer = CountVectorizer(analyzer=lambda q: [w for w in str(q).lower().split() if w not in stops],
+                                 binary=True, dtype=np.float64)
+    matrix = vectorizer.fit_transform([str(q) for q in questions_1] + [str(q) for q in questions_2]).tocsr()
+    vocabulary = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for word, j in vectorizer.vocabulary_.items():
+        vocabulary[j] = word
+    return matrix[:n], matrix[n:], vocabulary
+
+
+def weight_vector(vocabulary, weights):
+    # Weight of each column, 0 for the words without one
+    return np.array([weights.get(w, 0.) for w in vocabulary], dtype=np.float64)
+
+
+def _row_sums(matrix, weights=None):
+    if weights is None:
+        return np.asarray(matrix.sum(axis=1)).ravel()
+    return matrix.dot(weights)
+
+
+#
+# Features
+# ----------------------------------------------------------------------------
+def word_match_share(q1, q2):
+    # Share of the (non-stop) words of the pair that are in both questions
+    n1 = _row_sums(q1)
+    n2 = _row_sums(q2)
+    shared = _row_sums(q1.multiply(q2).tocsr())
+    empty = (n1 == 0) | (n2 == 0)
+    share = 2 * shared / np.where(empty, 1, n1 + n2)
+    share[empty] = 0
+    return share
+
+
+def tfidf_word_match_share(q1, q2, w):
+    # Weighted share of the words in both questions, w from weight_vector.
+    # 0 when either question has no word left, nan when all their words
+    # weigh 0, as the row function of the notebooks.
+    empty = (_row_sums(q1) == 0) | (_row_sums(q2) == 0)
+    shared = 2 * _row_sums(q1.multiply(q2).tocsr(), w)
+    total = _row_sums(q1, w) + _row_sums(q2, w)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = shared / total
+    share[empty] = 0
+    return share
+
+
+#
+# Word weights
+# ----------------------------------------------------------------------------
+def count_weights(texts, eps=10000, min_count=2):
+    # Weights of xgboost.ipynb: 1 / (count + eps) of every lower-cased word,
+    # 0 for the words seen less than min_count times (likely typos)
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    vectorizer = CountVectorizer(analyzer=lambda q: str(q).lower().split(), dtype=np.int64)
+    counts = np.asarray(vectorizer.fit_transform([str(q) for q in texts]).sum(axis=0)).ravel()
+    weights = np.where(counts < min_count, 0., 1. / (counts + eps))
+    return dict((word, weights[j]) for word, j in vectorizer.vocabulary_.items())
+
+
+def idf_weights(texts):
+    # Weights of xgboost_3.ipynb: idf of TfidfVectorizer(min_df=1)
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(min_df=1)
+    vectorizer.fit([str(q) for q in texts])
+    return dict((word, vectorizer.idf_[j]) for word, j in vectorizer.vocabulary_.items())
+
+
+#
+# TF-IDF cosine
+# ----------------------------------------------------------------------------
+def tfidf_matrices(questions_1, questions_2, analyzer='word', ngram_range=(1, 1), min_df=1):
+    # (T1, T2): L2-normalised TF-IDF CSR rows of both columns, from one
+    # TfidfVectorizer fitted over all the questions
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    n = len(questions_1)
+    vectorizer = TfidfVectorizer(analyzer=analyzer, ngram_range=ngram_range, min_df=min_df, dtype=np.float32)
+    matrix = vectorizer.fit_transform([str(q) for q in questions_1] + [str(q) for q in questions_2]).tocsr()
+    return matrix[:n], matrix[n:]
+
+
+def _row_dots(chunk):
+    t1, t2 = chunk
+    return _row_sums(t1.multiply(t2).tocsr())
+
+
+def row_cosine(t1, t2, chunk_size=200000, n_jobs=None):
+    # Cosine of every pair of rows of L2-normalised T1 and T2, 0 for the
+    # empty ones; chunks are spread over n_jobs processes (default: all cores)
+    chunks = [(t1[start:start + chunk_size], t2[start:start + chunk_size])
+              for start in range(0, t1.shape[0], chunk_size)]
+    n_jobs = min(n_jobs or os.cpu_count(), len(chunks))
+    if n_jobs <= 1:
+        dots = [_row_dots(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.get_context('spawn').Pool(n_jobs) as pool:
+            dots = pool.map(_row_dots, chunks)
+    return np.concatenate(dots) if dots else np.zeros(0)
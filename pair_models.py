@@ -0,0 +1,316 @@
+"""
+Model definitions of the question-pair scripts.
+
+    'lstm'           sample_LSTM.py
+    'cnn'            sample_cnn.py (fused and weight-tied since the 'fused' and
+                     'shared' parameters, see build_cnn)
+    'advanced_lstm'  advancedLSTM.py
+
+and the small student models distilled from ensembles of them (distill.py)
+
+    'bag'            mean of the word embeddings of each question
+    'small_cnn'      one shared width-3 convolution, max-pooled
+
+Hyperparameters are passed around as one dict (see sample_params) so that a
+run can be rebuilt, resumed or compared from its recorded parameters.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import numpy as np
+
+from keras import backend as K
+from keras.layers import Dense, Input, LSTM, Embedding, Dropout, Conv1D, MaxPooling1D, Flatten, Lambda
+from keras.layers import GlobalMaxPooling1D, ZeroPadding1D
+from keras import initializers
+from keras.constraints import Constraint
+from keras.layers.merge import concatenate
+from keras.models import Model
+from keras.layers.normalization import BatchNormalization
+
+import pair_data
+
+
+ARCHS = ('lstm', 'cnn', 'advanced_lstm')
+
+STUDENT_ARCHS = ('bag', 'small_cnn')
+
+STAMP_PREFIX = {'lstm': 'lstm', 'cnn': '2l_cnn', 'advanced_lstm': 'lstm'}
+
+
+#
+# Hyperparameters
+# ----------------------------------------------------------------------------
+def sample_params(arch, rng=np.random):
+    if arch not in ARCHS:
+        raise ValueError('Unknown model %r, expected one of %s' % (arch, ', '.join(ARCHS)))
+
+    if arch in ('cnn', 'advanced_lstm'):
+        # Fixed sizes in sample_cnn.py and advancedLSTM.py, only the dropout
+        # rates are sampled
+        num_lstm = 250
+        num_dense = 150
+    else:
+        num_lstm = rng.randint(175, 275)
+        num_dense = rng.randint(100, 150)
+    params = {'num_lstm': int(num_lstm),
+              'num_dense': int(num_dense),
+              'rate_drop_lstm': 0.15 + rng.rand() * 0.25,
+              'rate_drop_dense': 0.15 + rng.rand() * 0.25,
+              'act': 'relu'}
+
+    if arch == 'cnn':
+        params['num_filters'] = 50
+        params['filter_sizes'] = [3, 4, 5, 6, 8]
+        params['fused'] = True
+        params['shared'] = True
+    return params
+
+
+def make_stamp(arch, params):
+    return '%s_%d_%d_%.2f_%.2f' % (STAMP_PREFIX[arch], params['num_lstm'], params['num_dense'],
+                                   params['rate_drop_lstm'], params['rate_drop_dense'])
+
+
+#
+# Model structures
+# ----------------------------------------------------------------------------
+def build_model(arch, embedding_matrix, params, max_sequence_length=pair_data.MAX_SEQUENCE_LENGTH):
+    builders = {'lstm': build_lstm, 'cnn': build_cnn, 'advanced_lstm': build_advanced_lstm,
+                'bag': build_bag, 'small_cnn': build_small_cnn}
+    if arch not in builders:
+        raise ValueError('Unknown model %r, expected one of %s' % (arch, ', '.join(ARCHS + STUDENT_ARCHS)))
+    return builders[arch](embedding_matrix, params, max_sequence_length)
+
+
+def _embedding_layer(embedding_matrix, max_sequence_length):
+    return Embedding(embedding_matrix.shape[0],
+                     embedding_matrix.shape[1],
+                     weights=[embedding_matrix],
+                     input_length=max_sequence_length,
+                     trainable=False)
+
+
+def _classifier(merged, params):
+    # Dense head shared by all the architectures. bn_momentum is only set for
+    # gradient accumulation (grad_accum.adjust_params)
+    momentum = params.get('bn_momentum', 0.99)
+    merged = Dropout(params['rate_drop_dense'])(merged)
+
+    merged = BatchNormalization(momentum=momentum)(merged)
+    merged = Dense(params['num_dense'], activation=params['act'])(merged)
+    merged = Dropout(params['rate_drop_dense'])(merged)
+
+    merged = BatchNormalization(momentum=momentum)(merged)
+    return Dense(1, activation='sigmoid')(merged)
+
+
+def build_lstm(embedding_matrix, params, max_sequence_length=pair_data.MAX_SEQUENCE_LENGTH):
+    embedding_layer = _embedding_layer(embedding_matrix, max_sequence_length)
+    lstm_layer = LSTM(params['num_lstm'], dropout=params['rate_drop_lstm'], recurrent_dropout=params['rate_drop_lstm'])
+
+    sequence_1_input = Input(shape=(max_sequence_length,), dtype='int32')
+    embedded_sequences_1 = embedding_layer(sequence_1_input)
+    x1 = lstm_layer(embedded_sequences_1)
+
+    sequence_2_input = Input(shape=(max_sequence_length,), dtype='int32')
+    embedded_sequences_2 = embedding_layer(sequence_2_input)
+    y1 = lstm_layer(embedded_sequences_2)
+
+    preds = _classifier(concatenate([x1, y1]), params)
+    return Model(inputs=[sequence_1_input, sequence_2_input], outputs=preds)
+
+
+def build_advanced_lstm(embedding_matrix, params, max_sequence_length=pair_data.MAX_SEQUENCE_LENGTH):
+    embedding_layer = _embedding_layer(embedding_matrix, max_sequence_length)
+    lstm_layer = LSTM(params['num_lstm'], dropout=params['rate_drop_lstm'], recurrent_dropout=params['rate_drop_lstm'])
+
+    sequence_1_input = Input(shape=(max_sequence_length,), dtype='int32')
+    embedded_sequences_1 = embedding_layer(sequence_1_input)
+    trans_embedded_sequences_1 = Dense(params['num_dense'], activation=params['act'])(embedded_sequences_1)
+    trans_embedded_sequences_1 = Dropout(params['rate_drop_dense'])(trans_embedded_sequences_1)
+    trans_merged1 = concatenate([embedded_sequences_1, trans_embedded_sequences_1])
+    x1 = lstm_layer(trans_merged1)
+
+    sequence_2_input = Input(shape=(max_sequence_length,), dtype='int32')
+    embedded_sequences_2 = embedding_layer(sequence_2_input)
+    trans_embedded_sequences_2 = Dense(params['num_dense'], activation=params['act'])(embedded_sequences_2)
+    trans_embedded_sequences_2 = Dropout(params['rate_drop_dense'])(trans_embedded_sequences_2)
+    trans_merged2 = concatenate([embedded_sequences_2, trans_embedded_sequences_2])
+    x2 = lstm_layer(trans_merged2)
+
+    preds = _classifier(concatenate([x1, x2]), params)
+    return Model(inputs=[sequence_1_input, sequence_2_input], outputs=preds)
+
+
+def _conv_tower(embedded_sequences, params, prefix=''):
+    conv_blocks = []
+    for ks in params['filter_sizes']:
+        conv = Conv1D(filters=params['num_filters'],
+                      kernel_size=ks,
+                      padding='valid',
+                      activation="relu",
+                      strides=1,
+                      name=prefix + 'conv1_w%d' % ks)(embedded_sequences)
+        conv = MaxPooling1D(pool_size=2)(conv)
+        conv = Conv1D(filters=params['num_filters'],
+                      kernel_size=ks,
+                      padding='valid',
+                      activation="relu",
+                      strides=1,
+                      name=prefix + 'conv2_w%d' % ks)(conv)
+        conv = MaxPooling1D(pool_size=2)(conv)
+        conv = Flatten()(conv)
+        conv_blocks.append(conv)
+    return concatenate(conv_blocks) if len(conv_blocks) > 1 else conv_blocks[0]
+
+
+class TapMask(Constraint):
+    # Keeps the masked taps of a fused kernel at zero after every update
+    def __init__(self, mask):
+        self.mask = np.asarray(mask, dtype='float32')
+
+    def __call__(self, w):
+        return w * K.constant(self.mask)
+
+    def get_config(self):
+        return {'mask': self.mask.tolist()}
+
+
+def tap_mask(filter_sizes, num_filters):
+    # (max width, 1, widths * filters): width ks uses the first ks taps of
+    # its own block of filters
+    mask = np.zeros((max(filter_sizes), 1, num_filters * len(filter_sizes)), dtype='float32')
+    for w, ks in enumerate(filter_sizes):
+        mask[:ks, :, w * num_filters:(w + 1) * num_filters] = 1
+    return mask
+
+
+def _masked_glorot(mask):
+    def init(shape, dtype=None):
+        return initializers.glorot_uniform()(shape, dtype=dtype) * K.constant(mask)
+    return init
+
+
+def _fused_conv_tower(embedded_sequences, params, max_sequence_length, prefix=''):
+    # Same function as _conv_tower, with the first convolutions of all the
+    # widths computed by one convolution of the widest kernel over the
+    # right-padded sequence, the kernel of width ks being left-aligned and
+    # zero past its ks taps. The outputs past the valid positions of each
+    # width are cropped before its second convolution.
+    filter_sizes = params['filter_sizes']
+    num_filters = params['num_filters']
+    mask = tap_mask(filter_sizes, num_filters)
+
+    conv = ZeroPadding1D(padding=(0, max(filter_sizes) - 1))(embedded_sequences)
+    conv = Conv1D(filters=num_filters * len(filter_sizes),
+                  kernel_size=max(filter_sizes),
+                  padding='valid',
+                  activation="relu",
+                  strides=1,
+                  kernel_initializer=_masked_glorot(mask),
+                  kernel_constraint=TapMask(mask),
+                  name=prefix + 'conv1_fused')(conv)
+    conv = MaxPooling1D(pool_size=2)(conv)
+
+    conv_blocks = []
+    for w, ks in enumerate(filter_sizes):
+        length = (max_sequence_length - ks + 1) // 2
+        block = Lambda(lambda t, w=w, length=length: t[:, :length, w * num_filters:(w + 1) * num_filters])(conv)
+        block = Conv1D(filters=num_filters,
+                       kernel_size=ks,
+                       padding='valid',
+                       activation="relu",
+                       strides=1,
+                       name=prefix + 'conv2_w%d' % ks)(block)
+        block = MaxPooling1D(pool_size=2)(block)
+        block = Flatten()(block)
+        conv_blocks.append(block)
+    return concatenate(conv_blocks) if len(conv_blocks) > 1 else conv_blocks[0]
+
+
+def build_cnn(embedding_matrix, params, max_sequence_length=pair_data.MAX_SEQUENCE_LENGTH):
+    # params['fused'] computes all the filter widths with one convolution,
+    # params['shared'] runs both questions through one weight-tied tower as
+    # one stacked batch. Runs recorded before these keys are the unfused,
+    # unshared model.
+    embedding_layer = _embedding_layer(embedding_matrix, max_sequence_length)
+    if params.get('fused', False):
+        tower = lambda t, prefix: _fused_conv_tower(t, params, max_sequence_length, prefix)
+    else:
+        tower = lambda t, prefix: _conv_tower(t, params, prefix)
+
+    sequence_1_input = Input(shape=(max_sequence_length,), dtype='int32')
+    sequence_2_input = Input(shape=(max_sequence_length,), dtype='int32')
+
+    if params.get('shared', False):
+        # The 'encoder' and 'head' sub-models let the encodings of unique
+        # questions be computed once and reused (train_pair.predict_pairs_encoded)
+        encoder_input = Input(shape=(max_sequence_length,), dtype='int32')
+        encoder = Model(encoder_input, tower(embedding_layer(encoder_input), ''), name='encoder')
+        head_input = Input(shape=(2 * K.int_shape(encoder.output)[1],))
+        head = Model(head_input, _classifier(head_input, params), name='head')
+
+        stacked = Lambda(lambda t: K.concatenate(t, axis=0))([sequence_1_input, sequence_2_input])
+        convs = encoder(stacked)
+        convs1 = Lambda(lambda t: t[:K.shape(t)[0] // 2])(convs)
+        convs2 = Lambda(lambda t: t[K.shape(t)[0] // 2:])(convs)
+        preds = head(concatenate([convs1, convs2]))
+    else:
+        convs1 = tower(embedding_layer(sequence_1_input), 'q1_')
+        convs2 = tower(embedding_layer(sequence_2_input), 'q2_')
+        preds = _classifier(concatenate([convs1, convs2]), params)
+
+    return Model(inputs=[sequence_1_input, sequence_2_input], outputs=preds)
+
+
+#
+# Student models
+# ----------------------------------------------------------------------------
+def _masked_mean(inputs):
+    # Mean of the embeddings of the non-padding tokens
+    embedded, ids = inputs
+    mask = K.cast(K.not_equal(ids, 0), K.floatx())
+    count = K.maximum(K.sum(mask, axis=1, keepdims=True), 1.)
+    return K.sum(embedded * K.expand_dims(mask), axis=1) / count
+
+
+def _symmetric_head(u, v, params):
+    # Same prediction for both question orders
+    diff = Lambda(lambda t: K.abs(t[0] - t[1]))([u, v])
+    prod = Lambda(lambda t: t[0] * t[1])([u, v])
+    merged = concatenate([diff, prod])
+    merged = Dense(params['num_dense'], activation=params['act'])(merged)
+    merged = Dropout(params['rate_drop_dense'])(merged)
+    return Dense(1, activation='sigmoid')(merged)
+
+
+def build_bag(embedding_matrix, params, max_sequence_length=pair_data.MAX_SEQUENCE_LENGTH):
+    embedding_layer = _embedding_layer(embedding_matrix, max_sequence_length)
+    mean_layer = Lambda(_masked_mean)
+
+    sequence_1_input = Input(shape=(max_sequence_length,), dtype='int32')
+    u = mean_layer([embedding_layer(sequence_1_input), sequence_1_input])
+
+    sequence_2_input = Input(shape=(max_sequence_length,), dtype='int32')
+    v = mean_layer([embedding_layer(sequence_2_input), sequence_2_input])
+
+    preds = _symmetric_head(u, v, params)
+    return Model(inputs=[sequence_1_input, sequence_2_input], outputs=preds)
+
+
+def build_small_cnn(embedding_matrix, params, max_sequence_length=pair_data.MAX_SEQUENCE_LENGTH):
+    embedding_layer = _embedding_layer(embedding_matrix, max_sequence_length)
+    conv_layer = Conv1D(filters=params['num_filters'], kernel_size=3, padding='same', activation='relu')
+    pool_layer = GlobalMaxPooling1D()
+
+    sequence_1_input = Input(shape=(max_sequence_length,), dtype='int32')
+    u = pool_layer(conv_layer(embedding_layer(sequence_1_input)))
+
+    sequence_2_input = Input(shape=(max_sequence_length,), dtype='int32')
+    v = pool_layer(conv_layer(embedding_layer(sequence_2_input)))
+
+    preds = _symmetric_head(u, v, params)
+    return Model(inputs=[sequence_1_input, sequence_2_input], outputs=preds)
@@ -0,0 +1,104 @@
+"""
+Class rebalancing of the training pairs by sample weights.
+
+The test set has about 16.5% duplicates against 36.9% in train. The xgboost
+notebooks shift the prior by oversampling the negative pairs with repeated
+pd.concat, which copies the frame and grows the DMatrix. Weighting every
+negative row by
+
+    w = pos * (1 - p) / (p * neg)
+
+gives the same prior p = pos / (pos + w * neg) without duplicating a row
+(the neural models and the blend do the same with CLASS_WEIGHT, for
+p = 0.175, see class_weights()).
+
+notebook_weight() gives the weight equivalent to the oversampling loop of
+the notebooks itself, whose doubling overshoots the target p, for runs that
+must match the old boosters.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import numpy as np
+
+
+TARGET_SHARE = 0.165
+
+# Class weights to fit the 17.5% share in test set
+CLASS_WEIGHT = {0: 1.309028344, 1: 0.472001959}
+
+
+#
+# Weights
+# ----------------------------------------------------------------------------
+def negative_weight(labels, p=TARGET_SHARE):
+    labels = np.asarray(labels)
+    pos = float(np.sum(labels == 1))
+    neg = float(np.sum(labels == 0))
+    return pos * (1 - p) / (p * neg)
+
+
+def notebook_weight(labels, p=TARGET_SHARE):
+    # Copies of each negative row made by the notebooks' loop
+    #     scale = pos / (pos + neg) / p - 1
+    #     while scale > 1: neg = concat([neg, neg]); scale -= 1
+    #     neg = concat([neg, neg[:int(scale * len(neg))]])
+    # (up to the rows of the last, partial copy)
+    labels = np.asarray(labels)
+    scale = np.mean(labels == 1) / p - 1
+    copies = 1.
+    while scale > 1:
+        copies *= 2
+        scale -= 1
+    return copies * (1 + scale)
+
+
+def sample_weights(labels, p=TARGET_SHARE, neg_weight=None):
+    # 1 for the positive rows, the negative weight for the others
+    labels = np.asarray(labels)
+    if neg_weight is None:
+        neg_weight = negative_weight(labels, p)
+    weights = np.ones(len(labels), dtype=np.float32)
+    weights[labels == 0] = neg_weight
+    return weights
+
+
+def class_weights(labels, re_weight=True):
+    # CLASS_WEIGHT of every row, or 1 without re_weight
+    labels = np.asarray(labels)
+    weights = np.ones(len(labels))
+    if re_weight:
+        weights *= CLASS_WEIGHT[1]
+        weights[labels == 0] = CLASS_WEIGHT[0]
+    return weights
+
+
+def effective_share(labels, weights):
+    labels = np.asarray(labels)
+    return float(np.sum(weights[labels == 1]) / np.sum(weights))
+
+
+def weighted_dmatrix(x, labels, p=TARGET_SHARE, neg_weight=None, **kwargs):
+    # DMatrix of the rows as they are, rebalanced by weight
+    import xgboost as xgb
+
+    weights = sample_weights(labels, p, neg_weight)
+    print('Effective positive share %.3f' % effective_share(labels, weights))
+    return xgb.DMatrix(x, label=labels, weight=weights, **kwargs)
+
+
+#
+# Index sampler
+# ----------------------------------------------------------------------------
+def oversample_index(labels, p=TARGET_SHARE, rng=np.random):
+    # Row indices with each negative repeated w times on average (the whole
+    # part of w for every row, one more for a random fraction of them), for
+    # learners without sample weights
+    labels = np.asarray(labels)
+    w = negative_weight(labels, p)
+    pos = np.flatnonzero(labels == 1)
+    neg = np.flatnonzero(labels == 0)
+    extra = rng.choice(neg, int(round((w - int(w)) * len(neg))), replace=False)
+    return np.concatenate([pos] + [neg] * int(w) + [extra])
@@ -0,0 +1,124 @@
+"""
+Registry of finished runs, keyed by a hash of their full configuration.
+
+    python run_registry.py [REGISTRY_DIR]
+
+The configuration of a run is the data version of its fold (content hash
+of the fold's arrays and json files), the code version (content hash of
+CODE_FILES, the modules that build and train the models), the architecture,
+the hyperparameters, the seed and the training options. train_pair.run_fold looks it up before
+training: a configuration already in the registry returns its recorded
+report (metrics, artifact paths, timings) with 'cached': True, as long as
+its artifacts still exist. Every finished run is recorded as
+REGISTRY_DIR/<KEY>.json, one file per run so that parallel folds never
+write the same file.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import hashlib
+
+import data_paths
+
+
+REGISTRY_DIR = 'registry/'
+
+# Modules whose code changes the trained model or its scores
+CODE_FILES = ('pair_data.py', 'pair_models.py', 'train_pair.py', 'checkpoint.py', 'grad_accum.py')
+
+# Report entries that are files the cached result depends on
+ARTIFACTS = ('bst_model_path', 'oof_path', 'test_preds_path', 'submission_path')
+
+
+#
+# Configuration
+# ----------------------------------------------------------------------------
+def data_version(fold_dir):
+    # Changes with the content of the fold arrays, not only their shapes
+    return data_paths.fold_hash(fold_dir)
+
+
+def code_version():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return data_paths.data_hash([os.path.join(here, name) for name in CODE_FILES])
+
+
+def make_config(arch, fold_dir, params, seed=None, **options):
+    return {'data': data_version(fold_dir),
+            'code': code_version(),
+            'arch': arch,
+            'params': params,
+            'seed': seed,
+            'options': options}
+
+
+def config_key(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+#
+# Lookup and record
+# ----------------------------------------------------------------------------
+def lookup(registry_dir, config):
+    # The recorded run of this configuration, None if there is none or its
+    # artifacts are gone
+    path = os.path.join(registry_dir, config_key(config) + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        entry = json.load(f)
+    missing = [entry['report'][k] for k in ARTIFACTS if k in entry['report'] and
+               not os.path.exists(entry['report'][k])]
+    if missing:
+        print('Registry entry %s is missing %s, running again' % (entry['key'], ', '.join(missing)))
+        return None
+    return entry
+
+
+def record(registry_dir, config, report):
+    if not os.path.exists(registry_dir):
+        os.makedirs(registry_dir)
+    key = config_key(config)
+    entry = {'key': key,
+             'config': config,
+             'report': report,
+             'host': socket.gethostname(),
+             'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    path = os.path.join(registry_dir, key + '.json')
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, path)
+    return key
+
+
+def entries(registry_dir=REGISTRY_DIR):
+    found = []
+    for path in glob.glob(os.path.join(registry_dir, '*.json')):
+        with open(path) as f:
+            found.append(json.load(f))
+    return sorted(found, key=lambda e: e['created'])
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main(registry_dir):
+    print('%-16s %-19s %-14s %4s %8s %8s  %s' % ('key', 'created', 'arch', 'cv', 'oof', 'time (s)', 'stamp'))
+    for e in entries(registry_dir):
+        r = e['report']
+        print('%-16s %-19s %-14s %4s %8.4f %8.0f  %s' % (e['key'], e['created'], e['config']['arch'],
+                                                        r.get('test_CVID'), r.get('oof_logloss', float('nan')),
+                                                        r.get('total_time', 0), r.get('stamp')))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else REGISTRY_DIR)
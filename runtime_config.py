@@ -0,0 +1,121 @@
+"""
+CPU threading and affinity of the training and inference processes.
+
+configure() sets, for the calling process,
+    - the CPU affinity (sched_setaffinity)
+    - OMP_NUM_THREADS / MKL_NUM_THREADS / KMP_BLOCKTIME / KMP_AFFINITY
+    - the intra- and inter-op thread pools of the Keras TF session
+from a profile ('train' or 'inference'), then the settings bench_threads.py
+recorded as best for this host and model, then the environment:
+
+    RUNTIME_CPUS=0-7,16-23    cores of this process (default: all allowed)
+    RUNTIME_PROFILE=inference profile
+    TF_INTRA_THREADS=8        intra-op threads (default: one per core)
+    TF_INTER_THREADS=2        inter-op threads
+
+so several scripts run side by side on disjoint cores without oversubscribing
+the host. It must be called before TensorFlow is imported: the OpenMP/MKL
+variables are read when the runtime starts.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import sys
+import json
+import socket
+import multiprocessing
+
+
+PROFILES = {
+    # Large batches, few concurrent ops: all threads inside the ops
+    'train': {'inter_op': 2, 'kmp_blocktime': 1, 'kmp_affinity': 'granularity=fine,compact,1,0'},
+    # Small batches for latency: one op at a time, threads released early
+    'inference': {'inter_op': 1, 'kmp_blocktime': 0, 'kmp_affinity': 'granularity=fine,compact,1,0'},
+}
+
+# Best settings per host, model and profile, written by bench_threads.py
+SETTINGS_FILE = os.environ.get('RUNTIME_SETTINGS', 'runtime_settings.json')
+
+
+#
+# Settings
+# ----------------------------------------------------------------------------
+def parse_cpus(spec):
+    # '0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for part in spec.split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def allowed_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def load_settings(path=SETTINGS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def host_settings(model, profile, n_cpus, path=SETTINGS_FILE):
+    # Recorded best for this host and model on the largest benchmarked core
+    # count not above n_cpus, or {}
+    recorded = load_settings(path).get(socket.gethostname(), {}).get(model, {}).get(profile, {})
+    counts = [int(n) for n in recorded if int(n) <= n_cpus]
+    if not counts:
+        return {}
+    best = dict(recorded[str(max(counts))])
+    # The intra-op pool follows the cores actually given
+    best.pop('intra_op', None)
+    best.pop('samples_per_sec', None)
+    return best
+
+
+def resolve(profile='train', cpus=None, model=None, **overrides):
+    profile = os.environ.get('RUNTIME_PROFILE', profile)
+    if cpus is None:
+        cpus = parse_cpus(os.environ['RUNTIME_CPUS']) if 'RUNTIME_CPUS' in os.environ else allowed_cpus()
+    settings = dict(PROFILES[profile], profile=profile, cpus=list(cpus), intra_op=len(cpus))
+    if model is not None:
+        settings.update(host_settings(model, profile, len(cpus)))
+    if 'TF_INTRA_THREADS' in os.environ:
+        settings['intra_op'] = int(os.environ['TF_INTRA_THREADS'])
+    if 'TF_INTER_THREADS' in os.environ:
+        settings['inter_op'] = int(os.environ['TF_INTER_THREADS'])
+    settings.update(overrides)
+    settings['inter_op'] = min(settings['inter_op'], settings['intra_op'])
+    return settings
+
+
+#
+# Apply
+# ----------------------------------------------------------------------------
+def configure(profile='train', cpus=None, model=None, **overrides):
+    # Returns the settings applied to this process
+    settings = resolve(profile, cpus, model, **overrides)
+    if 'tensorflow' in sys.modules:
+        print('runtime_config: TensorFlow already imported, OMP/MKL settings may not apply')
+
+    os.environ['OMP_NUM_THREADS'] = str(settings['intra_op'])
+    os.environ['MKL_NUM_THREADS'] = str(settings['intra_op'])
+    os.environ['KMP_BLOCKTIME'] = str(settings['kmp_blocktime'])
+    os.environ['KMP_AFFINITY'] = settings['kmp_affinity']
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, settings['cpus'])
+
+    import tensorflow as tf
+    from keras import backend as K
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=settings['intra_op'],
+                                                   inter_op_parallelism_threads=settings['inter_op'])))
+    return settings
@@ -0,0 +1,90 @@
+"""
+Submission csv files of the test predictions, written chunk by chunk.
+
+Kept apart from train_pair.py so that the xgboost scripts can write their
+submissions without importing keras.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import gzip
+import numpy as np
+
+
+#
+# Write the submission
+# ----------------------------------------------------------------------------
+def submission_path(bst_val_score, stamp, out_dir='.', compress=False):
+    return os.path.join(out_dir, '%.4f_' % (bst_val_score) + stamp + ('.csv.gz' if compress else '.csv'))
+
+
+def open_submission(path):
+    # Text handle with the header written, gzipped for .gz
+    f = gzip.open(path, 'wt', compresslevel=1) if path.endswith('.gz') else open(path, 'w')
+    f.write('test_id,is_duplicate\n')
+    return f
+
+
+POWERS = 10 ** np.arange(19, dtype=np.int64)
+
+
+def format_rows(ids, preds):
+    # "id,pred" lines of one chunk, built digit by digit in a byte buffer
+    # with array operations. The predictions are written as %.6e, 7
+    # significant digits of fixed width, so that tiny probabilities, which
+    # %.6f would round to 0 and the logloss would punish, keep their digits;
+    # below 1e-99 (3 exponent digits) they are written as 0.
+    ids = np.asarray(ids, dtype=np.int64)
+    preds = np.asarray(preds, dtype=np.float64)
+    if not np.all(np.isfinite(preds)):
+        raise ValueError('Predictions must be finite')
+    if len(ids) == 0:
+        return ''
+    preds = np.where(preds < 1e-99, 0, preds)
+
+    # Row: id digits, then ',d.dddddde+dd\n', 14 bytes
+    n_digits = np.maximum(np.searchsorted(POWERS, ids, side='right'), 1)
+    ends = np.cumsum(n_digits + 14)
+    comma = ends - 14
+    buf = np.empty(ends[-1], dtype=np.uint8)
+    for d in range(n_digits.max()):
+        rows = n_digits > d
+        buf[comma[rows] - 1 - d] = 48 + ids[rows] // POWERS[d] % 10
+
+    # 7 digit mantissa and exponent; rounding up to 10.000000 moves to the
+    # next power of ten
+    exponent = np.zeros(len(preds), dtype=np.int64)
+    positive = preds > 0
+    exponent[positive] = np.floor(np.log10(preds[positive]))
+    mantissa = np.rint(preds * 10.0 ** (6 - exponent)).astype(np.int64)
+    over = mantissa >= POWERS[7]
+    exponent[over] += 1
+    mantissa[over] //= 10
+
+    buf[comma] = ord(',')
+    buf[comma + 1] = 48 + mantissa // POWERS[6]
+    buf[comma + 2] = ord('.')
+    for d in range(6):
+        buf[comma + 8 - d] = 48 + mantissa // POWERS[d] % 10
+    buf[comma + 9] = ord('e')
+    buf[comma + 10] = np.where(exponent < 0, ord('-'), ord('+'))
+    buf[comma + 11] = 48 + np.abs(exponent) // 10
+    buf[comma + 12] = 48 + np.abs(exponent) % 10
+    buf[comma + 13] = ord('\n')
+    return buf.tobytes().decode('ascii')
+
+
+def write_rows(f, ids, preds):
+    # Appends one chunk to the open submission
+    f.write(format_rows(ids, preds))
+
+
+def write_submission(test_ids, preds, bst_val_score, stamp, out_dir='.', compress=False, chunk_size=200000):
+    path = submission_path(bst_val_score, stamp, out_dir, compress)
+    with open_submission(path) as f:
+        for start in range(0, len(test_ids), chunk_size):
+            write_rows(f, test_ids[start:start + chunk_size], preds[start:start + chunk_size])
+    return path
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+import data_parallel
+
+
+def one_step(rank, n_workers, exchange, stop_flag, weights, x, y, optimizer):
+    # One step of a model without dropout nor BatchNormalization, its batch
+    # split between the workers as in train_worker
+    from keras.layers import Dense, Input
+    from keras.models import Model
+
+    inputs = Input(shape=(x.shape[1],))
+    model = Model(inputs, Dense(1, activation='sigmoid')(Dense(4, activation='tanh')(inputs)))
+    model.compile(optimizer=optimizer, loss='binary_crossentropy')
+    model.set_weights(weights)
+    grad_fn, apply_fn = data_parallel.build_step_functions(model)
+
+    shard = np.arange(rank, len(x), n_workers)
+    sizes = [len(x[r::n_workers]) for r in range(n_workers)]
+    grads = grad_fn([x[shard], y[shard][:, None], np.ones(len(shard)), 1])
+    avg = exchange.allreduce(rank, data_parallel._flatten(grads), weights=sizes)
+    apply_fn(data_parallel._unflatten(avg, grads))
+    return model.get_weights()
+
+
+@pytest.mark.parametrize('optimizer', ['sgd', 'adam'])
+def test_allreduce_matches_single_process(optimizer):
+    rng = np.random.RandomState(0)
+    weights = [rng.randn(3, 4).astype(np.float32), rng.randn(4).astype(np.float32),
+               rng.randn(4, 1).astype(np.float32), rng.randn(1).astype(np.float32)]
+    # Shards of 6 and 5 pairs
+    job = {'weights': weights, 'x': rng.randn(11, 3).astype(np.float32),
+           'y': (rng.rand(11) < 0.4).astype(np.float32), 'optimizer': optimizer}
+    n_params = sum(w.size for w in weights)
+
+    single = data_parallel.run(1, job, n_params=n_params, train_fn=one_step)
+    parallel = data_parallel.run(2, job, n_params=n_params, train_fn=one_step)
+    for w, expected in zip(single[0], weights):
+        assert not np.allclose(w, expected)
+    for rank in (0, 1):
+        for w, expected in zip(parallel[rank], single[0]):
+            np.testing.assert_allclose(w, expected, rtol=1e-5, atol=1e-6)
+
+
+def crash(rank, n_workers, exchange, stop_flag):
+    if rank == 1:
+        # Killed without reporting, as by the OOM killer
+        os._exit(1)
+    exchange.allreduce(rank, np.zeros(1, dtype=np.float32))
+
+
+def test_killed_worker():
+    # Worker 0 waits at the barrier until the parent finds worker 1 dead
+    results = data_parallel.run(2, {}, n_params=1, train_fn=crash, timeout=1)
+    assert results == {0: None, 1: None}
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+import distill
+import pair_models
+
+
+def test_weight_bytes_shared_cnns():
+    # Two weight-tied CNNs, their Embedding nested in the 'encoder' model
+    embedding_matrix = np.random.RandomState(0).rand(50, 7).astype(np.float32)
+    models = []
+    for seed in (1, 2):
+        params = pair_models.sample_params('cnn', np.random.RandomState(seed))
+        assert params['shared']
+        models.append(pair_models.build_model('cnn', embedding_matrix, params, max_sequence_length=12))
+
+    # Every weight of both models, the embedding matrix once
+    expected = 4 * (sum(m.count_params() for m in models) - embedding_matrix.size)
+    assert distill.weight_bytes(models) == expected
+    assert distill.weight_bytes(models[:1]) == 4 * models[0].count_params()
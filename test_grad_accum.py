@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip('keras')
+
+from keras.layers import Dense, Input
+from keras.models import Model
+from keras import optimizers
+
+import grad_accum
+
+
+accum_steps = 4
+batch_size = 8
+
+
+def tiny_model(optimizer, weights=None):
+    x = Input(shape=(3,))
+    y = Dense(1, activation='sigmoid')(Dense(5, activation='tanh')(x))
+    model = Model(x, y)
+    model.compile(optimizer=optimizer, loss='binary_crossentropy')
+    if weights is not None:
+        model.set_weights(weights)
+    return model
+
+
+@pytest.mark.parametrize('make_optimizer', [lambda: optimizers.SGD(lr=0.1),
+                                            lambda: optimizers.SGD(lr=0.1, momentum=0.9),
+                                            lambda: optimizers.Adam(lr=0.01)])
+def test_accumulated_steps_match_large_batch(make_optimizer):
+    rng = np.random.RandomState(0)
+    x = rng.randn(2 * accum_steps * batch_size, 3).astype(np.float32)
+    y = (rng.rand(len(x)) < 0.4).astype(np.float32)
+
+    large = tiny_model(make_optimizer())
+    accum = tiny_model(grad_accum.AccumOptimizer(make_optimizer(), accum_steps), large.get_weights())
+
+    # Two effective batches, so that the optimizer state (momentum, Adam
+    # moments) carried between updates is compared too
+    for start in range(0, len(x), accum_steps * batch_size):
+        stop = start + accum_steps * batch_size
+        before = accum.get_weights()
+        for i in range(start, stop, batch_size):
+            if i > start:
+                # No update before the last micro-batch
+                for w, b in zip(accum.get_weights(), before):
+                    np.testing.assert_array_equal(w, b)
+            accum.train_on_batch(x[i:i + batch_size], y[i:i + batch_size])
+        large.train_on_batch(x[start:stop], y[start:stop])
+        for w, expected in zip(accum.get_weights(), large.get_weights()):
+            np.testing.assert_allclose(w, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_adjust_params():
+    params = {'bn_momentum': grad_accum.BN_MOMENTUM, 'lr': 0.001}
+    assert grad_accum.adjust_params(params, 1) is params
+    adjusted = grad_accum.adjust_params(params, accum_steps)
+    # accum_steps micro-batch updates decay the moving averages as one did
+    assert adjusted['bn_momentum'] ** accum_steps == pytest.approx(grad_accum.BN_MOMENTUM)
+    assert adjusted['lr'] == params['lr']
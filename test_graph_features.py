@@ -0,0 +1,29 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+import graph_features
+
+
+def to_csr(g):
+    edges = np.array(g.edges(), dtype=np.int64).reshape(-1, 2)
+    return graph_features.adjacency(edges[:, 0], edges[:, 1], g.number_of_nodes())
+
+
+@pytest.mark.parametrize('g', [nx.gnm_random_graph(300, 1200, seed=1), nx.path_graph(50),
+                               nx.complete_graph(8), nx.barabasi_albert_graph(200, 3, seed=2),
+                               nx.empty_graph(5)])
+def test_kcore(g):
+    expected = nx.core_number(g)
+    core = graph_features.kcore(to_csr(g))
+    np.testing.assert_array_equal(core, [expected[v] for v in range(g.number_of_nodes())])
+
+
+def test_pair_features():
+    questions_1 = ['a', 'a', 'b', 'd', np.nan]
+    questions_2 = ['b', 'c', 'c', 'e', 'd']
+    features = graph_features.pair_features(questions_1, questions_2, verbose=0)
+    np.testing.assert_array_equal(features['q1_degree'], [2, 2, 2, 2, 1])
+    np.testing.assert_array_equal(features['common_neighbours'], [1, 1, 1, 0, 0])
+    np.testing.assert_array_equal(features['q1_kcore'], [2, 2, 2, 1, 1])
+    np.testing.assert_array_equal(features['component_size'], [3, 3, 3, 3, 3])
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pair_features
+
+
+stops = set(['the', 'a', 'is', 'what', 'how', 'of', 'to', 'i'])
+
+
+# Row function of the xgboost notebooks
+def word_match_share(row):
+    q1words = {}
+    q2words = {}
+    for word in str(row['question1']).lower().split():
+        if word not in stops:
+            q1words[word] = 1
+    for word in str(row['question2']).lower().split():
+        if word not in stops:
+            q2words[word] = 1
+    if len(q1words) == 0 or len(q2words) == 0:
+        return 0
+    shared_words_in_q1 = [w for w in q1words.keys() if w in q2words]
+    shared_words_in_q2 = [w for w in q2words.keys() if w in q1words]
+    R = (len(shared_words_in_q1) + len(shared_words_in_q2))/(len(q1words) + len(q2words))
+    return R
+
+
+def tfidf_word_match_share(row, weights):
+    q1words = {}
+    q2words = {}
+    for word in str(row['question1']).lower().split():
+        if word not in stops:
+            q1words[word] = 1
+    for word in str(row['question2']).lower().split():
+        if word not in stops:
+            q2words[word] = 1
+    if len(q1words) == 0 or len(q2words) == 0:
+        return 0
+
+    shared_weights = [weights.get(w, 0) for w in q1words.keys() if w in q2words] + [weights.get(w, 0) for w in q2words.keys() if w in q1words]
+    total_weights = [weights.get(w, 0) for w in q1words] + [weights.get(w, 0) for w in q2words]
+
+    R = np.sum(shared_weights) / np.sum(total_weights)
+    return R
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'question1': ['What is the best way to learn Python?', 'How do I lose weight?', 'What is the',
+                      'Is the moon made of cheese cheese?', np.nan, 'Why is SKY blue',
+                      'Which laptop should I buy?', 'Do cats dream?', 'Rare zyzzyva'],
+        'question2': ['How to learn python fast?', 'How can I lose weight fast fast?', 'What is love?',
+                      'The moon: cheese or rock?', 'Why is the sky blue?', 'why is sky blue?',
+                      'What is the', np.nan, 'quokka'],
+    })
+
+
+def test_word_match_share(df):
+    q1, q2, vocabulary = pair_features.question_matrices(df['question1'], df['question2'], stops)
+    expected = df.apply(word_match_share, axis=1, raw=False).values
+    np.testing.assert_allclose(pair_features.word_match_share(q1, q2), expected)
+
+
+def test_tfidf_word_match_share(df):
+    q1, q2, vocabulary = pair_features.question_matrices(df['question1'], df['question2'], stops)
+    texts = pd.concat([df['question1'], df['question2']]).astype(str)
+    weights = pair_features.count_weights(texts, eps=10)
+    w = pair_features.weight_vector(vocabulary, weights)
+    expected = df.apply(tfidf_word_match_share, axis=1, raw=False, args=(weights,)).values
+    # The last pair only has words seen once, weighing 0
+    assert np.isnan(expected[-1])
+    np.testing.assert_allclose(pair_features.tfidf_word_match_share(q1, q2, w), expected)
+
+
+@pytest.mark.parametrize('analyzer, ngram_range', [('word', (1, 1)), ('char_wb', (2, 4))])
+def test_row_cosine(df, analyzer, ngram_range):
+    t1, t2 = pair_features.tfidf_matrices(df['question1'], df['question2'], analyzer, ngram_range)
+    # Dense cosine of the raw rows
+    a, b = t1.toarray(), t2.toarray()
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    expected = np.sum(a * b, axis=1) / np.where(norms == 0, 1, norms)
+    for n_jobs in (1, 2):
+        np.testing.assert_allclose(pair_features.row_cosine(t1, t2, chunk_size=3, n_jobs=n_jobs), expected,
+                                   rtol=1e-5, atol=1e-6)
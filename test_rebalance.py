@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import rebalance
+
+
+# Duplicates of train.csv
+n_pos = 149263
+n_neg = 255027
+
+
+@pytest.fixture
+def labels():
+    return np.concatenate([np.ones(n_pos, dtype=np.int64), np.zeros(n_neg, dtype=np.int64)])
+
+
+def test_negative_weight(labels):
+    expected = n_pos * (1 - 0.165) / (0.165 * n_neg)
+    assert rebalance.negative_weight(labels) == pytest.approx(expected)
+    assert rebalance.negative_weight(labels, p=0.175) == pytest.approx(n_pos * 0.825 / (0.175 * n_neg))
+
+
+@pytest.mark.parametrize('p', [rebalance.TARGET_SHARE, 0.175, 0.3])
+def test_weighted_share(labels, p):
+    weights = rebalance.sample_weights(labels, p)
+    assert weights.dtype == np.float32
+    assert np.all(weights[labels == 1] == 1)
+    assert rebalance.effective_share(labels, weights) == pytest.approx(p, abs=1e-6)
+
+
+def test_weighted_share_shuffled():
+    labels = (np.random.RandomState(0).rand(10000) < 0.369).astype(np.int64)
+    weights = rebalance.sample_weights(labels)
+    assert rebalance.effective_share(labels, weights) == pytest.approx(0.165, abs=1e-6)
+
+
+def test_notebook_weight(labels):
+    # The oversampling loop of xgboost.ipynb: scale = 0.369 / 0.165 - 1 =
+    # 1.236, one doubling and 0.236 of a third copy of the negative rows
+    scale = n_pos / float(n_pos + n_neg) / 0.165 - 1
+    assert rebalance.notebook_weight(labels) == pytest.approx(2 * scale)
+    # Positive share printed by the notebook after the loop, up to the
+    # int() of its last partial copy
+    weights = rebalance.sample_weights(labels, neg_weight=rebalance.notebook_weight(labels))
+    assert rebalance.effective_share(labels, weights) == pytest.approx(0.19124366100096607, rel=1e-5)
+
+
+def test_oversample_index(labels):
+    index = rebalance.oversample_index(labels, rng=np.random.RandomState(0))
+    assert np.mean(labels[index] == 1) == pytest.approx(0.165, abs=1e-5)
+    assert np.sum(labels[index] == 1) == n_pos
+
+
+def test_class_weights(labels):
+    weights = rebalance.class_weights(labels)
+    assert weights[0] == rebalance.CLASS_WEIGHT[1]
+    assert weights[-1] == rebalance.CLASS_WEIGHT[0]
+    np.testing.assert_array_equal(rebalance.class_weights(labels, re_weight=False), 1)
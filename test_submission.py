@@ -0,0 +1,28 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+
+import submission
+
+
+def test_format_rows():
+    rng = np.random.RandomState(0)
+    ids = np.concatenate([[0, 9, 10, 123456789012], rng.randint(0, 3000000, 1000)])
+    preds = np.concatenate([[0, 1, 0.99999999, 1e-15], rng.rand(1000) ** 4])
+    expected = ''.join('%d,%.6e\n' % (i, p) for i, p in zip(ids, preds))
+    assert submission.format_rows(ids, preds) == expected
+    assert submission.format_rows([], []) == ''
+    # Too small for 2 exponent digits
+    assert submission.format_rows([3], [5e-300]) == '3,0.000000e+00\n'
+
+
+def test_write_submission(tmpdir):
+    ids = np.arange(1000)
+    preds = np.random.RandomState(0).rand(1000)
+    path = submission.write_submission(ids, preds, 0.3, 'test', str(tmpdir), compress=True, chunk_size=300)
+    with gzip.open(path, 'rt') as f:
+        df = pd.read_csv(f)
+    assert list(df.columns) == ['test_id', 'is_duplicate']
+    np.testing.assert_array_equal(df['test_id'].values, ids)
+    np.testing.assert_allclose(df['is_duplicate'].values, preds, rtol=1e-6)
@@ -0,0 +1,143 @@
+"""
+On-demand TF trace capture of a range of training steps.
+
+    PROFILE_STEPS=100:110 python sample_LSTM.py
+    PROFILE_STEPS=100:110 PROFILE_DIR=profile_cnn/ python sample_cnn.py
+
+traces training batches 100 to 109 (counted over the whole run, end
+exclusive) of any of the model scripts, or of anything going through
+train_pair.fit(). For every traced step it writes
+    <PROFILE_DIR>/timeline_step<N>.json   chrome://tracing timeline
+    <PROFILE_DIR>/events.out.tfevents.*   graph + run metadata, load offline
+                                          with tensorboard --logdir PROFILE_DIR
+and, after the last one, prints the ops that took the most time.
+
+Tracing is switched on through the RunOptions handed to the Keras training
+function, so the steps outside the range run untraced.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import re
+import json
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+from keras import backend as K
+from keras.callbacks import Callback
+
+
+#
+# Collect op times
+# ----------------------------------------------------------------------------
+def op_times(run_metadata):
+    # {(op type, node name): microseconds} of one traced step
+    times = defaultdict(int)
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node in dev_stats.node_stats:
+            # timeline_label looks like 'name = OpType(inputs)'
+            match = re.match(r'\S+ = (\w+)', node.timeline_label)
+            op_type = match.group(1) if match else node.node_name
+            times[(op_type, node.node_name)] += node.all_end_rel_micros
+    return times
+
+
+def print_top_ops(times, n_steps, top=20):
+    by_type = defaultdict(int)
+    for (op_type, _), micros in times.items():
+        by_type[op_type] += micros
+    total = float(sum(by_type.values())) or 1.
+
+    print('Top ops by type over %d traced steps (ms per step):' % n_steps)
+    for op_type, micros in sorted(by_type.items(), key=lambda kv: -kv[1])[:top]:
+        print('  %-32s %10.2f %5.1f%%' % (op_type, micros / 1000. / max(n_steps, 1), 100 * micros / total))
+
+    print('Top ops by node (ms per step):')
+    for (op_type, name), micros in sorted(times.items(), key=lambda kv: -kv[1])[:top]:
+        print('  %-60s %-20s %10.2f' % (name[-60:], op_type, micros / 1000. / n_steps))
+
+
+#
+# Callback
+# ----------------------------------------------------------------------------
+class ProfileSteps(Callback):
+
+    def __init__(self, start, stop, log_dir='profile/'):
+        super(ProfileSteps, self).__init__()
+        self.start = start
+        self.stop = stop
+        self.log_dir = log_dir
+        self.run_options = tf.RunOptions(trace_level=tf.RunOptions.NO_TRACE)
+        self.run_metadata = tf.RunMetadata()
+        self.step = 0
+        self.traced = 0
+        self.times = defaultdict(int)
+        self.writer = None
+
+    def attach(self, model):
+        # Must run before the training function is built (before model.fit)
+        model._function_kwargs = dict(getattr(model, '_function_kwargs', None) or {},
+                                      options=self.run_options, run_metadata=self.run_metadata)
+        model.train_function = None
+
+    def _set_trace(self, trace_level):
+        self.run_options.trace_level = trace_level
+        # Keras 2.2 copies the options into a cached session callable
+        if getattr(self.model.train_function, '_callable_fn', None) is not None:
+            self.model.train_function._callable_fn = None
+
+    def on_batch_begin(self, batch, logs=None):
+        if self.step == self.start:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            self.writer = tf.summary.FileWriter(self.log_dir, K.get_session().graph)
+            self._set_trace(tf.RunOptions.FULL_TRACE)
+            print('Tracing steps %d to %d into %s' % (self.start, self.stop - 1, self.log_dir))
+
+    def on_batch_end(self, batch, logs=None):
+        if self.start <= self.step < self.stop:
+            trace = timeline.Timeline(self.run_metadata.step_stats)
+            with open(os.path.join(self.log_dir, 'timeline_step%d.json' % self.step), 'w') as f:
+                f.write(trace.generate_chrome_trace_format())
+            self.writer.add_run_metadata(self.run_metadata, 'step%d' % self.step, self.step)
+            for key, micros in op_times(self.run_metadata).items():
+                self.times[key] += micros
+            self.traced += 1
+            # session.run merges into the proto, start each step empty
+            self.run_metadata.Clear()
+
+            if self.step == self.stop - 1:
+                self._finish()
+        self.step += 1
+
+    def on_train_end(self, logs=None):
+        if self.writer is not None:
+            self._finish()
+
+    def _finish(self):
+        self._set_trace(tf.RunOptions.NO_TRACE)
+        self.writer.close()
+        self.writer = None
+
+        # Steps actually traced, training may end inside the range
+        n_steps = self.traced
+        print_top_ops(self.times, n_steps)
+        summary = [{'op_type': op_type, 'node': name, 'micros': micros}
+                   for (op_type, name), micros in sorted(self.times.items(), key=lambda kv: -kv[1])]
+        with open(os.path.join(self.log_dir, 'top_ops.json'), 'w') as f:
+            json.dump({'steps': [self.start, self.start + n_steps], 'ops': summary}, f, indent=1)
+
+
+def from_env(default_dir='profile/'):
+    # ProfileSteps from PROFILE_STEPS=start:stop and PROFILE_DIR, or None
+    steps = os.environ.get('PROFILE_STEPS')
+    if not steps:
+        return None
+    start, stop = [int(s) for s in steps.split(':')]
+    if stop <= start:
+        raise ValueError('PROFILE_STEPS must be start:stop with stop > start, got %r' % steps)
+    return ProfileSteps(start, stop, os.environ.get('PROFILE_DIR', default_dir))
@@ -0,0 +1,193 @@
+"""
+Throughput and resource instrumentation of the pair model training.
+
+ThroughputMonitor appends JSON lines to <STAMP>.metrics.jsonl next to the
+checkpoint:
+    {"event": "batch", ...}  wall time of the batch, time waited for its input
+                              (slicing and feeding the arrays, everything
+                              between two batches) and samples/sec
+    {"event": "epoch", ...}  epoch wall time split into input wait, compute
+                              and validation, samples/sec, peak RSS and CPU
+                              utilisation of the process
+    {"event": "end", ...}     totals of the run
+A run whose wait fraction is high is bound by the input side, not compute.
+
+    python train_monitor.py runs/*.metrics.jsonl
+
+prints the epoch averages of several runs side by side, e.g. to compare the
+LSTM, CNN and advanced LSTM on speed.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import resource
+import multiprocessing
+
+from keras.callbacks import Callback
+
+
+#
+# Process resources
+# ----------------------------------------------------------------------------
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024. * 1024.) if sys.platform == 'darwin' else rss / 1024.
+
+
+def cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+
+def n_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+#
+# Callback
+# ----------------------------------------------------------------------------
+class ThroughputMonitor(Callback):
+
+    def __init__(self, path, info=None, batch_every=1):
+        super(ThroughputMonitor, self).__init__()
+        self.path = path
+        self.info = info or {}
+        # Write one batch record out of every batch_every batches
+        self.batch_every = batch_every
+        self.f = None
+
+    def _write(self, record):
+        record['time'] = time.time()
+        self.f.write(json.dumps(record) + '\n')
+
+    def on_train_begin(self, logs=None):
+        self.f = open(self.path, 'a')
+        self.train_start = time.time()
+        self.train_cpu = cpu_seconds()
+        self.total_samples = 0
+        self.n_cpus = n_cpus()
+        record = {'event': 'begin', 'pid': os.getpid(), 'n_cpus': self.n_cpus}
+        record.update(self.info)
+        self._write(record)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.current_epoch = epoch
+        self.epoch_start = time.time()
+        self.epoch_cpu = cpu_seconds()
+        self.last_batch_end = self.epoch_start
+        self.wait_time = 0.
+        self.compute_time = 0.
+        self.samples = 0
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.time()
+
+    def on_batch_end(self, batch, logs=None):
+        now = time.time()
+        logs = logs or {}
+        size = logs.get('size', 0)
+        wait = self.batch_start - self.last_batch_end
+        compute = now - self.batch_start
+        self.last_batch_end = now
+        self.wait_time += wait
+        self.compute_time += compute
+        self.samples += size
+
+        if batch % self.batch_every == 0:
+            self._write({'event': 'batch',
+                         'epoch': self.current_epoch,
+                         'batch': batch,
+                         'size': int(size),
+                         'wait': wait,
+                         'compute': compute,
+                         'samples_per_sec': size / max(wait + compute, 1e-9),
+                         'loss': float(logs.get('loss', float('nan')))})
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.time()
+        wall = now - self.epoch_start
+        train_wall = self.last_batch_end - self.epoch_start
+        self.total_samples += self.samples
+
+        record = {'event': 'epoch',
+                  'epoch': epoch,
+                  'wall': wall,
+                  'wait': self.wait_time,
+                  'compute': self.compute_time,
+                  'validation': now - self.last_batch_end,
+                  'wait_fraction': self.wait_time / max(train_wall, 1e-9),
+                  'samples': int(self.samples),
+                  'samples_per_sec': self.samples / max(train_wall, 1e-9),
+                  'peak_rss_mb': peak_rss_mb(),
+                  'cpu_util': (cpu_seconds() - self.epoch_cpu) / max(wall * self.n_cpus, 1e-9)}
+        for k, v in (logs or {}).items():
+            record[k] = float(v)
+        self._write(record)
+        self.f.flush()
+
+    def on_train_end(self, logs=None):
+        wall = time.time() - self.train_start
+        self._write({'event': 'end',
+                     'wall': wall,
+                     'samples': int(self.total_samples),
+                     'samples_per_sec': self.total_samples / max(wall, 1e-9),
+                     'peak_rss_mb': peak_rss_mb(),
+                     'cpu_util': (cpu_seconds() - self.train_cpu) / max(wall * self.n_cpus, 1e-9)})
+        self.f.close()
+
+
+#
+# Compare runs
+# ----------------------------------------------------------------------------
+def summarize(path):
+    epochs = []
+    info = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['event'] == 'begin':
+                info = record
+            elif record['event'] == 'epoch':
+                epochs.append(record)
+    if not epochs:
+        return None
+
+    def mean(key):
+        return sum(e[key] for e in epochs) / len(epochs)
+
+    return {'path': path,
+            'arch': info.get('arch', '?'),
+            'n_cpus': info.get('n_cpus'),
+            'epochs': len(epochs),
+            'epoch_wall': mean('wall'),
+            'samples_per_sec': mean('samples_per_sec'),
+            'wait_fraction': mean('wait_fraction'),
+            'cpu_util': mean('cpu_util'),
+            'peak_rss_mb': max(e['peak_rss_mb'] for e in epochs),
+            'best_val_loss': min(e.get('val_loss', float('inf')) for e in epochs)}
+
+
+def main(paths):
+    print('%-14s %5s %6s %10s %11s %6s %6s %9s %8s  %s' % (
+        'arch', 'cpus', 'epochs', 'epoch (s)', 'samples/s', 'wait', 'cpu', 'rss (MB)', 'val', 'file'))
+    for path in paths:
+        s = summarize(path)
+        if s is None:
+            continue
+        print('%-14s %5s %6d %10.1f %11.0f %5.1f%% %5.1f%% %9.0f %8.4f  %s' % (
+            s['arch'], s['n_cpus'], s['epochs'], s['epoch_wall'], s['samples_per_sec'],
+            100 * s['wait_fraction'], 100 * s['cpu_util'], s['peak_rss_mb'], s['best_val_loss'],
+            os.path.basename(path)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
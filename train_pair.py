@@ -0,0 +1,247 @@
+"""
+Training, scoring and submission helpers shared by the question-pair scripts.
+
+run_fold() trains one model on one CV fold and writes, next to the best
+weights, the sampled parameters, the out-of-fold predictions of the
+validation pairs and (optionally) the test submission.
+
+Training state is checkpointed every epoch (see checkpoint.py); a run started
+again in the same out_dir resumes from its last unfinished checkpoint. Speed
+and resource use go to <STAMP>.metrics.jsonl (see train_monitor.py), and
+PROFILE_STEPS=start:stop captures a TF trace of those steps (tf_profile.py).
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import random
+import numpy as np
+
+from keras.callbacks import EarlyStopping
+
+import checkpoint
+import grad_accum
+import pair_data
+import pair_models
+import run_registry
+import submission
+import train_monitor
+import tf_profile
+
+
+#
+# Train the model
+# ----------------------------------------------------------------------------
+def compile_model(model, optimizer='nadam', accum_steps=1, **kwargs):
+    # accum_steps > 1 applies the gradients of that many micro-batches at once
+    # (grad_accum.py), fit() then takes batch_size / accum_steps per step
+    if accum_steps > 1:
+        optimizer = grad_accum.AccumOptimizer(optimizer, accum_steps)
+    model.compile(loss='binary_crossentropy',
+                  optimizer=optimizer,
+                  metrics=['acc'],
+                  **kwargs)
+    return model
+
+
+def resume_or_sample(arch, out_dir='.', test_CVID=None, resume=True):
+    # Returns (params, state): the parameters and training state of the last
+    # unfinished run of this model in out_dir, or freshly sampled parameters
+    found = checkpoint.find_checkpoint(out_dir, arch, test_CVID) if resume else None
+    if found is None:
+        return pair_models.sample_params(arch), None
+    path, state = found
+    print('Resuming %s from epoch %d' % (path, state['epoch']))
+    return state['params'], state
+
+
+def fit(model, data, stamp, out_dir='.', re_weight=True, epochs=200, batch_size=2048, callbacks=None, verbose=1,
+        initial_epoch=0, resume_state=None, info=None, accum_steps=1):
+    # Trains on both question orders of the fold, keeps the best weights by
+    # weighted val_loss and returns (bst_model_path, bst_val_score, hist).
+    # info is stored with the checkpoint (arch, test_CVID, params).
+    # batch_size is the effective batch, run as accum_steps micro-batches
+    # with a model compiled with the same accum_steps.
+    data_1_train, data_2_train, labels_train = pair_data.augment_pairs(
+        data['train_data_1'], data['train_data_2'], data['train_labels'])
+    data_1_valid, data_2_valid, labels_valid = pair_data.augment_pairs(
+        data['valid_data_1'], data['valid_data_2'], data['valid_labels'])
+    weight_val = pair_data.sample_weights(labels_valid, re_weight)
+    class_weight = pair_data.CLASS_WEIGHT if re_weight else None
+
+    early_stopping = EarlyStopping(monitor='val_loss', patience=3)
+    bst_model_path = os.path.join(out_dir, stamp + '.h5')
+    model_checkpoint = checkpoint.ResumableCheckpoint(os.path.join(out_dir, stamp + '.ckpt'), bst_model_path,
+                                                      early_stopping, state=resume_state, info=info)
+    if resume_state is not None:
+        initial_epoch = resume_state['epoch']
+    monitor = train_monitor.ThroughputMonitor(os.path.join(out_dir, stamp + '.metrics.jsonl'), info=info)
+    callbacks = [early_stopping, model_checkpoint, monitor] + (callbacks or [])
+
+    # PROFILE_STEPS=start:stop traces those training steps
+    profiler = tf_profile.from_env(os.path.join(out_dir, 'profile_' + stamp))
+    if profiler is not None:
+        profiler.attach(model)
+        callbacks.append(profiler)
+
+    hist = model.fit([data_1_train, data_2_train],
+                     labels_train,
+                     validation_data=([data_1_valid, data_2_valid], labels_valid, weight_val),
+                     epochs=epochs, initial_epoch=initial_epoch, batch_size=batch_size // accum_steps, shuffle=True,
+                     verbose=verbose,
+                     class_weight=class_weight, callbacks=callbacks)
+
+    # History and best score of the resumed epochs as well
+    hist.history = model_checkpoint.history
+    model.load_weights(bst_model_path)
+    bst_val_score = model_checkpoint.best
+    return bst_model_path, bst_val_score, hist
+
+
+#
+# Predict and score
+# ----------------------------------------------------------------------------
+def predict_pairs(model, data_1, data_2, batch_size=8192, verbose=1):
+    # Average of both question orders
+    preds = model.predict([data_1, data_2], batch_size=batch_size, verbose=verbose)
+    preds += model.predict([data_2, data_1], batch_size=batch_size, verbose=verbose)
+    preds /= 2
+    return preds.ravel()
+
+
+def predict_pairs_encoded(model, data_1, data_2, batch_size=8192, verbose=1):
+    # Same as predict_pairs for a model with a shared 'encoder' and a 'head'
+    # (pair_models.build_cnn with params['shared']): each unique question is
+    # encoded once, then only the head runs on the pairs in both orders
+    encoder = model.get_layer('encoder')
+    head = model.get_layer('head')
+    questions, inverse = np.unique(np.vstack((data_1, data_2)), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    encodings = encoder.predict(questions, batch_size=batch_size, verbose=verbose)
+    if verbose:
+        print('Encoded %d unique questions of %d pairs' % (len(questions), len(data_1)))
+
+    u, v = encodings[inverse[:len(data_1)]], encodings[inverse[len(data_1):]]
+    preds = head.predict(np.hstack((u, v)), batch_size=batch_size, verbose=verbose)
+    preds += head.predict(np.hstack((v, u)), batch_size=batch_size, verbose=verbose)
+    preds /= 2
+    return preds.ravel()
+
+
+def weighted_logloss(labels, preds, re_weight=True, eps=1e-15):
+    # Same weighting as the val_loss monitored during training
+    labels = np.asarray(labels)
+    preds = np.clip(np.asarray(preds, dtype=np.float64), eps, 1 - eps)
+    weights = pair_data.sample_weights(labels, re_weight)
+    losses = -(labels * np.log(preds) + (1 - labels) * np.log(1 - preds))
+    return float(np.sum(weights * losses) / np.sum(weights))
+
+
+#
+# Write the submission
+# ----------------------------------------------------------------------------
+def predict_submission(model, test_data_1, test_data_2, test_ids, bst_val_score, stamp, out_dir='.',
+                       compress=False, chunk_size=200000, preds_path=None, verbose=1):
+    # Predicts the test pairs chunk by chunk and appends them to the
+    # submission as they come, so memory stays flat over the 2.3M pairs.
+    # The memory-mapped test tensors are sliced, not copied. With preds_path
+    # the predictions are also written to a memory-mapped .npy.
+    path = submission.submission_path(bst_val_score, stamp, out_dir, compress)
+    n = len(test_ids)
+    preds_out = None
+    if preds_path is not None:
+        preds_out = np.lib.format.open_memmap(preds_path, mode='w+', dtype=np.float32, shape=(n,))
+
+    with submission.open_submission(path) as f:
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            preds = predict_pairs(model, test_data_1[start:stop], test_data_2[start:stop], verbose=0)
+            submission.write_rows(f, test_ids[start:stop], preds)
+            if preds_out is not None:
+                preds_out[start:stop] = preds
+            if verbose:
+                print('Predicted %d/%d test pairs' % (stop, n))
+
+    if preds_out is not None:
+        preds_out.flush()
+        del preds_out
+    return path
+
+
+#
+# One model on one fold
+# ----------------------------------------------------------------------------
+def run_fold(arch, fold_dir, params=None, out_dir='.', re_weight=True, epochs=200, batch_size=2048,
+             predict_test=True, verbose=1, resume=True, seed=None, registry_dir=None, accum_steps=1):
+    # With registry_dir, a configuration already trained returns its recorded
+    # report instead (see run_registry.py). seed fixes the shuffling order.
+    start = time.time()
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    data = pair_data.load_fold(fold_dir)
+    test_CVID = data['meta']['test_CVID']
+
+    sampled, state = resume_or_sample(arch, out_dir, test_CVID, resume)
+    if state is not None or params is None:
+        params = sampled
+    params = grad_accum.adjust_params(params, accum_steps)
+    stamp = pair_models.make_stamp(arch, params)
+
+    config = None
+    if registry_dir is not None:
+        config = run_registry.make_config(arch, fold_dir, params, seed, re_weight=re_weight, epochs=epochs,
+                                          batch_size=batch_size, predict_test=predict_test, accum_steps=accum_steps)
+        entry = run_registry.lookup(registry_dir, config)
+        if entry is not None:
+            print('%s already trained as %s, using the recorded result' % (stamp, entry['key']))
+            return dict(entry['report'], cached=True)
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+
+    with open(os.path.join(out_dir, stamp + '.json'), 'w') as f:
+        json.dump({'arch': arch, 'test_CVID': test_CVID, 'fold_dir': fold_dir, 'params': params}, f, indent=2)
+
+    model = pair_models.build_model(arch, data['embedding_matrix'], params,
+                                    max_sequence_length=data['meta']['max_sequence_length'])
+    compile_model(model, accum_steps=accum_steps)
+    print(stamp)
+
+    bst_model_path, bst_val_score, hist = fit(model, data, stamp, out_dir=out_dir, re_weight=re_weight,
+                                              epochs=epochs, batch_size=batch_size, verbose=verbose,
+                                              resume_state=state, accum_steps=accum_steps,
+                                              info={'arch': arch, 'test_CVID': test_CVID, 'params': params})
+    train_time = time.time() - start
+
+    oof_preds = predict_pairs(model, data['valid_data_1'], data['valid_data_2'], verbose=verbose)
+    oof_path = os.path.join(out_dir, 'oof_' + stamp + '.npz')
+    np.savez(oof_path, ids=data['valid_ids'], labels=data['valid_labels'], preds=oof_preds)
+
+    report = {'arch': arch,
+              'test_CVID': test_CVID,
+              'fold_dir': fold_dir,
+              'stamp': stamp,
+              'params': params,
+              'bst_model_path': bst_model_path,
+              'bst_val_score': float(bst_val_score),
+              'oof_logloss': weighted_logloss(data['valid_labels'], oof_preds, re_weight),
+              'epochs': len(hist.history['val_loss']),
+              'oof_path': oof_path,
+              'train_time': train_time}
+
+    if predict_test:
+        print('Start making the submission before fine-tuning')
+        report['test_preds_path'] = os.path.join(out_dir, 'test_' + stamp + '.npy')
+        report['submission_path'] = predict_submission(model, data['test_data_1'], data['test_data_2'],
+                                                       data['test_ids'], bst_val_score, stamp, out_dir,
+                                                       preds_path=report['test_preds_path'], verbose=verbose)
+
+    report['total_time'] = time.time() - start
+    if config is not None:
+        report['registry_key'] = run_registry.record(registry_dir, config, report)
+    return report
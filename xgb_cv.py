@@ -0,0 +1,257 @@
+"""
+K-fold xgboost on stored pair features, folds trained in parallel processes.
+
+    python xgb_cv.py --features word_match tfidf_word_match q1_degree q2_degree --folds 5 --out-dir xgb_cv/
+
+The notebooks hold out one train_test_split(test_size=0.2); here every pair
+gets an out-of-fold prediction, for stacking. The feature matrices of the
+store are memory-mapped .npy files, so the workers share them through the
+page cache: each one builds its DMatrix straight from the mapping and slices
+its fold rows out of it, without a numpy copy of the features. The cores
+are split between the concurrent folds as in cv_runner.py, and every fold
+runs xgboost with nthread equal to its share.
+
+Written to --out-dir:
+    folds.npy            fold of every train pair
+    cv<K>/               booster, OOF and test predictions of fold K
+    oof_<STAMP>.csv      out-of-fold predictions of all pairs
+    <SCORE>_cv<N>_<STAMP>.csv   fold-averaged test submission
+    xgb_cv_report.json   scores and per-fold timing
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import argparse
+import traceback
+import numpy as np
+import pandas as pd
+
+import cv_runner
+import data_paths
+import feature_store
+import rebalance
+import submission
+import xgb_train
+
+
+#
+# Folds
+# ----------------------------------------------------------------------------
+def fold_ids(labels, n_folds=5, seed=4242):
+    # Fold of every row, stratified: each class is shuffled and dealt out
+    # round-robin
+    labels = np.asarray(labels)
+    rng = np.random.RandomState(seed)
+    folds = np.empty(len(labels), dtype=np.int8)
+    for value in np.unique(labels):
+        rows = rng.permutation(np.flatnonzero(labels == value))
+        folds[rows] = np.arange(len(rows)) % n_folds
+    return folds
+
+
+def logloss(labels, preds, weights=None, eps=1e-15):
+    labels = np.asarray(labels)
+    preds = np.clip(np.asarray(preds, dtype=np.float64), eps, 1 - eps)
+    losses = -(labels * np.log(preds) + (1 - labels) * np.log(1 - preds))
+    return float(np.average(losses, weights=weights))
+
+
+#
+# Train one fold
+# ----------------------------------------------------------------------------
+def run_fold(fold, x_path, labels_path, folds_path, out_dir, params, rounds=400, early_stopping_rounds=50,
+             p=rebalance.TARGET_SHARE, test_path=None, chunk_size=200000, verbose_eval=50):
+    import xgboost as xgb
+
+    start = time.time()
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    x = np.load(x_path, mmap_mode='r')
+    labels = np.load(labels_path, mmap_mode='r')
+    folds = np.load(folds_path, mmap_mode='r')
+    valid_idx = np.flatnonzero(folds == fold)
+    train_idx = np.flatnonzero(folds != fold)
+
+    # One DMatrix read from the mapping, labels and weights set once, then
+    # sliced into the fold rows
+    full = xgb.DMatrix(x, label=labels, weight=rebalance.sample_weights(labels, p), nthread=params['nthread'])
+    d_train = full.slice(train_idx)
+    d_valid = full.slice(valid_idx)
+    del full
+    load_time = time.time() - start
+
+    timer = xgb_train.RoundTimer(every=0)
+    bst = xgb.train(params, d_train, rounds, [(d_train, 'train'), (d_valid, 'valid')],
+                    early_stopping_rounds=early_stopping_rounds, verbose_eval=verbose_eval, callbacks=[timer])
+    train_time = time.time() - start - load_time
+    iteration_range = (0, bst.best_iteration + 1)
+    model_path = os.path.join(out_dir, 'model.ubj')
+    bst.save_model(model_path)
+
+    oof_path = os.path.join(out_dir, 'oof.npz')
+    np.savez(oof_path, rows=valid_idx, preds=bst.predict(d_valid, iteration_range=iteration_range))
+
+    report = {'fold': fold,
+              'best_iteration': int(bst.best_iteration),
+              'valid_logloss': float(bst.best_score),
+              'rounds': len(timer.times),
+              'rounds_per_sec': timer.rounds_per_sec(),
+              'nthread': params['nthread'],
+              'load_time': load_time,
+              'train_time': train_time,
+              'model_path': model_path,
+              'oof_path': oof_path}
+
+    if test_path:
+        predict_start = time.time()
+        report['test_preds_path'] = os.path.join(out_dir, 'test_preds.npy')
+        xgb_train.predict_rows(bst, np.load(test_path, mmap_mode='r'), chunk_size, params['nthread'],
+                               iteration_range, report['test_preds_path'])
+        report['predict_time'] = time.time() - predict_start
+    return report
+
+
+def _fold_worker(key, job, cpus, queue):
+    try:
+        # xgboost is already loaded (xgb_train), its threads are limited by
+        # the nthread parameter
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+        job['params'] = dict(job['params'], nthread=len(cpus))
+        report = run_fold(**job)
+        report['cpus'] = cpus
+        queue.put((key, report, None))
+    except Exception:
+        queue.put((key, None, traceback.format_exc()))
+
+
+#
+# Collect the fold results
+# ----------------------------------------------------------------------------
+def collect(reports, pair_ids, labels, weights, out_dir, stamp, test_ids=None):
+    # pair_ids: the id column of the train pairs, written with the OOF
+    # predictions so that they join the other models' on it
+    preds = np.full(len(labels), np.nan)
+    for r in reports:
+        oof = np.load(r['oof_path'])
+        preds[oof['rows']] = oof['preds']
+    done = ~np.isnan(preds)
+    oof_path = os.path.join(out_dir, 'oof_' + stamp + '.csv')
+    pd.DataFrame({'id': pair_ids[done], 'is_duplicate': labels[done], 'pred': preds[done]}).to_csv(
+        oof_path, index=False, columns=['id', 'is_duplicate', 'pred'])
+
+    scores = [r['valid_logloss'] for r in reports]
+    summary = {'stamp': stamp,
+               'folds': reports,
+               'mean_logloss': float(np.mean(scores)),
+               'std_logloss': float(np.std(scores)),
+               'oof_logloss': logloss(labels[done], preds[done], weights[done]),
+               'oof_path': oof_path}
+
+    test_paths = [r['test_preds_path'] for r in reports if 'test_preds_path' in r]
+    if test_paths and test_ids is not None:
+        # Running sum over the memory-mapped fold predictions
+        test_preds = np.zeros(len(test_ids), dtype=np.float64)
+        for path in test_paths:
+            test_preds += np.load(path, mmap_mode='r')
+        test_preds /= len(test_paths)
+        summary['submission_path'] = submission.write_submission(
+            test_ids, test_preds, summary['oof_logloss'], 'cv%d_' % len(test_paths) + stamp, out_dir)
+    return summary
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='K-fold xgboost on stored pair features, folds in parallel.')
+    parser.add_argument('--features', nargs='+', default=['word_match', 'tfidf_word_match'])
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--out-dir', default='xgb_cv/')
+    parser.add_argument('--rounds', type=int, default=400)
+    parser.add_argument('--early-stopping', type=int, default=50)
+    parser.add_argument('--eta', type=float, default=xgb_train.XGB_PARAMS['eta'])
+    parser.add_argument('--max-depth', type=int, default=xgb_train.XGB_PARAMS['max_depth'])
+    parser.add_argument('--max-bin', type=int, default=xgb_train.XGB_PARAMS['max_bin'])
+    parser.add_argument('--seed', type=int, default=4242)
+    parser.add_argument('--p', type=float, default=rebalance.TARGET_SHARE, help='positive share to rebalance to')
+    parser.add_argument('--min-threads', type=int, default=2, help='fewest cores given to one fold')
+    parser.add_argument('--scaling', type=float, default=0.8, help='assumed exponent of per-fold thread scaling')
+    parser.add_argument('--train-file', default=feature_store.TRAIN_FILE)
+    parser.add_argument('--test-file', default=feature_store.TEST_FILE)
+    parser.add_argument('--store-dir', default=feature_store.STORE_DIR)
+    parser.add_argument('--no-test', action='store_true', help='skip the test set predictions')
+    parser.add_argument('--chunk-size', type=int, default=200000, help='test pairs per DMatrix')
+    args = parser.parse_args()
+
+    start = time.time()
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    # Every store file the workers need exists before they start, so they
+    # only read memory-mapped arrays
+    data_key = data_paths.data_hash([args.train_file, args.test_file])
+    store = (args.train_file, args.test_file, args.store_dir, data_key)
+    feature_store.get_matrix(args.features, 'train', *store)
+    data_dir = feature_store.ensure(args.features, *store)
+    labels = np.asarray(feature_store.get_column('is_duplicate', 'train', *store))
+    pair_ids = np.asarray(feature_store.get_column('id', 'train', *store))
+    test_ids = None
+    if not args.no_test:
+        feature_store.get_matrix(args.features, 'test', *store)
+        test_ids = feature_store.get_column('test_id', 'test', *store)
+
+    folds_path = os.path.join(args.out_dir, 'folds.npy')
+    feature_store.atomic_save(folds_path, fold_ids(labels, args.folds, args.seed))
+
+    key = feature_store.matrix_key(args.features)
+    params = dict(xgb_train.XGB_PARAMS, eta=args.eta, max_depth=args.max_depth, max_bin=args.max_bin, seed=args.seed)
+    stamp = 'xgb_%d_%.3f_%s' % (args.max_depth, args.eta, key)
+    print(stamp)
+
+    jobs = [('cv%d' % fold, {'fold': fold,
+                             'x_path': os.path.join(data_dir, 'matrix_%s.train.npy' % key),
+                             'labels_path': os.path.join(data_dir, 'raw_is_duplicate.train.npy'),
+                             'folds_path': folds_path,
+                             'out_dir': os.path.join(args.out_dir, 'cv%d' % fold),
+                             'params': params,
+                             'rounds': args.rounds,
+                             'early_stopping_rounds': args.early_stopping,
+                             'p': args.p,
+                             'chunk_size': args.chunk_size,
+                             'test_path': None if args.no_test else os.path.join(data_dir,
+                                                                                  'matrix_%s.test.npy' % key)})
+            for fold in range(args.folds)]
+    slots = cv_runner.plan_slots(len(jobs), cv_runner.available_cpus(), args.min_threads, args.scaling)
+    print('Running %d folds on %d slots of %d cpus' % (len(jobs), len(slots), len(slots[0])))
+
+    results = cv_runner.run_jobs(jobs, _fold_worker, slots)
+    failed = [k for k, (_, error) in results.items() if error]
+    reports = [results[k][0] for k, _ in jobs if not results[k][1]]
+
+    weights = rebalance.sample_weights(labels, args.p)
+    summary = {'stamp': stamp}
+    if reports:
+        summary = collect(reports, pair_ids, labels, weights, args.out_dir, stamp, test_ids)
+    summary['features'] = list(args.features)
+    summary['failed'] = failed
+    summary['wall_time'] = time.time() - start
+    with open(os.path.join(args.out_dir, 'xgb_cv_report.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    for report in reports:
+        print('cv%d: %.4f at round %d (%d threads, %.0fs loading, %.0fs boosting, %.1f rounds/s)' % (
+            report['fold'], report['valid_logloss'], report['best_iteration'], report['nthread'],
+            report['load_time'], report['train_time'], report['rounds_per_sec']))
+    if reports:
+        print('OOF logloss %.4f, mean %.4f +- %.4f, wall time %.0fs' % (
+            summary['oof_logloss'], summary['mean_logloss'], summary['std_logloss'], summary['wall_time']))
+
+
+if __name__ == '__main__':
+    main()
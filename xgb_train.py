@@ -0,0 +1,277 @@
+"""
+Train the xgboost model of the notebooks on stored pair features.
+
+    python xgb_train.py --features word_match tfidf_word_match --nthread 8 --out-dir xgb_runs/
+
+The features come from the feature store (feature_store.py) as memory-mapped
+matrices, the classes are rebalanced to a positive share of --p with sample
+weights (rebalance.py) and --valid-size of the pairs are held out for early
+stopping, as in the notebooks but with tree_method='hist' and --nthread
+threads.
+
+The train and validation DMatrix are saved as xgboost binary files under
+--cache-dir, keyed by the data, features, split and weights, so later runs
+on the same features reload them instead of rebuilding them. Without a cache
+they are built as QuantileDMatrix (xgboost >= 1.7), the validation one
+reusing the quantile sketch of the train one.
+
+Written to --out-dir:
+    <STAMP>.ubj    booster in xgboost's binary (UBJSON) format
+    <STAMP>.json   parameters, features, best round and score, rounds/sec
+    <SCORE>_<STAMP>.csv   test submission, with --predict-test
+
+    python xgb_train.py --predict xgb_runs/<STAMP>.json --chunk-size 100000
+
+only writes the submission of a saved booster. The test features are read
+from the store --chunk-size pairs at a time into small DMatrix objects and
+every chunk of predictions is appended to the csv, so peak memory does not
+grow with the 2.3M test pairs or the number of features.
+"""
+
+
+#
+# Import packages
+# ----------------------------------------------------------------------------
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import xgboost as xgb
+
+import data_paths
+import feature_store
+import rebalance
+import submission
+
+
+XGB_PARAMS = {'objective': 'binary:logistic',
+              'eval_metric': 'logloss',
+              'eta': 0.02,
+              'max_depth': 4,
+              'tree_method': 'hist',
+              'max_bin': 256}
+
+
+#
+# Data
+# ----------------------------------------------------------------------------
+def split_index(n, valid_size=0.2, seed=4242):
+    # (train rows, validation rows), sorted to keep the memory-mapped reads
+    # sequential
+    order = np.random.RandomState(seed).permutation(n)
+    n_valid = int(round(valid_size * n))
+    return np.sort(order[n_valid:]), np.sort(order[:n_valid])
+
+
+def dmatrix_key(names, data_key, index, weights):
+    h = hashlib.sha1()
+    h.update(('%s|%s' % (data_key, feature_store.matrix_key(names))).encode('utf-8'))
+    h.update(np.ascontiguousarray(index).tobytes())
+    h.update(np.ascontiguousarray(weights).tobytes())
+    return h.hexdigest()[:16]
+
+
+def make_dmatrices(x, labels, weights, train_idx, valid_idx, nthread, cache_paths=None):
+    # (d_train, d_valid), reloaded from or saved to cache_paths if given
+    if cache_paths is not None and all(os.path.exists(p) for p in cache_paths):
+        print('Loading cached DMatrix %s' % ', '.join(cache_paths))
+        return tuple(xgb.DMatrix(p, nthread=nthread) for p in cache_paths)
+
+    parts = [(np.asarray(x[idx]), labels[idx], weights[idx]) for idx in (train_idx, valid_idx)]
+    if cache_paths is None and hasattr(xgb, 'QuantileDMatrix'):
+        d_train = xgb.QuantileDMatrix(parts[0][0], label=parts[0][1], weight=parts[0][2], nthread=nthread,
+                                      max_bin=XGB_PARAMS['max_bin'])
+        d_valid = xgb.QuantileDMatrix(parts[1][0], label=parts[1][1], weight=parts[1][2], nthread=nthread,
+                                      ref=d_train)
+        return d_train, d_valid
+
+    dmatrices = tuple(xgb.DMatrix(a, label=l, weight=w, nthread=nthread) for a, l, w in parts)
+    if cache_paths is not None:
+        for d, path in zip(dmatrices, cache_paths):
+            d.save_binary(path + '.tmp%d' % os.getpid())
+            os.replace(path + '.tmp%d' % os.getpid(), path)
+    return dmatrices
+
+
+#
+# Training
+# ----------------------------------------------------------------------------
+class RoundTimer(xgb.callback.TrainingCallback):
+    # Boosting rounds per second, printed every `every` rounds
+
+    def __init__(self, every=50):
+        super(RoundTimer, self).__init__()
+        self.every = every
+        self.times = []
+
+    def before_training(self, model):
+        self.start = time.time()
+        return model
+
+    def after_iteration(self, model, epoch, evals_log):
+        self.times.append(time.time())
+        if self.every and (epoch + 1) % self.every == 0:
+            print('[%d] %.1f rounds/s' % (epoch + 1, self.rounds_per_sec()))
+        return False
+
+    def rounds_per_sec(self):
+        return len(self.times) / max(self.times[-1] - self.start, 1e-9) if self.times else 0.
+
+
+def train(names, out_dir='xgb_runs/', params=None, nthread=None, rounds=400, early_stopping_rounds=50,
+          valid_size=0.2, seed=4242, p=rebalance.TARGET_SHARE, cache_dir='xgb_cache/',
+          train_file=feature_store.TRAIN_FILE, test_file=feature_store.TEST_FILE, store_dir=feature_store.STORE_DIR,
+          verbose_eval=10):
+    start = time.time()
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    params = dict(XGB_PARAMS, **(params or {}))
+    params['nthread'] = nthread or os.cpu_count()
+
+    data_key = data_paths.data_hash([train_file, test_file])
+    x = feature_store.get_matrix(names, 'train', train_file, test_file, store_dir, data_key)
+    labels = np.asarray(feature_store.get_column('is_duplicate', 'train', train_file, test_file, store_dir,
+                                                 data_key))
+    weights = rebalance.sample_weights(labels, p)
+    train_idx, valid_idx = split_index(len(labels), valid_size, seed)
+
+    cache_paths = None
+    if cache_dir:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        cache_paths = [os.path.join(cache_dir, '%s.%s.dmatrix' % (dmatrix_key(names, data_key, idx, weights[idx]),
+                                                                   split))
+                       for idx, split in ((train_idx, 'train'), (valid_idx, 'valid'))]
+    d_train, d_valid = make_dmatrices(x, labels, weights, train_idx, valid_idx, params['nthread'], cache_paths)
+    load_time = time.time() - start
+
+    timer = RoundTimer()
+    bst = xgb.train(params, d_train, rounds, [(d_train, 'train'), (d_valid, 'valid')],
+                    early_stopping_rounds=early_stopping_rounds, verbose_eval=verbose_eval, callbacks=[timer])
+    train_time = time.time() - start - load_time
+
+    stamp = 'xgb_%d_%.3f_%s' % (params['max_depth'], params['eta'], feature_store.matrix_key(names))
+    model_path = os.path.join(out_dir, stamp + '.ubj')
+    bst.save_model(model_path)
+    report = {'stamp': stamp,
+              'features': list(names),
+              'data_key': data_key,
+              'params': params,
+              'p': p,
+              'valid_size': valid_size,
+              'seed': seed,
+              'best_iteration': int(bst.best_iteration),
+              'best_score': float(bst.best_score),
+              'rounds': len(timer.times),
+              'rounds_per_sec': timer.rounds_per_sec(),
+              'load_time': load_time,
+              'train_time': train_time,
+              'model_path': model_path}
+    with open(os.path.join(out_dir, stamp + '.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print('%s: valid logloss %.4f at round %d, %.1f rounds/s (%.0fs loading, %.0fs boosting)' % (
+        stamp, report['best_score'], report['best_iteration'], report['rounds_per_sec'], load_time, train_time))
+    return bst, report
+
+
+#
+# Predict
+# ----------------------------------------------------------------------------
+def load_booster(model_path, nthread=None):
+    bst = xgb.Booster(model_file=model_path)
+    if nthread:
+        bst.set_param({'nthread': nthread})
+    return bst
+
+
+def predict_chunks(bst, x, chunk_size=200000, nthread=None, iteration_range=(0, 0)):
+    # Yields (start, stop, preds) over row chunks of the (memory-mapped) x,
+    # one small DMatrix at a time, so only one chunk of features is ever
+    # copied into xgboost whatever the number of rows and features
+    for start in range(0, len(x), chunk_size):
+        stop = min(start + chunk_size, len(x))
+        d_chunk = xgb.DMatrix(x[start:stop], nthread=nthread or -1)
+        yield start, stop, bst.predict(d_chunk, iteration_range=iteration_range)
+        del d_chunk
+
+
+def predict_rows(bst, x, chunk_size=200000, nthread=None, iteration_range=(0, 0), preds_path=None):
+    # Predictions of all the rows of x, into a memory-mapped .npy with
+    # preds_path
+    if preds_path is None:
+        preds = np.empty(len(x), dtype=np.float32)
+    else:
+        preds = np.lib.format.open_memmap(preds_path, mode='w+', dtype=np.float32, shape=(len(x),))
+    for start, stop, chunk in predict_chunks(bst, x, chunk_size, nthread, iteration_range):
+        preds[start:stop] = chunk
+    if preds_path is not None:
+        preds.flush()
+    return preds
+
+
+def predict_test(bst, report, out_dir='xgb_runs/', train_file=feature_store.TRAIN_FILE,
+                 test_file=feature_store.TEST_FILE, store_dir=feature_store.STORE_DIR, chunk_size=200000,
+                 compress=False, verbose=1):
+    # Streams the test features from the store chunk by chunk and appends
+    # each chunk of predictions to the submission as it comes
+    x_test = feature_store.get_matrix(report['features'], 'test', train_file, test_file, store_dir,
+                                      report['data_key'])
+    test_ids = feature_store.get_column('test_id', 'test', train_file, test_file, store_dir, report['data_key'])
+    path = submission.submission_path(report['best_score'], report['stamp'], out_dir, compress)
+    with submission.open_submission(path) as f:
+        for start, stop, preds in predict_chunks(bst, x_test, chunk_size, report['params']['nthread'],
+                                                 (0, report['best_iteration'] + 1)):
+            submission.write_rows(f, test_ids[start:stop], preds)
+            if verbose:
+                print('Predicted %d/%d test pairs' % (stop, len(test_ids)))
+    return path
+
+
+#
+# Main
+# ----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Train xgboost on stored pair features.')
+    parser.add_argument('--features', nargs='+', default=['word_match', 'tfidf_word_match'])
+    parser.add_argument('--out-dir', default='xgb_runs/')
+    parser.add_argument('--nthread', type=int, default=None, help='default: all cores')
+    parser.add_argument('--rounds', type=int, default=400)
+    parser.add_argument('--early-stopping', type=int, default=50)
+    parser.add_argument('--eta', type=float, default=XGB_PARAMS['eta'])
+    parser.add_argument('--max-depth', type=int, default=XGB_PARAMS['max_depth'])
+    parser.add_argument('--max-bin', type=int, default=XGB_PARAMS['max_bin'])
+    parser.add_argument('--valid-size', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=4242)
+    parser.add_argument('--p', type=float, default=rebalance.TARGET_SHARE, help='positive share to rebalance to')
+    parser.add_argument('--cache-dir', default='xgb_cache/')
+    parser.add_argument('--no-cache', action='store_true', help='build QuantileDMatrix instead of caching')
+    parser.add_argument('--train-file', default=feature_store.TRAIN_FILE)
+    parser.add_argument('--test-file', default=feature_store.TEST_FILE)
+    parser.add_argument('--store-dir', default=feature_store.STORE_DIR)
+    parser.add_argument('--predict-test', action='store_true')
+    parser.add_argument('--predict', metavar='REPORT', default=None,
+                        help='only write the submission of the booster of this <STAMP>.json')
+    parser.add_argument('--chunk-size', type=int, default=200000, help='test pairs per DMatrix')
+    parser.add_argument('--compress', action='store_true', help='gzip the submission')
+    args = parser.parse_args()
+
+    if args.predict:
+        with open(args.predict) as f:
+            report = json.load(f)
+        if args.nthread:
+            report['params']['nthread'] = args.nthread
+        bst = load_booster(report['model_path'], args.nthread)
+    else:
+        params = {'eta': args.eta, 'max_depth': args.max_depth, 'max_bin': args.max_bin}
+        bst, report = train(args.features, args.out_dir, params, args.nthread, args.rounds, args.early_stopping,
+                            args.valid_size, args.seed, args.p, None if args.no_cache else args.cache_dir,
+                            args.train_file, args.test_file, args.store_dir)
+    if args.predict or args.predict_test:
+        print('Submission: %s' % predict_test(bst, report, args.out_dir, args.train_file, args.test_file,
+                                              args.store_dir, args.chunk_size, args.compress))
+
+
+if __name__ == '__main__':
+    main()